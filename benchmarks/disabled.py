@@ -0,0 +1,63 @@
+"""Compare updating disabled fields against a model without the fields
+
+python -m benchmarks.disabled [iterations]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+import mmstats
+
+
+class BareStats(mmstats.MmStats):
+    requests = mmstats.CounterField()
+
+
+class DebugStats(BareStats):
+    queries = mmstats.CounterField(enabled=False)
+    query_time = mmstats.TimerField(enabled=False)
+    last_query = mmstats.DoubleField(enabled=False)
+
+
+def bare(stats):
+    stats.requests.incr()
+
+
+def debug(stats):
+    stats.requests.incr()
+    stats.queries.incr()
+    with stats.query_time:
+        pass
+    stats.last_query = 1.0
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    path = tempfile.mkdtemp()
+    bare_stats = BareStats(path=path, filename='bare.mmstats')
+    debug_stats = DebugStats(path=path, filename='debug.mmstats')
+    enabled_stats = DebugStats(path=path, filename='enabled.mmstats',
+                               enabled=['*'])
+    print 'bare offset:     %d' % bare_stats._offset
+    print 'disabled offset: %d' % debug_stats._offset
+    print 'enabled offset:  %d' % enabled_stats._offset
+
+    results = [
+        ('bare', timeit.timeit(lambda: bare(bare_stats), number=iterations)),
+        ('disabled', timeit.timeit(lambda: debug(debug_stats),
+                                   number=iterations)),
+        ('enabled', timeit.timeit(lambda: debug(enabled_stats),
+                                  number=iterations)),
+    ]
+    for name, elapsed in results:
+        print '%-10s %8.3fus/call' % (name, elapsed / iterations * 1e6)
+
+    bare_stats.remove()
+    debug_stats.remove()
+    enabled_stats.remove()
+    os.rmdir(path)
+
+
+if __name__ == '__main__':
+    main()
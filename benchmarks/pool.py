@@ -0,0 +1,53 @@
+"""Compare per-thread setup with and without the recycled file pool
+
+python -m benchmarks.pool [threads]
+"""
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import mmstats
+
+
+class WorkerStats(mmstats.MmStats):
+    requests = mmstats.CounterField()
+    errors = mmstats.CounterField()
+    latency = mmstats.TimerField()
+    status = mmstats.StringField()
+
+
+def churn(stats, threads):
+    """Returns the mean time spent initializing each thread's model"""
+    elapsed = []
+
+    def work():
+        start = time.time()
+        # First access in a thread initializes the thread's model
+        stats.requests.incr()
+        elapsed.append(time.time() - start)
+
+    for _ in xrange(threads):
+        t = threading.Thread(target=work)
+        t.start()
+        t.join()
+    return sum(elapsed) / len(elapsed)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    path = tempfile.mkdtemp()
+    try:
+        for pool_size in (0, mmstats.DEFAULT_POOL_SIZE):
+            stats = WorkerStats(path=path, pool_size=pool_size,
+                                filename='bench-%d-{TID}.mmstats' % pool_size)
+            mean = churn(stats, threads)
+            print 'pool_size=%-3d %8.1fus/thread' % (pool_size, mean * 1e6)
+            stats.remove()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Compare computing deltas between samples of many files with and without
+NumPy
+
+python -m benchmarks.rates [counts]
+
+`counts` is a comma separated list of numbers of files (defaults to
+1000,10000,100000).
+"""
+import sys
+import tempfile
+import time
+
+import mmstats
+from mmstats import rates, reader
+
+
+class RateStats(mmstats.MmStats):
+    requests = mmstats.CounterField()
+    errors = mmstats.CounterField()
+    connections = mmstats.UIntField()
+    depth = mmstats.IntField()
+    latency = mmstats.DoubleField()
+
+
+def make_sample(layout, values, count, offset):
+    """Return a sample of `count` files with the same layout"""
+    sample = rates.Sample(time=offset)
+    values = [v + offset if isinstance(v, (int, long, float)) else v
+              for v in values]
+    for i in xrange(count):
+        sample.add('bench-%d.mmstats' % i, layout, values)
+    return sample
+
+
+def timed(prev, cur):
+    """Returns seconds to compute the totals of deltas from prev to cur"""
+    start = time.time()
+    rates.deltas(prev, cur).totals()
+    return time.time() - start
+
+
+def main():
+    counts = [1000, 10000, 100000]
+    if len(sys.argv) > 1:
+        counts = [int(c) for c in sys.argv[1].split(',')]
+
+    stats = RateStats(path=tempfile.gettempdir(),
+                      filename='bench-rates.mmstats')
+    try:
+        layout = reader.get_layout(stats._mmap)
+        values = layout.values(stats._mmap)
+    finally:
+        stats.remove()
+
+    numpy = rates.numpy
+    print '%8s %12s %12s' % ('files', 'numpy', 'python')
+    for count in counts:
+        prev = make_sample(layout, values, count, 0)
+        cur = make_sample(layout, values, count, 1)
+        numpy_time = timed(prev, cur) if numpy is not None else float('nan')
+        rates.numpy = None
+        try:
+            python_time = timed(prev, cur)
+        finally:
+            rates.numpy = numpy
+        print '%8d %11.3fs %11.3fs' % (count, numpy_time, python_time)
+
+
+if __name__ == '__main__':
+    main()
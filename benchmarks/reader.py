@@ -0,0 +1,88 @@
+"""Compare reads/sec of the streaming reader, layout caching reader, and
+snapshots, single field lookups in version 1 and 2 files, and reading only
+changed fields
+
+python -m benchmarks.reader [fields] [seconds]
+"""
+import shutil
+import sys
+import tempfile
+import time
+
+import mmstats
+from mmstats import reader
+
+
+def make_model(num_fields):
+    """Return a model class with `num_fields` mixed fields"""
+    types = [mmstats.CounterField, mmstats.UIntField, mmstats.DoubleField,
+             mmstats.BoolField, mmstats.StaticUInt64Field]
+    attrs = {}
+    for i in xrange(num_fields):
+        cls = types[i % len(types)]
+        if cls is mmstats.StaticUInt64Field:
+            attrs['f%d' % i] = cls(label='bench.f%d' % i, value=i)
+        else:
+            attrs['f%d' % i] = cls(label='bench.f%d' % i)
+    return type('BenchStats', (mmstats.BaseMmStats,), attrs)
+
+
+def rate(func, seconds):
+    """Returns calls/sec of `func` over roughly `seconds`"""
+    count = 0
+    start = time.time()
+    deadline = start + seconds
+    while time.time() < deadline:
+        func()
+        count += 1
+    return count / (time.time() - start)
+
+
+def main():
+    num_fields = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    path = tempfile.mkdtemp()
+    try:
+        stats = make_model(num_fields)(path=path, filename='bench.mmstats')
+
+        def streaming():
+            list(reader.MmStatsReader.from_mmap(stats.filename))
+
+        layout_reader = reader.LayoutReader.from_mmap(stats.filename)
+
+        print '%d fields, %d bytes' % (num_fields, stats._offset)
+        print 'MmStatsReader %10.1f reads/sec' % rate(streaming, seconds)
+        print 'LayoutReader  %10.1f reads/sec' % rate(layout_reader.read,
+                                                      seconds)
+        print 'snapshot()    %10.1f reads/sec' % rate(layout_reader.snapshot,
+                                                      seconds)
+        layout_reader.close()
+
+        # Look up the last field which is the worst case for a scan
+        label = 'bench.f%d' % (num_fields - 1)
+        indexed = make_model(num_fields)(path=path, filename='bench2.mmstats',
+                                         version=2)
+        for name, s in (('v1', stats), ('v2', indexed)):
+            print 'read_value() %s %9.1f reads/sec' % (name, rate(
+                lambda: reader.read_value(s._mmap, label), seconds))
+        indexed.remove()
+
+        # One field is written between each read of the changes
+        tracked = make_model(num_fields)(path=path, filename='bench3.mmstats',
+                                         version=2, track_changes=True)
+        changes_reader = reader.LayoutReader.from_mmap(tracked.filename,
+                                                       writable=True)
+
+        def one_change():
+            tracked.f1 = 1
+            changes_reader.read_changes()
+        print 'read_changes()%10.1f reads/sec' % rate(one_change, seconds)
+        changes_reader.close()
+        tracked.remove()
+        stats.remove()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Compare scanning many files sequentially, with threads, and with processes
+
+python -m benchmarks.scan [counts] [workers]
+
+`counts` is a comma separated list of numbers of files (defaults to
+1000,10000,50000) and `workers` defaults to the number of CPUs.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import mmstats
+from mmstats import scan
+
+
+class ScanStats(mmstats.MmStats):
+    requests = mmstats.CounterField()
+    errors = mmstats.CounterField()
+    latency = mmstats.TimerField()
+    depth = mmstats.UIntField()
+    name = mmstats.StringField(size=32)
+
+
+def make_files(path, count):
+    """Create `count` copies of a stats file in `path`"""
+    stats = ScanStats(path=path, filename='template.mmstats')
+    stats.requests.incr(10)
+    stats.name = 'worker'
+    data = stats._mmap.raw
+    stats.remove()
+    for i in xrange(count):
+        with open(os.path.join(path, 'bench-%d.mmstats' % i), 'wb') as f:
+            f.write(data)
+
+
+def timed(pattern, **kwargs):
+    """Returns seconds to scan every file matching `pattern`"""
+    start = time.time()
+    for fn, stats in scan.scan(pattern, **kwargs):
+        pass
+    return time.time() - start
+
+
+def main():
+    counts = [1000, 10000, 50000]
+    if len(sys.argv) > 1:
+        counts = [int(c) for c in sys.argv[1].split(',')]
+    workers = mmstats.DEFAULT_SCAN_WORKERS
+    if len(sys.argv) > 2:
+        workers = int(sys.argv[2])
+
+    print '%d workers' % workers
+    print '%8s %12s %12s %12s' % ('files', 'sequential', 'threads',
+                                  'processes')
+    for count in counts:
+        path = tempfile.mkdtemp()
+        try:
+            make_files(path, count)
+            pattern = os.path.join(path, 'bench-*.mmstats')
+            print '%8d %11.3fs %11.3fs %11.3fs' % (
+                count,
+                timed(pattern, workers=1),
+                timed(pattern, workers=workers),
+                timed(pattern, workers=workers, processes=True))
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,3 +3,4 @@ version = __version__ = '0.8.0'
 from .defaults import *
 from .fields import *
 from .models import *
+from .process import ProcessStats
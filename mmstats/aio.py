@@ -0,0 +1,310 @@
+"""Non-blocking reading of mmstats files for asyncio event loops
+
+Globbing, opening, and parsing files runs in an executor so scraping
+thousands of files doesn't stall the event loop. Requires asyncio or, on
+Python 2, trollius: ``pip install mmstats[asyncio]``
+
+Functions return futures so they can be used with ``await``, ``yield from``,
+or trollius's ``yield From()``::
+
+    stats = yield From(aio.snapshot_all('/tmp/mmstats-*'))
+"""
+import collections
+import glob
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+from . import defaults, reader, scan
+from .watcher import Watcher
+
+
+try:
+    StopAsyncIteration = StopAsyncIteration
+except NameError:
+    class StopAsyncIteration(Exception):
+        """Raised by :meth:`AsyncScan.fetch` when every file has been read"""
+
+
+def _require_asyncio():
+    if asyncio is None:
+        raise ImportError('mmstats.aio requires asyncio or trollius')
+
+
+def _glob(files):
+    if files is None:
+        files = defaults.DEFAULT_GLOB
+    if isinstance(files, basestring):
+        files = glob.glob(files)
+    return list(files)
+
+
+def _batches(files, batch_size):
+    return [files[i:i + batch_size] for i in xrange(0, len(files), batch_size)]
+
+
+def _read_batch(files, labels, prefixes):
+    results = []
+    for fn in files:
+        stats = scan.read_file(fn, labels, prefixes)
+        if stats is not None:
+            results.append((fn, stats))
+    return results
+
+
+def _snapshot_batch(files, labels, prefixes):
+    results = []
+    for fn in files:
+        try:
+            results.append((fn, reader.snapshot(fn, labels, prefixes)))
+        except Exception:
+            # Unreadable or invalid files are skipped
+            continue
+    return results
+
+
+def _chain(source, result, callback):
+    """Call `callback` with `source`'s result or copy its exception to
+    `result`"""
+    def done(f):
+        if result.done():
+            return
+        if f.cancelled():
+            result.cancel()
+        elif f.exception() is not None:
+            result.set_exception(f.exception())
+        else:
+            callback(f.result())
+    source.add_done_callback(done)
+
+
+def snapshot_all(files=None, labels=None, prefixes=None,
+                 batch_size=defaults.DEFAULT_AIO_BATCH_SIZE, executor=None,
+                 loop=None):
+    """Return a future of a list of (filename, dict of label to value) for
+    every readable file
+
+    `files` is a glob pattern or a list of filenames and defaults to
+    ``MMSTATS_GLOB``. Each file is a consistent copy like
+    :func:`~mmstats.reader.snapshot`. Files are read `batch_size` at a time
+    in `executor` (the loop's default executor if None).
+    """
+    _require_asyncio()
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    result = asyncio.Future(loop=loop)
+
+    def gathered(batches):
+        result.set_result([r for batch in batches for r in batch])
+
+    def globbed(files):
+        batches = [loop.run_in_executor(executor, _snapshot_batch, batch,
+                                        labels, prefixes)
+                   for batch in _batches(files, batch_size)]
+        if batches:
+            _chain(asyncio.gather(*batches), result, gathered)
+        else:
+            result.set_result([])
+
+    _chain(loop.run_in_executor(executor, _glob, files), result, globbed)
+    return result
+
+
+class AsyncScan(object):
+    """Asynchronous iterator of (filename, stats) for every readable file
+
+    ::
+
+        async for fn, stats in aio.AsyncScan('/tmp/mmstats-*'):
+            ...
+
+    `stats` is a list of :class:`~mmstats.reader.Stat` and `labels` and
+    `prefixes` select fields like :meth:`~mmstats.reader.LayoutReader.read`.
+    See :func:`snapshot_all` for the other arguments. Every batch is
+    submitted to the executor up front and files are yielded in batch order.
+    On Python 2 call :meth:`fetch` instead of iterating.
+    """
+
+    def __init__(self, files=None, labels=None, prefixes=None,
+                 batch_size=defaults.DEFAULT_AIO_BATCH_SIZE, executor=None,
+                 loop=None):
+        _require_asyncio()
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.labels = labels
+        self.prefixes = prefixes
+        self.batch_size = batch_size
+        self._executor = executor
+        self._loop = loop
+        # Read results not fetched yet
+        self._results = collections.deque()
+        # Futures of batches being read, None until globbed
+        self._batches = None
+        self._files = loop.run_in_executor(executor, _glob, files)
+
+    def __aiter__(self):
+        return self
+
+    def _globbed(self, files):
+        if self._batches is not None:
+            return
+        self._batches = collections.deque(
+            self._loop.run_in_executor(self._executor, _read_batch, batch,
+                                       self.labels, self.prefixes)
+            for batch in _batches(files, self.batch_size))
+
+    def _fetch(self, result):
+        if result.done():
+            # Cancelled while waiting
+            return
+        if self._results:
+            result.set_result(self._results.popleft())
+        elif self._batches is None:
+            def globbed(files):
+                self._globbed(files)
+                self._fetch(result)
+            _chain(self._files, result, globbed)
+        elif self._batches:
+            def read(stats):
+                self._results.extend(stats)
+                self._fetch(result)
+            _chain(self._batches.popleft(), result, read)
+        else:
+            result.set_exception(StopAsyncIteration())
+
+    def fetch(self):
+        """Return a future of the next (filename, stats)
+
+        The future raises :exc:`StopAsyncIteration` once every file has been
+        read.
+        """
+        result = asyncio.Future(loop=self._loop)
+        self._fetch(result)
+        return result
+
+    __anext__ = fetch
+
+    def cancel(self):
+        """Cancel reading any batches which haven't started"""
+        self._files.cancel()
+        for batch in self._batches or ():
+            batch.cancel()
+
+
+class AsyncWatcher(object):
+    """:class:`~mmstats.watcher.Watcher` for event loops
+
+    The initial scan of `pattern`, updates, and reads run in `executor`.
+    :meth:`wait` uses the loop to watch inotify instead of polling when it's
+    available. Every method waits for the initial scan, which
+    :meth:`started` can also wait for.
+    """
+
+    def __init__(self, pattern=None,
+                 poll_interval=defaults.DEFAULT_WATCH_INTERVAL, inotify=True,
+                 executor=None, loop=None):
+        _require_asyncio()
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self._executor = executor
+        self._loop = loop
+        #: The wrapped :class:`~mmstats.watcher.Watcher`, None until the
+        #: initial scan is done
+        self.watcher = None
+        self._start = loop.run_in_executor(executor, Watcher, pattern,
+                                           poll_interval, inotify)
+        self._start.add_done_callback(self._started)
+
+    def _started(self, f):
+        if not f.cancelled() and f.exception() is None:
+            self.watcher = f.result()
+
+    def _after_start(self, func):
+        """Return a future of the result of the future returned by `func`
+        once the initial scan is done"""
+        result = asyncio.Future(loop=self._loop)
+        _chain(self._start, result,
+               lambda _: _chain(func(), result, result.set_result))
+        return result
+
+    def started(self):
+        """Return a future which completes once the initial scan is
+        done"""
+        result = asyncio.Future(loop=self._loop)
+        _chain(self._start, result, lambda _: result.set_result(None))
+        return result
+
+    @property
+    def readers(self):
+        if self.watcher is None:
+            return {}
+        return self.watcher.readers
+
+    def update(self):
+        """Return a future which completes once changed files are
+        applied"""
+        return self._after_start(lambda: self._loop.run_in_executor(
+            self._executor, self.watcher.update))
+
+    def read(self, labels=None, prefixes=None):
+        """Return a future of a list of (filename, stats) for every readable
+        file
+
+        Like :meth:`~mmstats.watcher.Watcher.read` but :meth:`update` is
+        applied first.
+        """
+        def update_and_read():
+            self.watcher.update()
+            return self.watcher.read(labels, prefixes)
+        return self._after_start(lambda: self._loop.run_in_executor(
+            self._executor, update_and_read))
+
+    def wait(self):
+        """Return a future which completes after files may have been added,
+        removed, or replaced and the registry has been updated
+
+        Without inotify this waits for `poll_interval` seconds.
+        """
+        return self._after_start(self._wait)
+
+    def _wait(self):
+        result = asyncio.Future(loop=self._loop)
+        changed = asyncio.Future(loop=self._loop)
+        fd = self.watcher.fileno()
+        if fd is None:
+            self._loop.call_later(self.watcher.poll_interval,
+                                  changed.set_result, None)
+        else:
+            def readable():
+                # Stop watching until update drains the events
+                self._loop.remove_reader(fd)
+                if not changed.done():
+                    changed.set_result(None)
+            self._loop.add_reader(fd, readable)
+
+            def cancelled(f):
+                if f.cancelled():
+                    self._loop.remove_reader(fd)
+            result.add_done_callback(cancelled)
+        _chain(changed, result,
+               lambda _: _chain(self.update(), result, result.set_result))
+        return result
+
+    def close(self):
+        """Close every file and stop watching"""
+        if self.watcher is None:
+            def started(f):
+                if self.watcher is not None:
+                    self.close()
+            # Close once the initial scan is done
+            self._start.add_done_callback(started)
+            return
+        fd = self.watcher.fileno()
+        if fd is not None:
+            self._loop.remove_reader(fd)
+        self.watcher.close()
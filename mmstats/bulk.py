@@ -0,0 +1,170 @@
+"""NumPy backed bulk reader for analyzing many mmstats files at once
+
+Requires NumPy: ``pip install mmstats[numpy]``
+"""
+import mmap
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from . import reader
+
+
+class Table(object):
+    """Values of every file sharing a layout
+
+    Numeric fields are in `values`, a 2-D array with a row per file and a
+    column per label, so aggregating across files is a single NumPy call::
+
+        table.values[:, table.index('requests')].sum()
+
+    `values` has the common type of every field, which is usually float64.
+    If any integer value can't be exactly represented by a float64 it's an
+    object array of Python numbers instead. :meth:`column` always returns
+    the field's own type.
+
+    String fields are in the `text` dict of label to an array of strings.
+    Ring array fields are not included.
+    """
+
+    def __init__(self, layout, files, labels, values, text, columns=None):
+        self.layout = layout
+        self.files = files
+        self.labels = labels
+        self.values = values
+        self.text = text
+        # label -> column with the field's own dtype
+        self._columns = columns or {}
+        self._index = dict((label, i) for i, label in enumerate(labels))
+
+    def __len__(self):
+        return len(self.files)
+
+    def index(self, label):
+        """Return the column index of `label` in `values`"""
+        return self._index[label]
+
+    def column(self, label):
+        """Return every file's value for `label`"""
+        if label in self.text:
+            return self.text[label]
+        if label in self._columns:
+            return self._columns[label]
+        return self.values[:, self._index[label]]
+
+
+def _numpy_type(type_signature):
+    if type_signature.endswith('s'):
+        return 'S' + type_signature[:-1]
+    # struct and NumPy share type characters for the types mmstats uses
+    return '=' + type_signature
+
+
+def layout_dtype(layout):
+    """Return a NumPy structured dtype for reading records with `layout`
+
+    Buffered fields have a ``wN`` write buffer byte and ``aN`` and ``bN``
+    buffers, unbuffered fields a ``vN`` value where ``N`` is the field's
+    index.
+    """
+    names, formats, offsets = [], [], []
+    for i, f in enumerate(layout.fields):
+        if f.array_size is not None:
+            continue
+        type_ = _numpy_type(f.type_signature)
+        if f.buffered:
+            size = numpy.dtype(type_).itemsize
+            names.extend(('w%d' % i, 'a%d' % i, 'b%d' % i))
+            formats.extend(('u1', type_, type_))
+            offsets.extend((f.offset, f.offset + 1, f.offset + 1 + size))
+        else:
+            names.append('v%d' % i)
+            formats.append(type_)
+            offsets.append(f.offset + 1)
+    return numpy.dtype({'names': names, 'formats': formats,
+                        'offsets': offsets, 'itemsize': layout.end})
+
+
+# Integers with a larger magnitude may not be exactly represented by float64
+_MAX_EXACT = 2 ** 53
+
+
+def _stack(columns):
+    """Return `columns` as a 2-D array of their common type without losing
+    integer precision"""
+    dtype = numpy.result_type(*columns)
+    if dtype.kind == 'f':
+        for column in columns:
+            if column.dtype.kind in 'iu' and column.dtype.itemsize >= 8 and (
+                    column.max() > _MAX_EXACT or column.min() < -_MAX_EXACT):
+                dtype = numpy.dtype(object)
+                break
+    return numpy.column_stack([c.astype(dtype) for c in columns])
+
+
+def build_table(layout, files, bufs):
+    """Build a :class:`Table` from `bufs` which all have `layout`"""
+    raw = numpy.empty((len(bufs), layout.end), dtype='u1')
+    for i, buf in enumerate(bufs):
+        raw[i] = numpy.frombuffer(buf, dtype='u1', count=layout.end)
+    records = raw.view(layout_dtype(layout)).reshape(len(bufs))
+
+    labels, columns, text = [], [], {}
+    for i, f in enumerate(layout.fields):
+        if f.array_size is not None:
+            continue
+        if f.buffered:
+            # Stored buffer is the *write* buffer so read the other one
+            column = numpy.where(records['w%d' % i] == 0,
+                                 records['b%d' % i], records['a%d' % i])
+        else:
+            column = records['v%d' % i]
+        if f.type_signature.endswith('s'):
+            text[f.label] = numpy.array(
+                [reader._decode(v) for v in column], dtype=object)
+        else:
+            labels.append(f.label)
+            columns.append(column)
+
+    if columns:
+        values = _stack(columns)
+    else:
+        values = numpy.empty((len(bufs), 0))
+    return Table(layout, files, labels, values, text,
+                 dict(zip(labels, columns)))
+
+
+def read_tables(filenames):
+    """Read `filenames` into a list of :class:`Table`, one per layout
+
+    Unreadable or invalid files are skipped.
+    """
+    if numpy is None:
+        raise ImportError('mmstats.bulk requires NumPy')
+
+    groups = {}
+    mmaps = []
+    try:
+        for fn in filenames:
+            try:
+                with open(fn, 'rb') as f:
+                    m = mmap.mmap(f.fileno(), 0, prot=mmap.ACCESS_READ)
+            except (IOError, OSError, ValueError):
+                continue
+            mmaps.append(m)
+            try:
+                layout = reader.get_layout(m)
+            except Exception:
+                continue
+            # Files without a stamped fingerprint still group by layout
+            _, files, bufs = groups.setdefault(layout.fingerprint,
+                                               (layout, [], []))
+            files.append(fn)
+            bufs.append(m)
+        return [build_table(layout, files, bufs)
+                for layout, files, bufs in groups.values()]
+    finally:
+        for m in mmaps:
+            m.close()
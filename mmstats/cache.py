@@ -0,0 +1,147 @@
+"""Bounded cache of open readers"""
+import collections
+import os
+import threading
+
+from . import defaults, reader
+
+
+class ReaderCache(object):
+    """LRU cache of open :class:`~mmstats.reader.LayoutReader` keyed by
+    path and inode
+
+    Getting a cached reader costs a single ``stat`` instead of opening and
+    mmapping the file. Files which have been replaced (new inode) or resized
+    are reopened. Readers reparse layouts which have changed on their own.
+    At most `max_size` files are kept open. Deleted files stay open until
+    they're evicted or :meth:`prune` is called.
+
+    Caches are threadsafe. Files are opened and read without holding the
+    cache's lock, so threads only wait on each other to update the cache.
+    """
+
+    def __init__(self, max_size=defaults.DEFAULT_READER_CACHE_SIZE):
+        self.max_size = max_size
+        # (path, inode) -> (reader, size) in least to most recently used order
+        self._readers = collections.OrderedDict()
+        # path -> (path, inode) of its cached reader
+        self._keys = {}
+        self._lock = threading.RLock()
+        # reader -> number of reads in progress
+        self._users = {}
+        # Readers removed from the cache while being read, closed by the
+        # last read
+        self._retired = set()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._readers)
+
+    def _close(self, r):
+        """Close `r` once it isn't being read"""
+        if self._users.get(r):
+            self._retired.add(r)
+        else:
+            r.close()
+
+    def _discard(self, key):
+        r, _ = self._readers.pop(key)
+        del self._keys[key[0]]
+        self._close(r)
+
+    def _get(self, fn, use):
+        st = os.stat(fn)
+        key = (fn, st.st_ino)
+        with self._lock:
+            old_key = self._keys.get(fn)
+            if old_key is not None:
+                r, size = self._readers.pop(old_key)
+                if old_key == key and size == st.st_size:
+                    self.hits += 1
+                    # Move to the most recently used end
+                    self._readers[key] = r, size
+                    if use:
+                        self._users[r] = self._users.get(r, 0) + 1
+                    return r
+                # Replaced or resized
+                self.stale += 1
+                del self._keys[fn]
+                self._close(r)
+            else:
+                self.misses += 1
+
+        # Opened without the lock as it's the slow part of a miss
+        r = reader.LayoutReader.from_mmap(fn)
+        with self._lock:
+            if fn in self._keys:
+                # Another thread cached it while this one was opening it
+                self._discard(self._keys[fn])
+            if use:
+                self._users[r] = 1
+            self._readers[key] = r, st.st_size
+            self._keys[fn] = key
+            while len(self._readers) > self.max_size:
+                self.evictions += 1
+                self._discard(next(iter(self._readers)))
+        return r
+
+    def _release(self, r):
+        with self._lock:
+            users = self._users.pop(r) - 1
+            if users:
+                self._users[r] = users
+            elif r in self._retired:
+                self._retired.discard(r)
+                r.close()
+
+    def get(self, fn):
+        """Return an open reader for `fn`
+
+        The reader is closed if it's evicted, so it shouldn't be kept. Use
+        :meth:`read` to read from several threads. Raises the same
+        exceptions as :meth:`~mmstats.reader.LayoutReader.from_mmap` if `fn`
+        can't be read.
+        """
+        return self._get(fn, False)
+
+    def read(self, fn, labels=None, prefixes=None):
+        """Return a list of :class:`~mmstats.reader.Stat` from `fn`
+
+        `labels` and `prefixes` select fields like
+        :meth:`~mmstats.reader.LayoutReader.read`. Readers evicted by other
+        threads mid-read are closed once the read is done.
+        """
+        r = self._get(fn, True)
+        try:
+            return r.read(labels, prefixes)
+        finally:
+            self._release(r)
+
+    def metrics(self):
+        """Return a dict of cache statistics"""
+        lookups = self.hits + self.misses + self.stale
+        return {
+            'open': len(self._readers),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+        }
+
+    def prune(self):
+        """Close readers of files which no longer exist"""
+        with self._lock:
+            for key in list(self._readers):
+                if not os.path.exists(key[0]):
+                    self._discard(key)
+
+    def clear(self):
+        """Close every cached reader"""
+        with self._lock:
+            for key in list(self._readers):
+                self._discard(key)
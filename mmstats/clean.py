@@ -1,12 +1,31 @@
 import errno
 import glob
+import itertools
 import os
+import struct
 import sys
 
 
 from mmstats import defaults, reader as mmstats_reader
 
 
+def pooled_pid(fn):
+    """Returns the PID of the process which pooled `fn` (named
+    ``.<name>.<pid>.pool``) or None if it isn't a pooled file"""
+    name = os.path.basename(fn)
+    if not (name.startswith('.') and name.endswith('.pool')):
+        return None
+    try:
+        return int(name[:-len('.pool')].rsplit('.', 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def pooled_files(pattern=defaults.DEFAULT_GLOB):
+    """Returns an iterator of pooled files in `pattern`'s directory"""
+    return glob.iglob(os.path.join(os.path.dirname(pattern), '.*.pool'))
+
+
 def clean(files):
     alive, removed = 0, 0
     for fn in files:
@@ -14,21 +33,29 @@ def clean(files):
         if os.path.isdir(fn):
             continue
 
-        try:
-            reader = mmstats_reader.MmStatsReader.from_file(fn)
-        except mmstats_reader.InvalidMmStatsVersion:
-            print 'Invalid file: %s' % fn
-            continue
-        except IOError as e:
-            if e.errno == errno.EACCES:
-                print 'Permission denied: %s' % fn
-            # Other IOErrors aren't even worth mentioning
-            continue
+        # Pooled files are hidden from readers so their name has the pid
+        pid = pooled_pid(fn)
+        if pid is None:
+            try:
+                reader = mmstats_reader.LayoutReader.from_mmap(fn)
+            except (mmstats_reader.InvalidMmStatsVersion, ValueError,
+                    struct.error):
+                # ValueError is raised when mmapping empty files
+                print 'Invalid file: %s' % fn
+                continue
+            except EnvironmentError as e:
+                if e.errno == errno.EACCES:
+                    print 'Permission denied: %s' % fn
+                # Other IOErrors aren't even worth mentioning
+                continue
 
-        pid = None
-        for k, v in reader:
-            if k.endswith('sys.pid'):
-                pid = v
+            # Only read the pid field(s)
+            pid_labels = [label for label in reader.layout.labels
+                          if label.endswith('sys.pid')]
+            if pid_labels:
+                for k, v in reader.read(labels=pid_labels):
+                    pid = v
+            reader.close()
 
         if pid is None:
             print 'File has no sys.pid entry: %s' % fn
@@ -61,7 +88,8 @@ def clean(files):
 
 def cli():
     if len(sys.argv) == 1:
-        clean(glob.iglob(defaults.DEFAULT_GLOB))
+        clean(itertools.chain(glob.iglob(defaults.DEFAULT_GLOB),
+                              pooled_files()))
     else:
         clean(sys.argv[1:])
 
@@ -1,4 +1,5 @@
 import ctypes
+import multiprocessing
 import os
 import tempfile
 
@@ -6,8 +7,35 @@ import tempfile
 BUFFER_IDX_TYPE = ctypes.c_byte
 SIZE_TYPE = ctypes.c_ushort
 WRITE_BUFFER_UNUSED = 255
+# Marks ring array fields in the write buffer byte
+WRITE_BUFFER_ARRAY = 254
 DEFAULT_PATH = os.getenv('MMSTATS_PATH', tempfile.gettempdir())
 DEFAULT_FILENAME = os.getenv('MMSTATS_FILES', '{CMD}-{PID}-{TID}.mmstats')
 DEFAULT_GLOB = os.getenv(
     'MMSTATS_GLOB', os.path.join(DEFAULT_PATH, '*.mmstats'))
 DEFAULT_STRING_SIZE = 255
+# Comma separated label patterns (fnmatch style) to disable or enable
+DEFAULT_DISABLED = os.getenv('MMSTATS_DISABLED', '')
+DEFAULT_ENABLED = os.getenv('MMSTATS_ENABLED', '')
+# Number of released per-thread files kept for reuse per model layout
+DEFAULT_POOL_SIZE = int(os.getenv('MMSTATS_POOL_SIZE', 8))
+# Seconds between samples of callback fields
+DEFAULT_SAMPLE_INTERVAL = 1.0
+# mmap format version new files are written in
+DEFAULT_VERSION = int(os.getenv('MMSTATS_VERSION', 1))
+# Seconds between polls of files waiting for changes. Polls back off from the
+# minimum to the maximum while files are idle.
+DEFAULT_WAIT_MIN_INTERVAL = 0.0001
+DEFAULT_WAIT_MAX_INTERVAL = 0.01
+# Number of threads or processes used to read many files at once
+try:
+    DEFAULT_SCAN_WORKERS = int(os.getenv('MMSTATS_SCAN_WORKERS',
+                                         multiprocessing.cpu_count()))
+except NotImplementedError:
+    DEFAULT_SCAN_WORKERS = 1
+# Seconds between rescans of watched globs when inotify isn't available
+DEFAULT_WATCH_INTERVAL = 1.0
+# Maximum number of files kept open by reader caches
+DEFAULT_READER_CACHE_SIZE = int(os.getenv('MMSTATS_READER_CACHE_SIZE', 1024))
+# Number of files read per executor job by the asyncio API
+DEFAULT_AIO_BATCH_SIZE = 64
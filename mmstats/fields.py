@@ -4,19 +4,35 @@ import math
 import time
 import warnings
 
-from . import defaults
+from . import defaults, sampler
 
 
 # >=2.7 ignores DeprecationWarning by default, mimic that behavior here
 warnings.filterwarnings('ignore', category=DeprecationWarning)
 
 
+def _identity(value):
+    return value
+
+
+def _changed(state):
+    """Flags a write to `state`'s field for readers tracking changes
+
+    Must be called after the value is written.
+    """
+    state.changed.value = 1
+    state.generation.value += 1
+
+
 class DuplicateFieldName(Exception):
     """Cannot add 2 fields with the same name to MmStat instances"""
 
 
-def _create_struct(label, type_, type_signature, buffers=None):
-    """Helper to wrap dynamic Structure subclass creation"""
+def _create_struct(label, type_, type_signature, buffers=None, array=False):
+    """Helper to wrap dynamic Structure subclass creation
+
+    Ring arrays (`array` is True) have `buffers` slots.
+    """
     if isinstance(label, unicode):
         label = label.encode('utf8')
 
@@ -28,6 +44,13 @@ def _create_struct(label, type_, type_signature, buffers=None):
         ('write_buffer', ctypes.c_ubyte),
     ]
 
+    if array:
+        fields.extend([
+            ('write_index', ctypes.c_ushort),
+            ('size', ctypes.c_ushort),
+            ('filled', ctypes.c_ushort),
+        ])
+
     if buffers is None:
         fields.append(('value', type_))
     else:
@@ -39,26 +62,54 @@ def _create_struct(label, type_, type_signature, buffers=None):
             )
 
 
+class _DisabledInternal(object):
+    """No-op stand-in for the internal interface of disabled complex fields"""
+    value = 0
+    values = ()
+    last = 0.0
+    elapsed = 0.0
+
+    def _noop(self, *args, **kwargs):
+        pass
+
+    inc = incr = add = start = stop = append = _noop
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        pass
+
+
+# Shared by every disabled complex field as it has no state
+_disabled_internal = _DisabledInternal()
+
+
 class Field(object):
     initial = 0
 
-    def __init__(self, label=None):
+    def __init__(self, label=None, enabled=True):
         self._struct = None  # initialized in _init
         if label:
             self.label = label
         else:
             self.label = None
+        self.enabled = enabled
+
+    def _label(self, label_prefix, attrname):
+        """Returns the full label for this field"""
+        # Label defaults to attribute name if no label specified
+        if self.label is None:
+            return label_prefix + attrname
+        else:
+            return label_prefix + self.label
 
     def _new(self, state, label_prefix, attrname, buffers=None):
         """Creates new data structure for field in state instance"""
         # Key is used to reference field state on the parent instance
         self.key = attrname
 
-        # Label defaults to attribute name if no label specified
-        if self.label is None:
-            state.label = label_prefix + attrname
-        else:
-            state.label = label_prefix + self.label
+        state.label = self._label(label_prefix, attrname)
         state._StructCls = _create_struct(
                 state.label, self.buffer_type,
                 self.type_signature, buffers)
@@ -76,6 +127,19 @@ class Field(object):
         state._struct.value = self.initial
         return offset + ctypes.sizeof(state._StructCls)
 
+    def _disable(self, state, label_prefix, attrname):
+        """Sets up a field state which takes no space in the mmap"""
+        self.key = attrname
+        state.label = self._label(label_prefix, attrname)
+        state.disabled = True
+        state.size = 0
+        return state.size
+
+    def _disabled_value(self):
+        """Returns the plain class attribute replacing this field when it's
+        disabled"""
+        return self.initial
+
     @property
     def type_signature(self):
         return self.buffer_type._type_
@@ -97,7 +161,10 @@ class DataDescriptorMixin(object):
     """Mixin to add single buffered __set__ method"""
 
     def __set__(self, inst, value):
-        inst._fields[self.key]._struct.value = value
+        state = inst._fields[self.key]
+        state._struct.value = value
+        if state.changed is not None:
+            _changed(state)
 
 
 class BufferedDescriptorMixin(object):
@@ -121,11 +188,13 @@ class BufferedDescriptorMixin(object):
         state._struct.buffers[state._struct.write_buffer] = value
         # Swap the write buffer
         state._struct.write_buffer ^= 1
+        if state.changed is not None:
+            _changed(state)
 
 
 class ReadOnlyField(Field, NonDataDescriptorMixin):
-    def __init__(self, label=None, value=None):
-        super(ReadOnlyField, self).__init__(label=label)
+    def __init__(self, label=None, value=None, **kwargs):
+        super(ReadOnlyField, self).__init__(label=label, **kwargs)
         self.value = value
 
     def _init(self, state, mm, offset):
@@ -133,13 +202,16 @@ class ReadOnlyField(Field, NonDataDescriptorMixin):
             # Value can't be None
             raise ValueError("value must be set")
         elif callable(self.value):
-            # If value is a callable, resolve it now during initialization
-            self.value = self.value()
+            # If value is a callable, resolve it now during initialization.
+            # Resolved per instance as values like the TID vary by thread.
+            value = self.value()
+        else:
+            value = self.value
 
         # Call super to do standard initialization
         new_offset = super(ReadOnlyField, self)._init(state, mm, offset)
         # Set the static field now
-        state._struct.value = self.value
+        state._struct.value = value
 
         # And return the offset as usual
         return new_offset
@@ -179,6 +251,9 @@ class ComplexDoubleBufferedField(DoubleBufferedField):
         self._init_internal(state)
         return offset
 
+    def _disabled_value(self):
+        return _disabled_internal
+
     def _init_internal(self, state):
         if self.InternalClass is None:
             raise NotImplementedError(
@@ -194,6 +269,7 @@ class ComplexDoubleBufferedField(DoubleBufferedField):
 class _InternalFieldInterface(object):
     """Base class used by internal field interfaces like counter"""
     def __init__(self, state):
+        self._state = state
         self._struct = state._struct
 
     @property
@@ -209,12 +285,15 @@ class _InternalFieldInterface(object):
         self._struct.buffers[self._struct.write_buffer] = v
         # Swap the write buffer
         self._struct.write_buffer ^= 1
+        if self._state.changed is not None:
+            _changed(self._state)
 
 
 class CounterField(ComplexDoubleBufferedField):
     """Counter field supporting an inc() method and value attribute"""
     buffer_type = ctypes.c_uint64
-    type_signature = 'Q'
+    # The explicit count marks the field as a counter for readers
+    type_signature = '1Q'
 
     class InternalClass(_InternalFieldInterface):
         """Internal counter class used by CounterFields"""
@@ -230,6 +309,16 @@ class CounterField(ComplexDoubleBufferedField):
             self._set(self.value + amount)
 
 
+class Counter32Field(CounterField):
+    """32-bit counter field which wraps around to 0 past 2**32 - 1
+
+    Takes half the space of a :class:`CounterField`. Rates of wrapped
+    counters are still positive.
+    """
+    buffer_type = ctypes.c_uint32
+    type_signature = '1I'
+
+
 class AverageField(ComplexDoubleBufferedField):
     """Average field supporting an add() method and value attribute"""
     buffer_type = ctypes.c_double
@@ -362,10 +451,166 @@ class TimerField(MovingAverageField):
                 return self._ctx.elapsed
 
 
+class _RingArrayInternal(object):
+    """Internal ring array interface used by RingArrayFields"""
+
+    def __init__(self, state):
+        self._state = state
+        self._struct = state._struct
+        self._slots = state.field.size + 1
+
+    def append(self, value):
+        """Append `value` replacing the oldest value if the array is full"""
+        s = self._struct
+        s.buffers[s.write_index] = value
+        # Readers skip the slot being written so publish it by moving on
+        s.write_index = (s.write_index + 1) % self._slots
+        if s.filled < s.size:
+            s.filled += 1
+        if self._state.changed is not None:
+            _changed(self._state)
+
+    @property
+    def values(self):
+        """List of values oldest first"""
+        s = self._struct
+        idx = s.write_index
+        ordered = s.buffers[idx + 1:] + s.buffers[:idx]
+        return ordered[len(ordered) - s.filled:]
+
+    def __len__(self):
+        return self._struct.filled
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+class RingArrayField(Field):
+    """Array of the last `size` values appended to it
+
+    Appending is O(1) and readers get the values oldest first, so recent raw
+    samples can be published without aggregating them:
+
+    >>> class Latencies(MmStats):
+    ...     recent = RingArrayField(ctypes.c_double, 100)
+    >>> stats = Latencies()
+    >>> stats.recent.append(0.25)
+    >>> stats.recent.values
+    [0.25]
+
+    `type_` is a ctypes integer or floating point type such as
+    ``ctypes.c_uint32``. `size` may be up to 65534.
+    """
+    # Standard size struct codes of integers by their size in bytes
+    _int_codes = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+
+    def __init__(self, type_=ctypes.c_double, size=100, **kwargs):
+        if not 0 < size < 65535:
+            raise ValueError('size must be between 1 and 65534')
+        code = getattr(type_, '_type_', None)
+        if not isinstance(code, str):
+            raise TypeError('type_ must be a simple ctypes type')
+        super(RingArrayField, self).__init__(**kwargs)
+        self.buffer_type = type_
+        self.size = size
+        self._type_signature = self._standard_code(code, ctypes.sizeof(type_))
+
+    def _standard_code(self, code, size):
+        """Returns the struct code with the standard size `size` for ctypes
+        type code `code`
+
+        Readers unpack with standard sizes, where ``l`` is 4 bytes even if
+        the native ``c_long`` is 8.
+        """
+        if code in 'fd':
+            return code
+        if code in 'bBhHiIlLqQ' and size in self._int_codes:
+            int_code = self._int_codes[size]
+            return int_code.upper() if code.isupper() else int_code
+        raise TypeError('type_ must be a ctypes integer or floating point '
+                        'type')
+
+    @property
+    def type_signature(self):
+        return self._type_signature
+
+    def _new(self, state, label_prefix, attrname):
+        self.key = attrname
+        state.label = self._label(label_prefix, attrname)
+        # An extra slot is written to so readers never see partial values
+        state._StructCls = _create_struct(
+                state.label, self.buffer_type, self.type_signature,
+                buffers=self.size + 1, array=True)
+        state.size = ctypes.sizeof(state._StructCls)
+        return state.size
+
+    def _init(self, state, mm_ptr, offset):
+        state._struct = state._StructCls.from_address(mm_ptr + offset)
+        state._struct.label_sz = len(state.label)
+        state._struct.label = state.label
+        state._struct.type_sig_sz = len(self.type_signature)
+        state._struct.type_signature = self.type_signature
+        state._struct.write_buffer = defaults.WRITE_BUFFER_ARRAY
+        state._struct.size = self.size
+        state.internal = _RingArrayInternal(state)
+        return offset + ctypes.sizeof(state._StructCls)
+
+    def _disabled_value(self):
+        return _disabled_internal
+
+    def __get__(self, inst, owner):
+        if inst is None:
+            return self
+        return inst._fields[self.key].internal
+
+
 class BufferedDescriptorField(DoubleBufferedField, BufferedDescriptorMixin):
     """Base class for double buffered descriptor fields"""
 
 
+class CallbackGaugeField(DoubleBufferedField):
+    """64bit Float gauge sampled from `fn` every `interval` seconds
+
+    `fn` is called by a single background thread shared by all callback
+    fields in the process, so publishing values like queue sizes costs
+    nothing per request:
+
+    >>> class QueueStats(MmStats):
+    ...     depth = CallbackGaugeField(work_queue.qsize, interval=0.5)
+
+    Fields may share a :class:`~mmstats.sampler.Source` so its callback is
+    only called once per interval. Then `fn` is passed the source's result
+    and returns the field's value. The source's interval is used.
+    """
+    buffer_type = ctypes.c_double
+
+    def __init__(self, fn, interval=defaults.DEFAULT_SAMPLE_INTERVAL,
+                 source=None, **kwargs):
+        super(CallbackGaugeField, self).__init__(**kwargs)
+        self.fn = fn
+        if source is None:
+            self.source = sampler.Source(fn, interval)
+            self._sampled_value = _identity
+        else:
+            self.source = source
+            self._sampled_value = fn
+
+    def _init(self, state, mm_ptr, offset):
+        offset = super(CallbackGaugeField, self)._init(state, mm_ptr, offset)
+        sampler.register(self.source, self, mm_ptr, state)
+        return offset
+
+    def __get__(self, inst, owner):
+        if inst is None:
+            return self
+        state = inst._fields[self.key]
+        # Get from the read buffer
+        return state._struct.buffers[state._struct.write_buffer ^ 1]
+
+    def __set__(self, inst, value):
+        raise AttributeError("%s is set by its callback" % self.key)
+
+
 class UInt64Field(BufferedDescriptorField):
     """Unbuffered read-only 64bit Unsigned Integer field"""
     buffer_type = ctypes.c_uint64
@@ -435,7 +680,10 @@ class BoolField(ReadWriteField):
         return inst._fields[self.key]._struct.value == 1
 
     def __set__(self, inst, value):
-        inst._fields[self.key]._struct.value = 1 if value else 0
+        state = inst._fields[self.key]
+        state._struct.value = 1 if value else 0
+        if state.changed is not None:
+            _changed(state)
 
 
 class StringField(ReadWriteField):
@@ -466,7 +714,10 @@ class StringField(ReadWriteField):
                 value = value.decode('utf8', 'ignore').encode('utf8')
         elif len(value) > self.size:
             value = value[:self.size]
-        inst._fields[self.key]._struct.value = value
+        state = inst._fields[self.key]
+        state._struct.value = value
+        if state.changed is not None:
+            _changed(state)
 
 
 class StaticUIntField(ReadOnlyField):
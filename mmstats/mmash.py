@@ -4,10 +4,11 @@ import glob
 import operator
 import os
 import sys
+import threading
 
 import flask
 
-from mmstats import defaults, reader as mmstats_reader
+from mmstats import cache, defaults, rates, scan, watcher
 
 
 app = flask.Flask(__name__)
@@ -16,20 +17,67 @@ if 'MMASH_SETTINGS' in os.environ:
     app.config.from_envvar('MMASH_SETTINGS')
 
 
-def iter_stats(stats_glob=None):
-    """Yields a label at a time from every mmstats file in MMSTATS_GLOB"""
-    if not stats_glob:
-        stats_glob = app.config['MMSTATS_GLOB']
-    elif '..' in stats_glob:
+_watcher = None
+_watcher_lock = threading.Lock()
+# Keeps files matching custom globs open between requests
+_cache = cache.ReaderCache()
+# (glob, statname, exact) -> last rates.Sample
+_samples = {}
+MAX_SAMPLES = 1024
+_samples_lock = threading.Lock()
+
+
+def get_watcher():
+    """Returns the shared watcher of MMSTATS_GLOB"""
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None:
+            _watcher = watcher.Watcher(app.config['MMSTATS_GLOB'])
+        return _watcher
+
+
+def custom_glob(stats_glob):
+    """Returns `stats_glob` relative to MMSTATS_PATH"""
+    if '..' in stats_glob:
         # Don't allow path traversal in custom globs
         flask.abort(400)
+    # Prepend MMSTATS_PATH to beginning of glob
+    return os.path.join(defaults.DEFAULT_PATH, stats_glob)
+
+
+def iter_stats(stats_glob=None, labels=None, prefixes=None):
+    """Yields a label at a time from every mmstats file in MMSTATS_GLOB
+
+    If `labels` or `prefixes` are given only matching fields are read.
+    Files matching MMSTATS_GLOB are kept open between requests.
+    """
+    if not stats_glob:
+        w = get_watcher()
+        w.update()
+        results = w.read(labels, prefixes)
     else:
-        # Prepend MMSTATS_PATH to beginning of glob
-        stats_glob = os.path.join(defaults.DEFAULT_PATH, stats_glob)
-    for fn in glob.iglob(stats_glob):
+        # Cached files are cheap to read so a pool isn't worth starting
+        results = scan.scan(custom_glob(stats_glob), labels, prefixes,
+                            workers=1, cache=_cache)
+    for fn, stats in results:
+        if stats is None:
+            continue
+        for label, value in stats:
+            yield fn, label, value
+
+
+def iter_readers(stats_glob=None):
+    """Yields (filename, LayoutReader) for every mmstats file in
+    MMSTATS_GLOB or `stats_glob`"""
+    if not stats_glob:
+        w = get_watcher()
+        w.update()
+        for item in w.readers.items():
+            yield item
+        return
+    for fn in glob.glob(custom_glob(stats_glob)):
         try:
-            for label, value in mmstats_reader.MmStatsReader.from_mmap(fn):
-                yield fn, label, value
+            yield fn, _cache.get(fn)
         except Exception:
             continue
 
@@ -42,6 +90,15 @@ def find_labels():
     return labels
 
 
+@app.route('/cache/')
+def cache_metrics():
+    """Hit rates and sizes of the open file caches"""
+    w = get_watcher()
+    return flask.jsonify(
+        cache=_cache.metrics(),
+        watcher={'open': len(w.readers), 'inotify': w.using_inotify})
+
+
 @app.route('/stats/')
 def stats():
     return flask.jsonify(stats=sorted(find_labels()))
@@ -97,11 +154,12 @@ def getstat(statname):
     stats = defaultdict(list)
     exact = flask.request.args.get('exact')
     stats_glob = flask.request.args.get('glob')
-    for fn, label, value in iter_stats(stats_glob):
-        if exact and label == statname:
-            stats[label].append(value)
-        elif label.startswith(statname):
-            stats[label].append(value)
+    if exact:
+        selected = iter_stats(stats_glob, labels=[statname])
+    else:
+        selected = iter_stats(stats_glob, prefixes=[statname])
+    for fn, label, value in selected:
+        stats[label].append(value)
 
     aggr = aggregators.get(flask.request.args.get('aggr'))
     if aggr:
@@ -114,6 +172,34 @@ def getstat(statname):
     return flask.jsonify(stats)
 
 
+@app.route('/rates/<statname>')
+def getrates(statname):
+    """Per second rates of `statname` since the last request for it
+
+    Rates are summed across files. The first request only returns the
+    number of files.
+    """
+    exact = flask.request.args.get('exact')
+    stats_glob = flask.request.args.get('glob')
+    if exact:
+        selection = {'labels': [statname]}
+    else:
+        selection = {'prefixes': [statname]}
+    cur = rates.Sample.from_readers(iter_readers(stats_glob), **selection)
+
+    key = (stats_glob, statname, bool(exact))
+    with _samples_lock:
+        prev = _samples.get(key)
+        if prev is None and len(_samples) >= MAX_SAMPLES:
+            _samples.clear()
+        _samples[key] = cur
+    if prev is None:
+        return flask.jsonify(files=len(cur), elapsed=None, rates={})
+    deltas = rates.deltas(prev, cur)
+    return flask.jsonify(files=len(deltas.files), elapsed=deltas.elapsed,
+                         rates=deltas.rates(), resets=deltas.resets)
+
+
 @app.route('/')
 def index():
     return flask.render_template(
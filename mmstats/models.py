@@ -1,16 +1,23 @@
+import atexit
 import ctypes
+import fnmatch
 import glob
 import os
 import sys
 import time
 import threading
 
-from . import fields, libgettid, _mmap
-from .defaults import DEFAULT_PATH, DEFAULT_FILENAME
+from . import fields, libgettid, reader, sampler, _mmap
+from .defaults import (DEFAULT_PATH, DEFAULT_FILENAME, DEFAULT_DISABLED,
+        DEFAULT_ENABLED, DEFAULT_POOL_SIZE, DEFAULT_VERSION)
 
 
 removal_lock = threading.Lock()
 
+# Released per-thread files kept for reuse keyed by model layout
+_pools = {}
+_pool_lock = threading.Lock()
+
 
 def _expand_filename(path=DEFAULT_PATH, filename=DEFAULT_FILENAME):
     """Compute mmap's full path given a `path` and `filename`.
@@ -34,13 +41,194 @@ def _expand_filename(path=DEFAULT_PATH, filename=DEFAULT_FILENAME):
     return os.path.join(path, filename)
 
 
+def _parse_patterns(patterns):
+    """Return a tuple of label patterns from a comma separated string or list
+    """
+    if isinstance(patterns, basestring):
+        patterns = patterns.split(',')
+    return tuple(p.strip() for p in patterns if p.strip())
+
+
+def _matches(label, patterns):
+    """True if `label` matches any of the fnmatch style `patterns`"""
+    for pattern in patterns:
+        if fnmatch.fnmatchcase(label, pattern):
+            return True
+    return False
+
+
+def _is_main_thread():
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+def _release_mmap(fd, size, mm_ptr, filename):
+    """Unmap, close, and remove a model's mmapped file"""
+    # Stop background writes before the memory goes away
+    sampler.unregister(mm_ptr)
+    _mmap.munmap(mm_ptr, size)
+    os.close(fd)
+    try:
+        os.remove(filename)
+    except OSError:
+        # Ignore failed file removals
+        pass
+
+
+def _pool_filename(filename):
+    """Hidden name for pooled files so readers' globs skip them
+
+    The name ends with the PID so cleanstats can remove files leaked by
+    processes which didn't exit cleanly.
+    """
+    path, basename = os.path.split(filename)
+    return os.path.join(path, '.%s.%d.pool' % (basename, os.getpid()))
+
+
+def _pool_get(key):
+    """Return a pooled MmapInfo and its current filename or None"""
+    with _pool_lock:
+        pool = _pools.get(key)
+        if pool:
+            return pool.pop()
+    return None
+
+
+def _pool_put(key, info, filename, pool_size):
+    """Return a released file to the pool, returns False if the pool is full
+    """
+    with _pool_lock:
+        pool = _pools.setdefault(key, [])
+        if len(pool) >= pool_size:
+            return False
+        sampler.unregister(info.pointer)
+        # Hide the file from readers until it's adopted by a new thread
+        ctypes.c_byte.from_address(info.pointer).value = 0
+        pooled_fn = _pool_filename(filename)
+        os.rename(filename, pooled_fn)
+        pool.append((info, pooled_fn))
+    return True
+
+
+def _drain_pool(key):
+    """Release every file pooled for `key`"""
+    with _pool_lock:
+        pool = _pools.pop(key, [])
+    for info, filename in pool:
+        _release_mmap(info.fd, info.size, info.pointer, filename)
+
+
+@atexit.register
+def _drain_pools():
+    for key in list(_pools):
+        _drain_pool(key)
+
+
+class _ThreadCleanup(object):
+    """Releases a thread's mmapped file when the thread exits
+
+    Instances are stored in a model's thread local state which is released
+    when the thread exits. Must not reference the model to avoid cycles.
+
+    If `pool_size` allows the file is returned to the pool for `pool_key`
+    instead of being removed.
+    """
+
+    def __init__(self, info, filename, pool_key, pool_size):
+        self.info = info
+        self.filename = filename
+        self.pool_key = pool_key
+        self.pool_size = pool_size
+        self.armed = True
+
+    def __del__(self):
+        if not self.armed:
+            return
+        self.armed = False
+        # Never raise from __del__
+        try:
+            if _pool_put(self.pool_key, self.info, self.filename,
+                    self.pool_size):
+                return
+        except Exception:
+            pass
+        try:
+            _release_mmap(self.info.fd, self.info.size, self.info.pointer,
+                    self.filename)
+        except Exception:
+            pass
+
+
+# (model class, disabled attribute names) -> subclass without their fields
+_disabled_classes = {}
+
+
+def _disabled_class(cls, names):
+    """Returns a subclass of `cls` with the fields `names` replaced by plain
+    class attributes
+
+    Using a disabled field then costs the same as a plain attribute instead
+    of going through its descriptor.
+    """
+    key = (cls, names)
+    subclass = _disabled_classes.get(key)
+    if subclass is None:
+        attrs = {'__module__': cls.__module__, '_model_class': cls}
+        for name in names:
+            attrs[name] = getattr(cls, name)._disabled_value()
+        subclass = _disabled_classes[key] = type(cls.__name__, (cls,), attrs)
+    return subclass
+
+
 class FieldState(object):
     """Holds field state for each Field instance"""
+    disabled = False
+    # ctypes change flag and generation counter when tracking changes
+    changed = None
+    generation = None
 
     def __init__(self, field):
         self.field = field
 
 
+class SubModel(object):
+    """Embeds another model's fields in the parent model's mmap
+
+    The embedded model's labels are prefixed with `label_prefix` which
+    defaults to the attribute name followed by a period:
+
+    >>> class DBStats(BaseMmStats):
+    ...     queries = fields.CounterField()
+    ...
+    >>> class AppStats(MmStats):
+    ...     db = SubModel(DBStats)
+    ...
+    >>> stats = AppStats()
+    >>> stats.db.queries.incr()
+
+    Publishes a ``db.queries`` field in the same file as ``AppStats``' fields.
+    """
+
+    def __init__(self, model, label_prefix=None):
+        self.model = model
+        self.label_prefix = label_prefix
+        self.key = None
+
+    def get_prefix(self, attrname):
+        """Return the label prefix for the embedded model"""
+        if self.label_prefix is None:
+            return attrname + '.'
+        return self.label_prefix
+
+    def __get__(self, inst, owner):
+        if inst is None:
+            return self
+        return inst._submodels[self.key]
+
+    def __repr__(self):
+        return '%s(%s, label_prefix=%r)' % (
+            self.__class__.__name__, self.model.__name__, self.label_prefix)
+
+
 class BaseMmStats(threading.local):
     """Stats models should inherit from this
 
@@ -55,57 +243,235 @@ class BaseMmStats(threading.local):
 
     This class is *not threadsafe*, so you should include both {PID} and
     {TID} in your filename to ensure the mmaped files don't collide.
+
+    Fields may be disabled by passing a list of fnmatch style label patterns
+    as `disabled` or setting a comma separated list in the
+    ``MMSTATS_DISABLED`` environment variable. Fields created with
+    ``enabled=False`` may be turned on with `enabled` or ``MMSTATS_ENABLED``.
+    Disabled fields take no space in the mmap. They're replaced by plain
+    attributes, so setting them costs no more than any attribute and methods
+    like ``incr()`` are no-ops.
+
+    Files for threads other than the main thread are unmapped and removed
+    automatically when their thread exits if `filename` includes {TID}. Up to
+    `pool_size` of those files are kept per model layout and reused by new
+    threads, which only need to rename and reinitialize them.
+
+    Other models may be embedded with :class:`~mmstats.models.SubModel` to
+    share a single mmaped file.
+
+    `version` selects the mmap format. Version 2 adds an index of fields to
+    the file's header so readers can find a field without parsing the rest.
+    It defaults to ``MMSTATS_VERSION`` or 1.
+
+    Version 2 writers may `track_changes` which flags fields as they're
+    written so readers only need to decode fields which have changed (see
+    :meth:`~mmstats.reader.LayoutReader.read_changes`).
     """
+    # Set on models embedded in another model's mmap
+    _parent = None
+    # Set on per-thread models which should be released on thread exit
+    _cleanup = None
 
     def __init__(self, path=DEFAULT_PATH, filename=DEFAULT_FILENAME,
-                 label_prefix=None):
+                 label_prefix=None, disabled=(), enabled=(),
+                 pool_size=DEFAULT_POOL_SIZE, version=DEFAULT_VERSION,
+                 track_changes=False):
         self._removed = False
+        if version not in (1, 2):
+            raise ValueError('Unsupported mmstats version: %r' % version)
+        if track_changes and version != 2:
+            raise ValueError('track_changes requires version 2')
+        self._version = version
+        self._track_changes = track_changes
 
         # Setup label prefix
         self._label_prefix = '' if label_prefix is None else label_prefix
 
+        # Patterns are added to those from the environment
+        self._disabled = (_parse_patterns(DEFAULT_DISABLED) +
+                _parse_patterns(disabled))
+        self._enabled = (_parse_patterns(DEFAULT_ENABLED) +
+                _parse_patterns(enabled))
+
         self._full_path = _expand_filename(path, filename)
         self._filename = filename
         self._path = path
 
-        self._offset = 1
+        total_size = self._add_fields()
+
+        # Header followed by the layout fingerprint
+        self._field_count = 1 + sum(1 for _ in self._iter_states())
+        self._header_size = reader.header_size(
+                version, self._field_count, track_changes)
+        self._offset = self._header_size + reader.LAYOUT_RECORD_SIZE
+        total_size += self._offset
+
+        # Files are only interchangeable between identical layouts
+        self._pool_key = (os.getpid(), self.__class__, self._label_prefix,
+                self._disabled, self._enabled, version, track_changes,
+                total_size,
+                os.path.dirname(self._full_path))
+        pooled = _pool_get(self._pool_key)
+        if pooled is None:
+            info = _mmap.init_mmap(self._full_path, size=total_size)
+        else:
+            # Adopt a file released by an exited thread
+            info, pooled_fn = pooled
+            os.rename(pooled_fn, self._full_path)
+            ctypes.memset(info.pointer, 0, info.size)
+        self._fd, self._size, self._mm_ptr = info
+        mmap_t = ctypes.c_char * self._size
+        self._mmap = mmap_t.from_address(self._mm_ptr)
+
+        if '{TID}' in self._filename and not _is_main_thread():
+            # Remove this thread's file when its thread local state goes away
+            self._cleanup = _ThreadCleanup(
+                info, self._full_path, self._pool_key, pool_size)
+
+        # Finally initialize thes stats
+        self._init_fields(total_size)
+        self._init_layout()
+
+        # Set the version last so readers never see a partially initialized
+        # (or recycled) file
+        ver = ctypes.c_byte.from_address(self._mm_ptr)
+        ver.value = version
 
+    def _add_fields(self):
+        """Add this model's fields and submodels and return their total size"""
         # Store state for this instance's fields
         self._fields = {}
+        self._submodels = {}
 
-        total_size = self._offset
+        total_size = 0
         #FIXME This is the *wrong* way to initialize stat fields
         for cls in self.__class__.__mro__:
             for attrname, attrval in cls.__dict__.items():
-                if (attrname not in self._fields
-                        and isinstance(attrval, fields.Field)):
+                if attrname in self._fields or attrname in self._submodels:
+                    continue
+                if isinstance(attrval, fields.Field):
                     total_size += self._add_field(attrname, attrval)
+                elif isinstance(attrval, SubModel):
+                    total_size += self._add_submodel(attrname, attrval)
 
-        self._fd, self._size, self._mm_ptr = _mmap.init_mmap(
-            self._full_path, size=total_size)
-        mmap_t = ctypes.c_char * self._size
-        self._mmap = mmap_t.from_address(self._mm_ptr)
-        ver = ctypes.c_byte.from_address(self._mm_ptr)
-        ver.value = 1  # Version number
-
-        # Finally initialize thes stats
-        self._init_fields(total_size)
+        disabled = tuple(sorted(name for name, state in self._fields.items()
+                                if state.disabled))
+        if disabled:
+            self.__class__ = _disabled_class(
+                getattr(self.__class__, '_model_class', self.__class__),
+                disabled)
+        return total_size
 
     def _add_field(self, name, field):
         """Given a name and Field instance, add this field and retun size"""
         # Stats need a place to store their per Mmstats instance state
         state = self._fields[name] = FieldState(field)
 
+        if not self._is_enabled(field._label(self.label_prefix, name),
+                field.enabled):
+            # Disabled fields get a no-op state and take no space
+            return field._disable(state, self.label_prefix, name)
+
         # Call field._new to determine size
         return field._new(state, self.label_prefix, name)
 
+    def _is_enabled(self, label, default):
+        """Returns whether the field with the given label should be enabled"""
+        if _matches(label, self._enabled):
+            return True
+        if not default:
+            return False
+        return not _matches(label, self._disabled)
+
+    def _add_submodel(self, name, submodel):
+        """Given a name and SubModel instance, embed the model and return size
+        """
+        # Key is used to reference the embedded model on the parent instance
+        submodel.key = name
+        model = submodel.model
+        # Bypass __init__ as embedded models don't get their own mmap
+        child = self._submodels[name] = model.__new__(model)
+        child._removed = False
+        child._parent = self
+        child._label_prefix = self.label_prefix + submodel.get_prefix(name)
+        child._full_path = self._full_path
+        child._filename = self._filename
+        child._path = self._path
+        child._disabled = self._disabled
+        child._enabled = self._enabled
+        return child._add_fields()
+
     def _init_fields(self, total_size):
         """Once all fields have been added, initialize them in mmap"""
 
         for state in self._fields.values():
+            if state.disabled:
+                continue
+            state.offset = self._offset
             # 2nd Call field._init to initialize new stat
             self._offset = state.field._init(state, self._mm_ptr, self._offset)
 
+        # Embedded models are laid out after this model's own fields
+        for child in self._submodels.values():
+            child._size = self._size
+            child._mm_ptr = self._mm_ptr
+            child._mmap = self._mmap
+            child._offset = self._offset
+            child._init_fields(total_size)
+            self._offset = child._offset
+
+    def _iter_states(self):
+        """Yield state for every enabled field including embedded models'"""
+        for state in self._fields.values():
+            if not state.disabled:
+                yield state
+        for child in self._submodels.values():
+            for state in child._iter_states():
+                yield state
+
+    def _init_layout(self):
+        """Stamp the layout fingerprint readers use to cache layouts and the
+        version 2 header
+        """
+        layout = [(reader.LAYOUT_LABEL, 'Q', self._header_size)]
+        for state in sorted(self._iter_states(), key=lambda s: s.offset):
+            label = state.label
+            if isinstance(label, unicode):
+                label = label.encode('utf8')
+            layout.append((label, state.field.type_signature, state.offset))
+        reader.write_layout_record(
+            self._mmap, reader.layout_fingerprint(layout, self._offset),
+            self._header_size)
+        if self._version == 2:
+            reader.write_header(
+                self._mmap, [(label, offset) for label, _, offset in layout],
+                self._offset, self._track_changes)
+        if self._track_changes:
+            self._init_changes()
+
+    def _init_changes(self):
+        """Point fields at their change flag and the generation counter"""
+        offset = self._mm_ptr + reader.changes_offset(self._field_count)
+        generation = ctypes.c_uint64.from_address(offset)
+        flags = offset + ctypes.sizeof(generation)
+        # Flags are in file order after the layout fingerprint's
+        states = sorted(self._iter_states(), key=lambda s: s.offset)
+        for i, state in enumerate(states, 1):
+            state.changed = ctypes.c_ubyte.from_address(flags + i)
+            state.generation = generation
+
+    def _clear_fields(self):
+        """Remove fields (recursively) to prevent segfaults after removal"""
+        for child in self._submodels.values():
+            child._clear_fields()
+            child._size = None
+            child._mm_ptr = None
+            child._mmap = None
+            child._removed = True
+        self._fields = {}
+        self._submodels = {}
+
     @property
     def filename(self):
         return self._full_path
@@ -125,9 +491,15 @@ class BaseMmStats(threading.local):
                       finish syncing to disk. Defaults to ``False``
         :type async: bool
         """
+        if self._parent is not None:
+            # Embedded models share their parent's mmap
+            return self._parent.flush(async)
         _mmap.msync(self._mm_ptr, self._size, async)
 
     def remove(self):
+        if self._parent is not None:
+            # Embedded models share their parent's mmap
+            return self._parent.remove()
         with removal_lock:
             # Perform regular removal of this process/thread's own file.
             self._remove()
@@ -136,6 +508,8 @@ class BaseMmStats(threading.local):
             # cleanup than to cleanup multiple PIDs' files.
             if '{PID}' in self._filename and '{TID}' in self._filename:
                 self._remove_stale_thread_files()
+            # Pooled files are only useful while the model is in use
+            _drain_pool(self._pool_key)
 
     def _remove_stale_thread_files(self):
         # The originally given (to __init__) filename string, containing
@@ -147,25 +521,26 @@ class BaseMmStats(threading.local):
         expanded = _expand_filename(path=self._path, filename=globbed)
         # And nuke as appropriate.
         for leftover in glob.glob(expanded):
-            os.remove(leftover)
+            try:
+                os.remove(leftover)
+            except OSError:
+                # Exiting threads may have removed their own file already
+                pass
 
     def _remove(self):
         """Close and remove mmap file - No further stats updates will work"""
         if self._removed:
             # Make calling more than once a noop
             return
-        _mmap.munmap(self._mm_ptr, self._size)
+        if self._cleanup is not None:
+            # Released here instead of on thread exit
+            self._cleanup.armed = False
+        _release_mmap(self._fd, self._size, self._mm_ptr, self.filename)
         self._size = None
         self._mm_ptr = None
         self._mmap = None
-        os.close(self._fd)
-        try:
-            os.remove(self.filename)
-        except OSError:
-            # Ignore failed file removals
-            pass
         # Remove fields to prevent segfaults
-        self._fields = {}
+        self._clear_fields()
         self._removed = True
 
 
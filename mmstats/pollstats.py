@@ -5,15 +5,22 @@ pollstats [options] <fields> <files>...
 """
 import argparse
 import collections
+import csv
+import ctypes
+import ctypes.util
+import curses
+import errno
+import glob
+import json
+import math
 import mmap
 import os
-import struct
 import sys
 import time
 
 import pkg_resources
 
-from mmstats import reader
+from mmstats import rates, reader, scan, watcher
 
 
 VERSION = pkg_resources.require('mmstats')[0].version
@@ -73,21 +80,93 @@ ansi = {
 }
 
 
+def positive_float(value):
+    """argparse type for a float greater than 0"""
+    try:
+        value = float(value)
+    except ValueError:
+        value = None
+    if value is None or not value > 0:
+        raise argparse.ArgumentTypeError('must be a positive number')
+    return value
+
+
+def command_name(fn, pid):
+    """Returns the command name of process `pid` which wrote `fn`
+
+    The name is taken from the ``{CMD}-{PID}`` start of the default
+    filenames. Otherwise it's read from ``/proc`` while the process is
+    running or is the filename.
+    """
+    name = os.path.basename(fn)
+    if pid is None:
+        return name
+    marker = '-%d-' % pid
+    if marker in name:
+        return name.split(marker, 1)[0]
+    try:
+        with open('/proc/%d/comm' % pid) as f:
+            return f.read().rstrip('\n')
+    except (IOError, OSError):
+        return name
+
+
 opts = argparse.ArgumentParser()
+opts.add_argument('-a', '--aggregate', default='sum',
+        help='aggregate files with sum, avg, min, max, or pNN percentiles')
 opts.add_argument('-c', '--count', type=int)
-opts.add_argument('-d', '--delay', type=int, default=1)
+opts.add_argument('-d', '--delay', type=positive_float, default=1,
+        help='seconds between ticks, may be fractional')
 opts.add_argument('-f', '--filter', nargs='*', default=[])
+opts.add_argument('-g', '--group-by', metavar='LABEL',
+        help='print a line per value of LABEL (such as sys.pid), per '
+             'command if LABEL is "cmd", or per file if LABEL is "file"')
 opts.add_argument('-n', '--headers', default=20, type=int,
         help='print headers every HEADERS lines')
+opts.add_argument('-o', '--output', choices=('table', 'csv', 'json', 'top'),
+        default='table',
+        help='table, CSV, JSON lines, or an interactive top-like view')
 opts.add_argument('-p', '--prefix', default='', help='field prefix')
+opts.add_argument('-r', '--rate', action='store_true',
+        help='print per second rates instead of deltas')
 opts.add_argument('fields', help='Comma seperated list of fields')
-opts.add_argument('files', nargs='+')
+opts.add_argument('files', nargs='+',
+        help='files or quoted glob patterns which are watched for new files')
 opts.add_argument('-v', action='append_const', const=1, dest='verbosity',
         default=[], help='verbosity: warnings=1, info=2, debug=3')
 opts.add_argument('--version', action='version',
         version='%%(prog)s %s' % VERSION)
 
 
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _clock_gettime():
+    """Returns a function reading CLOCK_MONOTONIC or None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        clock_gettime = ctypes.CDLL(ctypes.util.find_library('c'),
+                                    use_errno=True).clock_gettime
+    except (AttributeError, OSError):
+        return None
+    CLOCK_MONOTONIC = 1
+    ts = _timespec()
+
+    def monotonic():
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+            raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+
+# Seconds from a clock which never jumps when the system time is changed.
+# Falls back to time.time where there's no monotonic clock.
+monotonic = (getattr(time, 'monotonic', None) or _clock_gettime() or
+             time.time)
+
+
 def get_console_size():
     """Returns rows, columns for current console"""
     #FIXME Only tested on linux
@@ -96,28 +175,28 @@ def get_console_size():
 
 def iter_stats(m):
     """Yields label, value pairs for the given mmstats map"""
-    # Hop to the beginning
-    m.seek(1)
-    while m[m.tell()] != '\x00':
-        label_sz = struct.unpack('H', m.read(2))[0]
-        label = m.read(label_sz)
-        type_sz = struct.unpack('H', m.read(2))[0]
-        type_ = m.read(type_sz)
-        sz = struct.calcsize(type_)
-        idx = struct.unpack('B', m.read_byte())[0]
-        if idx == reader.UNBUFFERED_FIELD:
-            value = struct.unpack(type_, m.read(sz))[0]
-        else:
-            idx ^= 1 # Flip bit as the stored buffer is the *write* buffer
-            buffers = m.read(sz * 2)
-            offset = sz * idx
-            value = struct.unpack(type_, buffers[offset:sz+offset])[0]
-        yield label, value
+    for stat in reader.get_layout(m).stats(m):
+        yield stat
 
 
 Mmap = collections.namedtuple('Mmap', ('file', 'mmap'))
 
 
+def open_mmap(fn):
+    """Returns `fn` and an :class:`Mmap` of it or None if it can't be opened
+    """
+    try:
+        f = open(fn, 'rb')
+    except Exception:
+        return fn, None
+    try:
+        m = mmap.mmap(f.fileno(), 0, prot=mmap.ACCESS_READ)
+    except Exception:
+        f.close()
+        return fn, None
+    return fn, Mmap(f, m)
+
+
 class PollStats(object):
     def __init__(self, args):
         self.args = args
@@ -127,8 +206,22 @@ class PollStats(object):
         if args.prefix:
             self.fields = ["%s%s" % (args.prefix, field)
                     for field in self.fields]
-        self.last_vals = dict((field, 0) for field in self.fields)
+        self.last_sample = None
+        # Files given literally: filename -> Mmap
         self.files = {}
+        # Glob patterns are watched so new files are polled as they appear
+        self.watchers = [watcher.Watcher(pattern)
+                         for pattern in set(args.files)
+                         if glob.has_magic(pattern)]
+        # Watched filename -> (LayoutReader, matches filters)
+        self.watched = {}
+        # filename -> Layout of the displayed fields
+        self.layouts = {}
+        # filename -> group key of the file when grouping
+        self.groups = {}
+        # Clocks for output timestamps and for normalizing rates
+        self.time = time.time
+        self.clock = monotonic
         self._mmap_files()
 
         # By default filter down to just files that have the given fields
@@ -137,64 +230,96 @@ class PollStats(object):
         for filterstr in args.filter:
             if '=' in filterstr:
                 # Filter on exact key-value pairs
-                self.kv_filters.add(filterstr.split('='))
+                self.kv_filters.add(tuple(filterstr.split('=', 1)))
             else:
                 # Filter on presence of keys
                 self.key_filters.add(filterstr)
 
         self._filter_mmaps()
-        self.print_headers()
+        self.csv = None
+        if args.output == 'csv':
+            self.csv = csv.writer(sys.stdout, lineterminator='\n')
+            self.write_csv_header()
+        elif args.output == 'table':
+            self.print_headers()
 
     def _mmap_files(self):
-        for fn in set(self.args.files):
-            try:
-                f = open(fn, 'rb')
-                m = mmap.mmap(f.fileno(), 0, prot=mmap.ACCESS_READ)
-            except Exception:
+        files = set(fn for fn in self.args.files if not glob.has_magic(fn))
+        # Files are opened in parallel as there may be thousands
+        for fn, opened in scan.imap(open_mmap, files):
+            if opened is None:
                 self.warn('Skipping %s - unable to open' % fn)
                 continue
 
-            if m.read_byte() == reader.VERSION_1:
+            f, m = opened
+            if m.read_byte() in reader.VERSIONS:
                 self.files[fn] = Mmap(f, m)
             else:
                 m.close()
                 f.close()
                 self.warn('Skipping %s - unknown file format' % fn)
 
-    def _filter_mmaps(self):
-        for fn, (f, m) in self.files.items():
-            # By default remove files that don't match filters
-            remove = True
-            fields = dict(pair for pair in iter_stats(m))
-            for kf in self.key_filters:
-                for k in fields.iterkeys():
-                    # Key filters match the start of the key name
-                    if k.startswith(kf):
-                        remove = False
-                        break
-                if not remove:
-                    break
-
-            if not remove:
-                # Matched key filter, don't remove and continue on
-                continue
+    def matches(self, fields):
+        """Returns True if a file's `fields` dict matches the filters"""
+        for kf in self.key_filters:
+            for k in fields.iterkeys():
+                # Key filters match the start of the key name
+                if k.startswith(kf):
+                    return True
 
-            # Didn't remove file, check kv_filters
-            for kf, vf in self.kv_filters:
-                if kf in fields and fields[kf] == vf:
-                    remove = False
-                    break
+        # Didn't match a key filter, check kv_filters
+        for kf, vf in self.kv_filters:
+            if kf in fields and fields[kf] == vf:
+                return True
+        return False
 
-            if remove:
+    def _filter_mmaps(self):
+        for fn, (f, m) in self.files.items():
+            if not self.matches(dict(pair for pair in iter_stats(m))):
                 # fn didn't match key filter or key/value filter, remove
                 self.remove_file(fn)
 
+    def iter_files(self):
+        """Yields (filename, mmap) for every polled file
+
+        Watched patterns are updated first, and new files which match the
+        filters are included.
+        """
+        for fn, (_, m) in self.files.iteritems():
+            yield fn, m
+
+        seen = set()
+        for w in self.watchers:
+            w.update()
+            for fn, r in w.readers.items():
+                if fn in self.files or fn in seen:
+                    continue
+                watched = self.watched.get(fn)
+                if watched is None or watched[0] is not r:
+                    # New or replaced file
+                    try:
+                        stats = dict(r.read())
+                    except Exception:
+                        continue
+                    watched = self.watched[fn] = (r, self.matches(stats))
+                seen.add(fn)
+                if watched[1]:
+                    yield fn, r.data
+
+        for fn in set(self.watched) - seen:
+            # Removed from watched patterns
+            del self.watched[fn]
+            self.layouts.pop(fn, None)
+            self.groups.pop(fn, None)
+
     def remove_file(self, fn):
         """Remove file `fn` from open mmstat files"""
         m = self.files[fn]
         m.file.close()
         m.mmap.close()
         del self.files[fn]
+        self.layouts.pop(fn, None)
+        self.groups.pop(fn, None)
 
     def dbg(self, msg):
         if self.verbosity >= DEBUG_LEVEL:
@@ -208,48 +333,376 @@ class PollStats(object):
         #_, width = get_console_size()
         #field_width = (width / len(self.fields)) - 1
         width = 20
+        headers = [f.replace(self.prefix, '', 1) for f in self.fields]
+        if self.args.group_by:
+            headers.insert(0, self.args.group_by)
         print '|'.join(
-            ansi['bold'] +
-                f.replace(self.prefix, '', 1)[:width].center(width)
-                + ansi['default']
-            for f in self.fields
+            ansi['bold'] + h[:width].center(width) + ansi['default']
+            for h in headers
         )
 
+    def print_values(self, values, group=None):
+        """Prints a line of `values` dict of field to value"""
+        cells = []
+        if self.args.group_by:
+            key = group if isinstance(group, basestring) else repr(group)
+            cells.append('%20s' % key[-20:])
+        for field in self.fields:
+            value = values.get(field, 0)
+            fmt = '%s%19.2f%s ' if isinstance(value, float) else '%s%19d%s '
+            cells.append(fmt % (ansi['yellow'], value, ansi['default']))
+        line = '|'.join(cells)
+        if isinstance(line, unicode):
+            line = line.encode('utf8')
+        print line
+
+    def get_layout(self, fn, m):
+        """Returns the layout of the displayed fields in `m`
+
+        Fields are resolved to offsets once per file and only revalidated on
+        later ticks, so each tick just unpacks the displayed values. Group
+        labels other than ``file`` and ``cmd`` may change at runtime so they
+        are re-read every tick.
+        """
+        layout = self.layouts.get(fn)
+        if layout is None or not layout.valid(m):
+            layout = reader.get_layout(m).select(self.fields)
+            self.layouts[fn] = layout
+            if self.args.group_by:
+                self.groups[fn] = self.group_key(fn, m)
+        elif self.args.group_by not in (None, 'file', 'cmd'):
+            self.groups[fn] = self.group_key(fn, m)
+        return layout
+
+    def group_key(self, fn, m):
+        """Returns the value of the --group-by label in `m`"""
+        if self.args.group_by == 'file':
+            return fn
+        if self.args.group_by == 'cmd':
+            pids = reader.get_layout(m).select(['sys.pid']).values(m)
+            return command_name(fn, pids[0] if pids else None)
+        values = reader.get_layout(m).select([self.args.group_by]).values(m)
+        return values[0] if values else None
+
+    def sample(self):
+        """Returns a :class:`~mmstats.rates.Sample` of the displayed fields
+        """
+        # Rates are normalized by the monotonic time between samples
+        sample = rates.Sample(time=self.clock())
+        for fn, m in self.iter_files():
+            try:
+                layout = self.get_layout(fn, m)
+                values = layout.values(m)
+            except Exception as e:
+                # Probably being reinitialized by its writer
+                self.dbg('Skipping %s this tick - %s' % (fn, e))
+                continue
+            sample.add(fn, layout, values)
+        return sample
+
+    def write_csv_header(self):
+        header = ['time']
+        if self.args.group_by:
+            header.append(self.args.group_by)
+        self.csv.writerow(header + self.fields)
+        sys.stdout.flush()
+
+    def write_csv(self, timestamp, values, group=None):
+        """Writes a CSV row of `values` dict of field to value"""
+        row = [repr(timestamp)]
+        if self.args.group_by:
+            if isinstance(group, unicode):
+                group = group.encode('utf8')
+            row.append(group)
+        self.csv.writerow(row + [values.get(f, 0) for f in self.fields])
+        sys.stdout.flush()
+
+    def write_json(self, timestamp, values, group=None):
+        """Writes a JSON object of `values` dict of field to value on a
+        line"""
+        obj = {'time': timestamp}
+        if self.args.group_by:
+            obj[self.args.group_by] = group
+        for field in self.fields:
+            obj[field] = values.get(field, 0)
+        sys.stdout.write(json.dumps(obj, separators=(',', ':')) + '\n')
+        sys.stdout.flush()
+
+    def aggregate(self):
+        """Samples the files and returns a dict of group to a dict of field
+        to aggregated value
+
+        The first sample's values are aggregated and later samples' deltas
+        (or rates) since the previous sample.
+        """
+        cur = self.sample()
+        groups = self.groups if self.args.group_by else None
+        if self.last_sample is None:
+            # Nothing to compare to yet so aggregate the values
+            result = cur.aggregate(self.args.aggregate, groups)
+        else:
+            # Deltas handle restarted writers and wrapped counters
+            deltas = rates.deltas(self.last_sample, cur)
+            result = deltas.aggregate(self.args.aggregate, groups,
+                                      per_second=self.args.rate)
+        self.last_sample = cur
+        return result
+
     def read_once(self):
-        cur_vals = collections.defaultdict(int)
-        for _, m in self.files.itervalues():
-            mvals = dict(pair for pair in iter_stats(m))
-            for field in self.fields:
-                cur_vals[field] += mvals[field]
+        timestamp = self.time()
+        result = self.aggregate()
+        if self.args.group_by:
+            lines = [(group, result[group]) for group in sorted(result)]
+        else:
+            lines = [(None, result.get(None, {}))]
+        for group, values in lines:
+            if self.args.output == 'csv':
+                self.write_csv(timestamp, values, group)
+            elif self.args.output == 'json':
+                self.write_json(timestamp, values, group)
+            else:
+                self.print_values(values, group)
+
+    def ticks(self, clock=monotonic, sleep=time.sleep):
+        """Yields the tick number every --delay seconds
+
+        Ticks are scheduled from the first tick on a monotonic `clock` so
+        they don't drift by the time spent reading. Ticks missed by slow
+        reads are skipped.
+        """
+        delay = self.args.delay
+        if not delay > 0:
+            raise ValueError('delay must be positive: %r' % delay)
+        next_tick = clock()
+        tick = 0
+        while 1:
+            yield tick
+            tick += 1
+            next_tick += delay
+            now = clock()
+            if now > next_tick:
+                skipped = int(math.ceil((now - next_tick) / delay))
+                self.dbg('Skipping %d ticks' % skipped)
+                next_tick += skipped * delay
+            if next_tick > now:
+                sleep(next_tick - now)
 
-        print '|'.join("%s%19d%s " % (ansi['yellow'],
-                cur_vals[field] - self.last_vals[field], ansi['default'])
-            for field in self.fields)
-        self.last_vals = cur_vals
+    def run(self):
+        lines_since_header = 0
+        for tick in self.ticks():
+            if self.args.count:
+                if tick == self.args.count:
+                    return
+            elif (self.args.output == 'table' and
+                    lines_since_header == self.args.headers):
+                self.print_headers()
+                lines_since_header = 0
+            self.read_once()
+            lines_since_header += 1
+
+
+#: Width of each TopView column including its separating space
+TOP_WIDTH = 20
+
+
+def format_group(group):
+    """Returns the text of a TopView group"""
+    if isinstance(group, unicode):
+        return group.encode('utf8')
+    return group if isinstance(group, str) else repr(group)
+
+
+def format_value(value):
+    """Returns the text of a TopView value"""
+    if isinstance(value, float):
+        return '%.2f' % value
+    return '%d' % value
+
+
+def sort_groups(result, fields, sort_column=1, descending=True,
+                group_filter=''):
+    """Returns a list of (group text, values) from `result`, a dict of group
+    to a dict of field to value, sorted by column `sort_column`
+
+    Column 0 is the group and the rest are `fields`. Only groups containing
+    `group_filter` are included.
+    """
+    groups = [(format_group(group), values)
+              for group, values in result.iteritems()]
+    if group_filter:
+        groups = [g for g in groups if group_filter in g[0]]
+    if sort_column == 0:
+        key = lambda g: g[0]
+    else:
+        field = fields[sort_column - 1]
+        key = lambda g: g[1].get(field, 0)
+    return sorted(groups, key=key, reverse=descending)
+
+
+def render_frame(result, fields, group_by, prefix='', sort_column=1,
+                 descending=True, group_filter='', height=24,
+                 width=TOP_WIDTH):
+    """Returns a TopView frame of `result` as a dict of (row, column) to
+    (text, curses attribute)
+
+    See :func:`sort_groups` for the sorting and filtering arguments. Groups
+    which don't fit in `height` rows are left out.
+    """
+    groups = sort_groups(result, fields, sort_column, descending,
+                         group_filter)
+    order = 'desc' if descending else 'asc'
+    status = 'pollstats: %d %ss  %s  filter: %s  [<>] sort [r]everse ' \
+        '[/] filter [q]uit' % (len(groups), group_by, order,
+                               group_filter or '-')
+    frame = {(0, 0): (status.ljust(width * 4), curses.A_NORMAL)}
+
+    headers = [group_by] + [f.replace(prefix, '', 1) for f in fields]
+    for i, header in enumerate(headers):
+        attr = curses.A_REVERSE if i == sort_column else curses.A_BOLD
+        frame[(1, i * width)] = (header[-(width - 1):].center(width - 1),
+                                 attr)
+
+    for row, (group, values) in enumerate(groups[:max(0, height - 2)], 2):
+        cells = [group[-(width - 1):].ljust(width - 1)]
+        cells.extend(format_value(values.get(f, 0)).rjust(width - 1)
+                     for f in fields)
+        for i, text in enumerate(cells):
+            frame[(row, i * width)] = (text, curses.A_NORMAL)
+    return frame
+
+
+class TopView(object):
+    """Full screen view of every group (or file) sorted by any column
+
+    Keys: ``<`` and ``>`` (or the arrow keys) change the sort column, ``r``
+    reverses the sort, ``/`` filters groups by a substring, and ``q``
+    quits. Only cells which changed since the last tick are redrawn.
+    """
+    width = TOP_WIDTH
+
+    def __init__(self, poll, screen):
+        self.poll = poll
+        self.screen = screen
+        self.result = {}
+        # Column 0 is the group, the rest are the fields
+        self.sort_column = 1
+        self.descending = True
+        self.filter = ''
+        # (row, column) -> (text, attribute) last drawn there
+        self.cells = {}
+
+    def set_cell(self, row, col, text, attr=curses.A_NORMAL):
+        """Draws `text` at (`row`, `col`) if it isn't there already"""
+        if self.cells.get((row, col)) == (text, attr):
+            return
+        self.cells[(row, col)] = (text, attr)
+        height, width = self.screen.getmaxyx()
+        if row >= height or col >= width - 1:
+            return
+        # Writing the bottom right corner raises so stop just before it
+        self.screen.addstr(row, col, text[:width - 1 - col], attr)
+
+    def draw(self):
+        height, _ = self.screen.getmaxyx()
+        frame = render_frame(self.result, self.poll.fields,
+                             self.poll.args.group_by, self.poll.prefix,
+                             self.sort_column, self.descending, self.filter,
+                             height, self.width)
+        for (row, col), (text, _) in self.cells.items():
+            if (row, col) not in frame:
+                # Clear rows left over from a longer list
+                self.set_cell(row, col, ' ' * len(text))
+        for (row, col), (text, attr) in sorted(frame.iteritems()):
+            self.set_cell(row, col, text, attr)
+        # Only the changes since the last refresh are sent to the terminal
+        self.screen.noutrefresh()
+        curses.doupdate()
+
+    def prompt_filter(self):
+        height, width = self.screen.getmaxyx()
+        self.screen.move(height - 1, 0)
+        self.screen.clrtoeol()
+        self.screen.addstr(height - 1, 0, 'filter: ')
+        curses.echo()
+        # Block until the filter is entered
+        self.screen.timeout(-1)
+        try:
+            self.filter = self.screen.getstr(height - 1, 8, width - 9).strip()
+        finally:
+            curses.noecho()
+        self.redraw()
+
+    def redraw(self):
+        self.cells.clear()
+        self.screen.erase()
+
+    def handle_key(self, key):
+        """Returns False if the view should exit"""
+        columns = len(self.poll.fields) + 1
+        if key in (ord('q'), ord('Q')):
+            return False
+        elif key in (ord('<'), curses.KEY_LEFT):
+            self.sort_column = (self.sort_column - 1) % columns
+        elif key in (ord('>'), curses.KEY_RIGHT):
+            self.sort_column = (self.sort_column + 1) % columns
+        elif key == ord('r'):
+            self.descending = not self.descending
+        elif key == ord('/'):
+            self.prompt_filter()
+        elif key == curses.KEY_RESIZE:
+            self.redraw()
+        return True
 
     def run(self):
-        if self.args.count:
-            for _ in xrange(self.args.count):
-                self.read_once()
-                time.sleep(self.args.delay)
-        else:
-            lines_since_header = 0
-            while 1:
-                if lines_since_header == self.args.headers:
-                    self.print_headers()
-                    lines_since_header = 0
-                self.read_once()
-                lines_since_header += 1
-                time.sleep(self.args.delay)
+        try:
+            curses.curs_set(0)
+        except curses.error:
+            pass
+        delay = self.poll.args.delay
+        next_tick = monotonic()
+        while 1:
+            now = monotonic()
+            if now >= next_tick:
+                self.result = self.poll.aggregate()
+                self.draw()
+                next_tick += delay
+                now = monotonic()
+                if now > next_tick and delay > 0:
+                    # Skip ticks missed by slow reads
+                    next_tick += delay * math.ceil((now - next_tick) / delay)
+            # Wait for a key until the next tick
+            self.screen.timeout(max(0, int((next_tick - now) * 1000)))
+            key = self.screen.getch()
+            if key == -1:
+                continue
+            if not self.handle_key(key):
+                return
+            self.draw()
 
 
 def main():
     """CLI Entry Point"""
-    p = PollStats(opts.parse_args())
+    args = opts.parse_args()
     try:
-        p.run()
+        rates.check_aggregate(args.aggregate)
+    except ValueError as e:
+        opts.error(str(e))
+    if args.output == 'top' and not args.group_by:
+        # A row per file
+        args.group_by = 'file'
+    try:
+        p = PollStats(args)
+        if args.output == 'top':
+            curses.wrapper(lambda screen: TopView(p, screen).run())
+        else:
+            p.run()
     except KeyboardInterrupt:
         return
+    except IOError as e:
+        if e.errno == errno.EPIPE:
+            # Piped to a command (e.g.: head) which exited
+            return
+        raise
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,181 @@
+"""Process and interpreter metrics sampled in the background"""
+import gc
+import operator
+import os
+import resource
+import time
+import warnings
+
+from . import fields, sampler
+from .models import MmStats
+
+
+try:
+    CLOCK_TICKS = float(os.sysconf('SC_CLK_TCK'))
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = 100.0
+PAGESIZE = resource.getpagesize()
+
+
+class _ProcFile(object):
+    """Keeps a /proc file open so each read is a single lseek and read"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.pid = None
+
+    def read(self):
+        if self.pid != os.getpid():
+            # /proc/self was resolved when opened so reopen after forking
+            self.close()
+            self.fd = os.open(self.path, os.O_RDONLY)
+            self.pid = os.getpid()
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        return os.read(self.fd, 8192)
+
+    def close(self):
+        if self.fd is not None and self.pid == os.getpid():
+            os.close(self.fd)
+        self.fd = None
+
+
+class _GCTimer(object):
+    """Tracks garbage collections via gc.callbacks when available (3.3+)"""
+
+    def __init__(self):
+        self.collections = [0, 0, 0]
+        self.time = 0.0
+        self._start = None
+        self.installed = False
+
+    def install(self):
+        if self.installed or not hasattr(gc, 'callbacks'):
+            return
+        gc.callbacks.append(self)
+        self.installed = True
+
+    def __call__(self, phase, info):
+        if phase == 'start':
+            self._start = time.time()
+        elif self._start is not None:
+            self.time += time.time() - self._start
+            self.collections[info['generation']] += 1
+            self._start = None
+
+
+_stat = _ProcFile('/proc/self/stat')
+_status = _ProcFile('/proc/self/status')
+_gc_timer = _GCTimer()
+
+
+def sample_process():
+    """Returns a dict of process and interpreter metrics
+
+    Reads each /proc file once. Metrics which aren't available on this
+    platform are omitted.
+    """
+    sample = {}
+    try:
+        stat = _stat.read()
+    except OSError:
+        # No /proc, fallback to getrusage
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        sample['cpu.user'] = usage.ru_utime
+        sample['cpu.system'] = usage.ru_stime
+        sample['ctx_switches.voluntary'] = usage.ru_nvcsw
+        sample['ctx_switches.involuntary'] = usage.ru_nivcsw
+    else:
+        # comm may contain spaces and parens so split after the last paren.
+        # values[0] is field 3 in proc(5)
+        values = stat.rsplit(')', 1)[1].split()
+        sample['cpu.user'] = int(values[11]) / CLOCK_TICKS
+        sample['cpu.system'] = int(values[12]) / CLOCK_TICKS
+        sample['threads'] = int(values[17])
+        sample['rss'] = int(values[21]) * PAGESIZE
+
+        for line in _status.read().splitlines():
+            key, _, value = line.partition(':')
+            if key == 'voluntary_ctxt_switches':
+                sample['ctx_switches.voluntary'] = int(value)
+            elif key == 'nonvoluntary_ctxt_switches':
+                sample['ctx_switches.involuntary'] = int(value)
+
+        try:
+            # Don't count the directory's fd or our 2 open /proc files
+            sample['fds'] = len(os.listdir('/proc/self/fd')) - 3
+        except OSError:
+            pass
+
+    for gen, count in enumerate(gc.get_count()):
+        sample['gc.objects.gen%d' % gen] = count
+    if _gc_timer.installed:
+        for gen, count in enumerate(_gc_timer.collections):
+            sample['gc.collections.gen%d' % gen] = count
+        sample['gc.time'] = _gc_timer.time
+    return sample
+
+
+#: Shared by every ProcessStats field so /proc is read once per interval
+process_source = sampler.Source(sample_process)
+
+#: Interval explicitly requested by a ProcessStats instance, if any
+_requested_interval = None
+
+
+def _field(key, label):
+    return fields.CallbackGaugeField(operator.itemgetter(key), label=label,
+                                     source=process_source)
+
+
+class ProcessStats(MmStats):
+    """Opt-in model publishing process and Python interpreter metrics
+
+    Values are sampled every `interval` seconds by the shared background
+    sampler thread. The interval applies to every ProcessStats instance in
+    the process, so a RuntimeWarning is issued when instances request
+    different intervals.
+
+    Since the values are process wide create a single instance and don't
+    access it from other threads:
+
+    >>> proc_stats = ProcessStats(filename='{CMD}-{PID}-process.mmstats')
+
+    CPU times are in seconds and RSS is in bytes. Garbage collection counts
+    and times are only published on Python 3.3+.
+    """
+    rss = _field('rss', 'sys.rss')
+    cpu_user = _field('cpu.user', 'sys.cpu.user')
+    cpu_system = _field('cpu.system', 'sys.cpu.system')
+    fds = _field('fds', 'sys.fds')
+    threads = _field('threads', 'sys.threads')
+    ctx_voluntary = _field('ctx_switches.voluntary',
+                           'sys.ctx_switches.voluntary')
+    ctx_involuntary = _field('ctx_switches.involuntary',
+                             'sys.ctx_switches.involuntary')
+    gc_objects0 = _field('gc.objects.gen0', 'org.python.gc.objects.gen0')
+    gc_objects1 = _field('gc.objects.gen1', 'org.python.gc.objects.gen1')
+    gc_objects2 = _field('gc.objects.gen2', 'org.python.gc.objects.gen2')
+    if hasattr(gc, 'callbacks'):
+        # Collections can only be observed with gc.callbacks, so these
+        # fields would always be 0 on older Pythons
+        gc_collections0 = _field('gc.collections.gen0',
+                                 'org.python.gc.collections.gen0')
+        gc_collections1 = _field('gc.collections.gen1',
+                                 'org.python.gc.collections.gen1')
+        gc_collections2 = _field('gc.collections.gen2',
+                                 'org.python.gc.collections.gen2')
+        gc_time = _field('gc.time', 'org.python.gc.time')
+
+    def __init__(self, interval=None, **kwargs):
+        global _requested_interval
+        if interval is not None:
+            if _requested_interval not in (None, interval):
+                warnings.warn(
+                    "ProcessStats interval changed from %r to %r for every "
+                    "instance" % (_requested_interval, interval),
+                    RuntimeWarning
+                )
+            _requested_interval = process_source.interval = interval
+        _gc_timer.install()
+        super(ProcessStats, self).__init__(**kwargs)
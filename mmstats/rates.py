@@ -0,0 +1,395 @@
+"""Deltas and per-second rates of numeric fields across many files
+
+Take a :class:`Sample` of the files every interval and compare consecutive
+samples with :func:`deltas`::
+
+    prev = rates.Sample.from_readers(watcher.readers, labels=['requests'])
+    time.sleep(1)
+    cur = rates.Sample.from_readers(watcher.readers, labels=['requests'])
+    print rates.deltas(prev, cur).rates()
+
+Counters are fields whose type has an explicit count of 1 such as
+:class:`~mmstats.fields.CounterField`'s ``1Q``. When a counter decreases its
+writer is assumed to have restarted and the delta is the counter's new value,
+unless the counter is 32 bits or narrower (such as
+:class:`~mmstats.fields.Counter32Field`) and wrapping around its maximum
+explains the change with less than half its range. Every other integer and
+floating point field is a gauge whose deltas are plain (possibly negative)
+differences. Other fields are ignored.
+
+Files in only one of the samples are left out of the deltas. Values and
+deltas can be aggregated across files, optionally grouped by any key such as
+a file's ``sys.pid``::
+
+    deltas.aggregate('p99', groups={filename: pid, ...})
+
+The arithmetic is vectorized with NumPy when it's installed.
+"""
+import time as _time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: Bits of counter struct types
+COUNTER_BITS = {'1B': 8, '1H': 16, '1I': 32, '1L': 32, '1Q': 64}
+#: Integer and floating point (gauge) struct types
+GAUGE_TYPES = frozenset('bBhHiIlLqQfd')
+# Types stored as uint64 by NumPy
+_UNSIGNED_TYPES = frozenset(COUNTER_BITS) | frozenset('BHILQ')
+#: Aggregations across files besides percentiles, which are ``pNN``
+AGGREGATES = ('sum', 'avg', 'min', 'max')
+
+
+def percentile(how):
+    """Return the percentile of a ``pNN`` aggregation or None"""
+    if not how.startswith('p'):
+        return None
+    try:
+        q = float(how[1:])
+    except ValueError:
+        return None
+    return q if 0 <= q <= 100 else None
+
+
+def check_aggregate(how):
+    """Raise ValueError if `how` isn't a valid aggregation"""
+    if how not in AGGREGATES and percentile(how) is None:
+        raise ValueError('aggregation must be one of %s or pNN: %r' % (
+                         ', '.join(AGGREGATES), how))
+
+
+def _counter_delta(prev, cur, bits):
+    """Return the delta and whether the counter was reset"""
+    if cur >= prev:
+        return cur - prev, False
+    if bits < 64:
+        wrapped = (cur - prev) % (1 << bits)
+        if wrapped < 1 << (bits - 1):
+            return wrapped, False
+    return cur, True
+
+
+class Sample(object):
+    """Numeric field values of many files at a point in time"""
+
+    def __init__(self, time=None):
+        #: Seconds since the epoch the sample was taken
+        self.time = _time.time() if time is None else time
+        #: Filenames in the order they were added
+        self.files = []
+        #: label -> struct type character
+        self.types = {}
+        # label -> ([row], [value]) where row indexes files
+        self._columns = {}
+        # label -> (values, has value) NumPy arrays over every row
+        self._arrays = {}
+
+    @classmethod
+    def from_readers(cls, readers, labels=None, prefixes=None, time=None):
+        """Sample every :class:`~mmstats.reader.LayoutReader` in `readers`
+
+        `readers` is a dict or a list of (filename, reader) pairs like
+        :attr:`Watcher.readers <mmstats.watcher.Watcher.readers>`. `labels`
+        and `prefixes` select fields like
+        :meth:`~mmstats.reader.LayoutReader.read`. Unreadable files are
+        skipped.
+        """
+        sample = cls(time)
+        if isinstance(readers, dict):
+            readers = readers.items()
+        for fn, r in readers:
+            try:
+                layout = r.selected_layout(labels, prefixes)
+                values = layout.values(r.data)
+            except Exception:
+                # Probably being reinitialized by its writer or closed
+                continue
+            sample.add(fn, layout, values)
+        return sample
+
+    def __len__(self):
+        return len(self.files)
+
+    def add(self, fn, layout, values):
+        """Add `fn`'s `values` which were read with
+        :class:`~mmstats.reader.Layout` `layout`"""
+        row = len(self.files)
+        self.files.append(fn)
+        self._arrays.clear()
+        for f, value in zip(layout.fields, values):
+            type_ = f.type_signature
+            if f.array_size is not None or (type_ not in COUNTER_BITS and
+                                            type_ not in GAUGE_TYPES):
+                continue
+            if self.types.setdefault(f.label, type_) != type_:
+                # Files disagree on the label's type so ignore it
+                continue
+            rows, column = self._columns.setdefault(f.label, ([], []))
+            rows.append(row)
+            column.append(value)
+
+    def totals(self):
+        """Return a dict of label to the sum of its values"""
+        return dict((label, sum(column))
+                    for label, (_, column) in self._columns.iteritems())
+
+    def aggregate(self, how='sum', groups=None):
+        """Return a dict of group to a dict of label to its values
+        aggregated across files
+
+        See :func:`aggregate`.
+        """
+        columns = []
+        for label, (rows, column) in self._columns.iteritems():
+            if numpy is not None:
+                values, has = self._array(label)
+                rows = numpy.flatnonzero(has)
+                column = values[rows]
+            columns.append((label, rows, column))
+        return aggregate(self.files, columns, how, groups)
+
+    def _array(self, label):
+        arrays = self._arrays.get(label)
+        if arrays is None:
+            rows, column = self._columns[label]
+            type_ = self.types[label]
+            if type_ in _UNSIGNED_TYPES:
+                dtype = 'u8'
+            elif type_ in ('f', 'd'):
+                dtype = 'f8'
+            else:
+                dtype = 'i8'
+            # fromiter converts lists far faster than assigning them
+            column = numpy.fromiter(column, dtype, len(column))
+            if len(rows) == len(self.files):
+                values = column
+                has = numpy.ones(len(self.files), dtype=bool)
+            else:
+                rows = numpy.fromiter(rows, numpy.intp, len(rows))
+                values = numpy.zeros(len(self.files), dtype=dtype)
+                values[rows] = column
+                has = numpy.zeros(len(self.files), dtype=bool)
+                has[rows] = True
+            arrays = self._arrays[label] = values, has
+        return arrays
+
+
+class Deltas(object):
+    """Changes of numeric fields between two samples"""
+
+    def __init__(self, elapsed, files):
+        #: Seconds between the samples
+        self.elapsed = elapsed
+        #: Filenames in both samples
+        self.files = files
+        #: label -> number of counters which were reset
+        self.resets = {}
+        # label -> ([row], [delta]) where row indexes files
+        self._columns = {}
+
+    def totals(self):
+        """Return a dict of label to the sum of its deltas"""
+        totals = {}
+        for label, (_, column) in self._columns.iteritems():
+            total = column.sum() if hasattr(column, 'sum') else sum(column)
+            totals[label] = total.item() if hasattr(total, 'item') else total
+        return totals
+
+    def rates(self):
+        """Return a dict of label to the per second rate of its total
+
+        Rates are 0 if no time elapsed.
+        """
+        if self.elapsed <= 0:
+            return dict.fromkeys(self._columns, 0.0)
+        return dict((label, total / float(self.elapsed))
+                    for label, total in self.totals().iteritems())
+
+    def aggregate(self, how='sum', groups=None, per_second=False):
+        """Return a dict of group to a dict of label to its deltas
+        aggregated across files
+
+        If `per_second` is True the aggregated deltas are divided by the
+        elapsed time. See :func:`aggregate`.
+        """
+        result = aggregate(self.files, ((label, rows, column) for label,
+                           (rows, column) in self._columns.iteritems()),
+                           how, groups)
+        if per_second:
+            for values in result.itervalues():
+                for label, value in values.iteritems():
+                    values[label] = (value / float(self.elapsed)
+                                     if self.elapsed > 0 else 0.0)
+        return result
+
+    def by_file(self):
+        """Return a dict of filename to a dict of label to delta"""
+        result = dict((fn, {}) for fn in self.files)
+        for label, (rows, column) in self._columns.iteritems():
+            if hasattr(rows, 'tolist'):
+                rows, column = rows.tolist(), column.tolist()
+            for row, delta in zip(rows, column):
+                result[self.files[row]][label] = delta
+        return result
+
+
+def _labels(prev, cur):
+    """Labels in both samples with the same type"""
+    return [label for label, type_ in cur.types.iteritems()
+            if prev.types.get(label) == type_]
+
+
+def _python_deltas(prev, cur, pairs, result):
+    for label in _labels(prev, cur):
+        prev_values = dict(zip(*prev._columns[label]))
+        cur_values = dict(zip(*cur._columns[label]))
+        bits = COUNTER_BITS.get(cur.types[label])
+        rows, column, resets = [], [], 0
+        for row, (p, c) in enumerate(pairs):
+            if p not in prev_values or c not in cur_values:
+                continue
+            if bits is None:
+                delta = cur_values[c] - prev_values[p]
+            else:
+                delta, reset = _counter_delta(prev_values[p], cur_values[c],
+                                              bits)
+                resets += reset
+            rows.append(row)
+            column.append(delta)
+        result._columns[label] = rows, column
+        result.resets[label] = resets
+
+
+def _numpy_deltas(prev, cur, pairs, result):
+    prev_idx = numpy.fromiter((p for p, _ in pairs), numpy.intp, len(pairs))
+    cur_idx = numpy.fromiter((c for _, c in pairs), numpy.intp, len(pairs))
+    for label in _labels(prev, cur):
+        prev_values, prev_has = prev._array(label)
+        cur_values, cur_has = cur._array(label)
+        rows = numpy.flatnonzero(prev_has[prev_idx] & cur_has[cur_idx])
+        p = prev_values[prev_idx[rows]]
+        c = cur_values[cur_idx[rows]]
+        type_ = cur.types[label]
+        bits = COUNTER_BITS.get(type_)
+        resets = 0
+        if bits is None:
+            deltas = c - p
+            if type_ in _UNSIGNED_TYPES:
+                # Unsigned gauges may decrease
+                deltas = deltas.view('i8')
+        else:
+            # Unsigned subtraction wraps around modulo 2**64
+            deltas = c - p
+            if bits < 64:
+                deltas &= numpy.uint64((1 << bits) - 1)
+            reset = c < p
+            if bits < 64:
+                reset &= deltas >= numpy.uint64(1 << (bits - 1))
+            resets = int(reset.sum())
+            if resets:
+                deltas = numpy.where(reset, c, deltas)
+        result._columns[label] = rows, deltas
+        result.resets[label] = resets
+
+
+def deltas(prev, cur):
+    """Return the :class:`Deltas` from Sample `prev` to Sample `cur`"""
+    if prev.files == cur.files:
+        # Usually the same files are sampled in the same order
+        pairs = [(row, row) for row in xrange(len(cur.files))]
+    else:
+        prev_rows = dict((fn, row) for row, fn in enumerate(prev.files))
+        pairs = [(prev_rows[fn], row) for row, fn in enumerate(cur.files)
+                 if fn in prev_rows]
+    result = Deltas(cur.time - prev.time, [cur.files[c] for _, c in pairs])
+    if numpy is not None:
+        _numpy_deltas(prev, cur, pairs, result)
+    else:
+        _python_deltas(prev, cur, pairs, result)
+    return result
+
+
+def _aggregate_values(values, how, q):
+    if how == 'sum':
+        return sum(values)
+    if how == 'avg':
+        return sum(values) / float(len(values))
+    if how == 'min':
+        return min(values)
+    if how == 'max':
+        return max(values)
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+def _numpy_aggregate(codes, values, how, q):
+    """Return the codes present and the aggregate of each one's values"""
+    # Sort by group and then value so each group is a sorted slice
+    order = numpy.lexsort((values, codes))
+    codes = codes[order]
+    values = values[order]
+    starts = numpy.flatnonzero(numpy.concatenate(
+        ([True], codes[1:] != codes[:-1])))
+    counts = numpy.diff(numpy.append(starts, len(values)))
+    if how == 'sum':
+        result = numpy.add.reduceat(values, starts)
+    elif how == 'avg':
+        result = numpy.add.reduceat(values, starts) / counts.astype('f8')
+    elif how == 'min':
+        result = values[starts]
+    elif how == 'max':
+        result = values[starts + counts - 1]
+    else:
+        # Linear interpolation between the closest ranks
+        pos = starts + (counts - 1) * (q / 100.0)
+        lo = numpy.floor(pos).astype(numpy.intp)
+        hi = numpy.minimum(lo + 1, starts + counts - 1)
+        values = values.astype('f8')
+        result = values[lo] + (values[hi] - values[lo]) * (pos - lo)
+    return codes[starts], result
+
+
+def aggregate(files, columns, how='sum', groups=None):
+    """Return a dict of group to a dict of label to aggregated values
+
+    `columns` is an iterable of (label, rows, values) where `rows` index
+    `files`. `how` is one of :data:`AGGREGATES` or ``pNN`` for the NNth
+    percentile. `groups` is a dict of filename to the file's group. Files
+    missing from it and every file if it's None are in the None group. Each
+    label is aggregated in a single pass over every group.
+    """
+    check_aggregate(how)
+    q = percentile(how)
+    if groups is None:
+        keys, codes = [None], [0] * len(files)
+    else:
+        index = {}
+        codes = [index.setdefault(groups.get(fn), len(index)) for fn in files]
+        keys = sorted(index, key=index.get)
+
+    result = {}
+    numpy_codes = None
+    for label, rows, values in columns:
+        if len(rows) == 0:
+            continue
+        if hasattr(values, 'dtype'):
+            if numpy_codes is None:
+                numpy_codes = numpy.fromiter(codes, numpy.intp, len(codes))
+            present, aggregated = _numpy_aggregate(
+                numpy_codes[rows], values, how, q)
+            pairs = zip(present.tolist(), aggregated.tolist())
+        else:
+            grouped = {}
+            for row, value in zip(rows, values):
+                grouped.setdefault(codes[row], []).append(value)
+            pairs = [(code, _aggregate_values(group, how, q))
+                     for code, group in grouped.iteritems()]
+        for code, value in pairs:
+            result.setdefault(keys[code], {})[label] = value
+    return result
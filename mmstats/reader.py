@@ -1,11 +1,46 @@
 """mmstats reader implementation"""
 from collections import namedtuple
+import hashlib
 import mmap
 import struct
+import time
+import zlib
+
+from . import defaults
 
 
 VERSION_1 = '\x01'
+VERSION_2 = '\x02'
+VERSIONS = (VERSION_1, VERSION_2)
 UNBUFFERED_FIELD = 255
+ARRAY_FIELD = 254
+
+# Version 2 files follow the version byte with the number of fields, the
+# offset just past the last field, and flags, then an index entry per field
+# sorted by label hash
+_v2_header = struct.Struct('=III')
+_index_entry = struct.Struct('=II')
+#: Version 2 header flag set when writers track changes. The index is followed
+#: by a generation counter bumped on every write and a change flag byte per
+#: field in file order.
+TRACK_CHANGES = 1
+_generation = struct.Struct('=Q')
+# Ring array fields follow their marker byte with the write index, array
+# size, and number of values written (up to the array size)
+_array_header = struct.Struct('=HHH')
+
+#: Label of the unbuffered ``Q`` field writers place first in every file. Its
+#: value fingerprints the labels, types, and offsets of all fields so readers
+#: can share parsed layouts between files. Readers don't return it as a stat.
+LAYOUT_LABEL = 'mmstats.layout'
+_layout_record = struct.Struct('=H%dsHsBQ' % len(LAYOUT_LABEL))
+_layout_header = (len(LAYOUT_LABEL), LAYOUT_LABEL, 1, 'Q', UNBUFFERED_FIELD)
+LAYOUT_RECORD_SIZE = _layout_record.size
+
+# Process wide cache of parsed layouts keyed by fingerprint
+_layouts = {}
+MAX_CACHED_LAYOUTS = 1024
+MAX_CACHED_SELECTIONS = 128
 
 
 def reader(fmt):
@@ -26,11 +61,475 @@ read_ubyte = reader('B')
 
 Stat = namedtuple('Stat', ('label', 'value'))
 
+#: A field in a :class:`Layout`. `start` is the offset of the field's
+#: structure and `offset` is the offset of its write buffer byte; values
+#: immediately follow it. `array_size` is None unless it's a ring array.
+LayoutField = namedtuple('LayoutField',
+        ('label', 'type_signature', 'start', 'offset', 'buffered',
+         'array_size'))
+
 
 class InvalidMmStatsVersion(Exception):
     """Unsupported mmstats version"""
 
 
+_ushort = struct.Struct('H')
+_ubyte = struct.Struct('B')
+
+
+def _decode(value):
+    """Strings are \x00 padded utf8"""
+    return value.split('\x00', 1)[0].decode('utf8', 'ignore')
+
+
+def _chronological(slots, write_index, filled):
+    """Return the `filled` newest values of a ring array's slots, oldest
+    first
+
+    The slot at `write_index` is being written and is skipped.
+    """
+    ordered = slots[write_index + 1:] + slots[:write_index]
+    return list(ordered[len(ordered) - filled:])
+
+
+def _field_size(type_signature, buffered, array_size):
+    """Return the size of a field's data following its write buffer byte"""
+    size = struct.calcsize(type_signature)
+    if array_size is not None:
+        return _array_header.size + size * (array_size + 1)
+    return size * (2 if buffered else 1)
+
+
+def layout_fingerprint(fields, end):
+    """Return the fingerprint for an iterable of (label, type signature,
+    offset) tuples in file order and the offset just past the last field
+
+    Labels should be utf8 encoded.
+    """
+    digest = hashlib.md5()
+    for label, type_signature, offset in fields:
+        digest.update('%s\x00%s\x00%d\x00' % (label, type_signature, offset))
+    # The end covers the size of the last field such as ring arrays'
+    digest.update('%d' % end)
+    # 0 means no fingerprint
+    return struct.unpack('=Q', digest.digest()[:8])[0] or 1
+
+
+def label_hash(label):
+    """Return the index hash of a utf8 encoded label"""
+    return zlib.crc32(label) & 0xffffffff
+
+
+def changes_offset(field_count):
+    """Return the offset of the generation counter in a version 2 file which
+    tracks changes
+    """
+    return 1 + _v2_header.size + _index_entry.size * field_count
+
+
+def header_size(version, field_count, track_changes=False):
+    """Return the offset of the first field in a file
+
+    `version` is the version number and `field_count` includes the layout
+    fingerprint field.
+    """
+    if version == 1:
+        return 1
+    size = changes_offset(field_count)
+    if track_changes:
+        size += _generation.size + field_count
+    return size
+
+
+def write_header(buf, fields, end, track_changes=False):
+    """Write a version 2 header and index (but not the version byte)
+
+    `fields` is an iterable of (utf8 label, offset) tuples and `end` the
+    offset just past the last field.
+    """
+    entries = sorted((label_hash(label), offset) for label, offset in fields)
+    flags = TRACK_CHANGES if track_changes else 0
+    _v2_header.pack_into(buf, 1, len(entries), end, flags)
+    pos = 1 + _v2_header.size
+    for entry in entries:
+        _index_entry.pack_into(buf, pos, *entry)
+        pos += _index_entry.size
+
+
+def _fields_start(buf):
+    """Return the offset of the first field and the end of the fields (None
+    if unknown)
+    """
+    if buf[0] == VERSION_2:
+        count, end, flags = _v2_header.unpack_from(buf, 1)
+        return header_size(2, count, flags & TRACK_CHANGES), end
+    return 1, None
+
+
+def read_changes(buf):
+    """Return the generation and offset of the change flags in `buf` or
+    None if its writer doesn't track changes
+    """
+    if buf[0] != VERSION_2:
+        return None
+    count, _, flags = _v2_header.unpack_from(buf, 1)
+    if not flags & TRACK_CHANGES:
+        return None
+    offset = changes_offset(count)
+    return (_generation.unpack_from(buf, offset)[0],
+            offset + _generation.size)
+
+
+def write_layout_record(buf, fingerprint, offset=1):
+    """Write the layout fingerprint field at `offset` in `buf`"""
+    _layout_record.pack_into(buf, offset,
+                             *(_layout_header + (fingerprint,)))
+
+
+def read_fingerprint(buf):
+    """Return the layout fingerprint stamped in `buf` or None"""
+    if not len(buf):
+        return None
+    if buf[0] == VERSION_2:
+        if len(buf) < 1 + _v2_header.size:
+            return None
+        offset = _fields_start(buf)[0]
+    else:
+        offset = 1
+    if len(buf) < offset + LAYOUT_RECORD_SIZE:
+        return None
+    record = _layout_record.unpack_from(buf, offset)
+    if record[:-1] != _layout_header or not record[-1]:
+        return None
+    return record[-1]
+
+
+def get_layout(buf):
+    """Return the :class:`Layout` for `buf`
+
+    Layouts of files with a fingerprint are cached process wide, so files
+    written by the same model only need their fields parsed once.
+    """
+    fingerprint = read_fingerprint(buf)
+    if fingerprint is not None:
+        layout = _layouts.get(fingerprint)
+        if layout is not None and len(buf) >= layout.end:
+            return layout
+
+    layout = parse_layout(buf)
+    if fingerprint is not None and fingerprint == layout.fingerprint:
+        if len(_layouts) >= MAX_CACHED_LAYOUTS:
+            _layouts.clear()
+        _layouts[fingerprint] = layout
+    return layout
+
+
+def _parse_field(buf, start):
+    """Parse the field at `start` and return it and the offset of the next
+    field
+    """
+    offset = start + 2
+    label_sz = _ushort.unpack_from(buf, start)[0]
+    label = buf[offset:offset + label_sz].decode('utf8', 'ignore')
+    offset += label_sz
+    type_sz = _ushort.unpack_from(buf, offset)[0]
+    offset += 2
+    type_ = buf[offset:offset + type_sz]
+    offset += type_sz
+    write_buffer = _ubyte.unpack_from(buf, offset)[0]
+    array_size = None
+    if write_buffer == ARRAY_FIELD:
+        array_size = _array_header.unpack_from(buf, offset + 1)[1]
+    buffered = write_buffer not in (UNBUFFERED_FIELD, ARRAY_FIELD)
+    field = LayoutField(label, type_, start, offset, buffered, array_size)
+    return field, offset + 1 + _field_size(type_, buffered, array_size)
+
+
+def parse_layout(buf):
+    """Parse the fields of an mmstats file into a :class:`Layout`
+
+    `buf` may be anything supporting the buffer interface such as an mmap.
+    Only labels are copied out of `buf`.
+    """
+    version = buf[0]
+    if version not in VERSIONS:
+        raise InvalidMmStatsVersion(repr(version))
+    fields = []
+    offset, end = _fields_start(buf)
+    size = len(buf) if end is None else min(end, len(buf))
+    while offset + 2 <= size:
+        if not _ushort.unpack_from(buf, offset)[0]:
+            # EOF
+            break
+        field, offset = _parse_field(buf, offset)
+        fields.append(field)
+    if fields and fields[0].label == LAYOUT_LABEL:
+        # The fingerprint covers its own field but isn't a stat
+        fingerprint = layout_fingerprint(
+            ((f.label.encode('utf8'), f.type_signature, f.start)
+             for f in fields), offset)
+        return Layout(fields[1:], offset, fingerprint, version, hidden=1)
+    return Layout(fields, offset, version=version)
+
+
+def find_field(buf, label):
+    """Return the :class:`LayoutField` labeled `label` in `buf` or None
+
+    Version 2 files are looked up in their index so only the matching field
+    is parsed. Version 1 files are scanned.
+    """
+    if buf[0] != VERSION_2:
+        for field in parse_layout(buf).fields:
+            if field.label == label:
+                return field
+        return None
+
+    if isinstance(label, unicode):
+        label = label.encode('utf8')
+    target = label_hash(label)
+    count = _v2_header.unpack_from(buf, 1)[0]
+    base = 1 + _v2_header.size
+    # Binary search for the first entry with the label's hash
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _index_entry.unpack_from(buf, base + mid * _index_entry.size)[0] \
+                < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    # Hashes may collide so check every entry with a matching hash
+    for i in xrange(lo, count):
+        hash_, offset = _index_entry.unpack_from(
+            buf, base + i * _index_entry.size)
+        if hash_ != target:
+            break
+        field = _parse_field(buf, offset)[0]
+        if field.label.encode('utf8') == label:
+            return field
+    return None
+
+
+def read_value(buf, label):
+    """Return the value of the field labeled `label` in `buf`
+
+    Raises KeyError if there is no such field.
+    """
+    field = find_field(buf, label)
+    if field is None:
+        raise KeyError(label)
+    if field.array_size is not None:
+        return read_array(buf, field)
+    value_struct = struct.Struct('=' + field.type_signature)
+    offset = field.offset + 1
+    if field.buffered:
+        # Stored buffer is the *write* buffer so read the other one
+        write_buffer = _ubyte.unpack_from(buf, field.offset)[0]
+        offset += (write_buffer ^ 1) * value_struct.size
+    value = value_struct.unpack_from(buf, offset)[0]
+    if isinstance(value, str):
+        value = _decode(value)
+    return value
+
+
+def read_array(buf, field, retries=3):
+    """Return the values of the ring array `field` in `buf` oldest first
+
+    Retries if the writer appends while the array is read.
+    """
+    array_struct = struct.Struct('=HHH%d%s' % (field.array_size + 1,
+                                               field.type_signature))
+    for _ in xrange(retries):
+        raw = array_struct.unpack_from(buf, field.offset + 1)
+        if _ushort.unpack_from(buf, field.offset + 1)[0] == raw[0]:
+            break
+    return _chronological(raw[3:], raw[0], raw[2])
+
+
+class Layout(object):
+    """Compiled table of an mmstats file's fields
+
+    Reading values from a layout is a single ``struct.unpack_from`` call
+    directly on the mmap regardless of the number of fields.
+    """
+
+    def __init__(self, fields, end, fingerprint=None, version=VERSION_1,
+                 hidden=0):
+        self.fields = tuple(fields)
+        #: Number of leading fields in the file left out of `fields` (the
+        #: layout fingerprint)
+        self.hidden = hidden
+        self.labels = tuple(f.label for f in self.fields)
+        #: Offset just past the last field
+        self.end = end
+        if fingerprint is None:
+            fingerprint = layout_fingerprint(
+                ((f.label.encode('utf8'), f.type_signature, f.start)
+                 for f in self.fields), end)
+        self.fingerprint = fingerprint
+        #: Version byte of files with this layout
+        self.version = version
+        self._selections = {}
+        # Single field layouts for field_values() created on demand
+        self._field_layouts = None
+        self._compile()
+
+    def _compile(self):
+        # '=' avoids alignment padding as fields are packed
+        values_fmt = ['=']
+        check_fmt = ['=']
+        self._expected = []
+        wb_fmt = ['=']
+        # (kind, is string, array size) per field in unpacked order where
+        # kind is 'u'nbuffered, 'b'uffered, or 'a'rray
+        self._kinds = []
+        # Indexes of buffered fields
+        self._buffered = []
+        pos = check_pos = wb_pos = 0
+        for i, f in enumerate(self.fields):
+            if f.offset > pos:
+                values_fmt.append('%dx' % (f.offset - pos))
+            if f.array_size is not None:
+                values_fmt.append('xHHH%d%s' % (f.array_size + 1,
+                                                f.type_signature))
+                kind = 'a'
+            elif f.buffered:
+                values_fmt.append('B%s%s' % (f.type_signature,
+                                             f.type_signature))
+                self._buffered.append(i)
+                wb_fmt.append('%dxB' % (f.offset - wb_pos))
+                wb_pos = f.offset + 1
+                kind = 'b'
+            else:
+                values_fmt.append('x%s' % f.type_signature)
+                kind = 'u'
+            pos = f.offset + 1 + _field_size(f.type_signature, f.buffered,
+                                             f.array_size)
+            self._kinds.append((kind, f.type_signature.endswith('s'),
+                                f.array_size))
+
+            # Label and type signature sizes are used to validate the layout
+            label_sz = f.offset - len(f.type_signature) - 4 - f.start
+            if f.start > check_pos:
+                check_fmt.append('%dx' % (f.start - check_pos))
+            check_fmt.append('H%dxH' % label_sz)
+            check_pos = f.offset - len(f.type_signature)
+            self._expected.extend((label_sz, len(f.type_signature)))
+        self._struct = struct.Struct(''.join(values_fmt))
+        self._wb_struct = struct.Struct(''.join(wb_fmt))
+        self._check = struct.Struct(''.join(check_fmt))
+        self._expected = tuple(self._expected)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def field_values(self, buf, indexes):
+        """Return a list of values from `buf` of the fields at `indexes`
+
+        Only those fields are decoded.
+        """
+        if self._field_layouts is None:
+            self._field_layouts = [
+                Layout([f], self.end, self.fingerprint, self.version,
+                       self.hidden)
+                for f in self.fields]
+        return [self._field_layouts[i].values(buf)[0] for i in indexes]
+
+    def select(self, labels=(), prefixes=()):
+        """Return a layout of the fields matching `labels` or `prefixes`
+
+        Reading values from the selection skips every other field. It's
+        validated against files the same as its parent layout. Selections
+        are cached.
+        """
+        key = (frozenset(labels), tuple(prefixes))
+        selection = self._selections.get(key)
+        if selection is None:
+            fields = [f for f in self.fields
+                      if f.label in key[0] or f.label.startswith(key[1])]
+            if len(self._selections) >= MAX_CACHED_SELECTIONS:
+                self._selections.clear()
+            selection = self._selections[key] = Layout(
+                fields, self.end, self.fingerprint, self.version, self.hidden)
+            # Files are validated against every field
+            selection._check = self._check
+            selection._expected = self._expected
+        return selection
+
+    def valid(self, buf):
+        """Cheaply check if `buf` still has this layout"""
+        if len(buf) < self.end or buf[0] != self.version:
+            return False
+        fingerprint = read_fingerprint(buf)
+        if fingerprint is not None:
+            return fingerprint == self.fingerprint
+        if self._check.unpack_from(buf) != self._expected:
+            return False
+        # No fields should have been appended
+        return not buf[self.end:self.end + 2].strip('\x00')
+
+    def values(self, buf):
+        """Return a list of values from `buf` in field order"""
+        raw = self._struct.unpack_from(buf)
+        values = []
+        append = values.append
+        i = 0
+        for kind, is_str, array_size in self._kinds:
+            if kind == 'b':
+                # Stored buffer is the *write* buffer so read the other one
+                value = raw[i + 2] if raw[i] == 0 else raw[i + 1]
+                i += 3
+            elif kind == 'u':
+                value = raw[i]
+                i += 1
+            else:
+                end = i + 4 + array_size
+                # Ring array values are never strings
+                append(_chronological(raw[i + 3:end], raw[i], raw[i + 2]))
+                i = end
+                continue
+            if is_str:
+                value = _decode(value)
+            append(value)
+        return values
+
+    def snapshot(self, buf, retries=3):
+        """Return a dict of label to value from a consistent copy of `buf`
+
+        The fields are copied out of `buf` at once and parsed from the copy.
+        Buffered fields whose write buffer was flipped while copying may be
+        torn, so they're reread individually.
+        """
+        copy = buf[:self.end]
+        values = self.values(copy)
+        before = self._wb_struct.unpack_from(copy)
+        after = self._wb_struct.unpack_from(buf)
+        if before != after:
+            for i, old, new in zip(self._buffered, before, after):
+                if old != new:
+                    values[i] = self._reread(buf, self.fields[i], retries)
+        return dict(zip(self.labels, values))
+
+    def _reread(self, buf, field, retries):
+        """Read a single buffered field retrying if its buffer flips"""
+        value_struct = struct.Struct('=' + field.type_signature)
+        for _ in xrange(retries):
+            write_buffer = _ubyte.unpack_from(buf, field.offset)[0]
+            read_offset = (field.offset + 1 +
+                           (write_buffer ^ 1) * value_struct.size)
+            value = value_struct.unpack_from(buf, read_offset)[0]
+            if _ubyte.unpack_from(buf, field.offset)[0] == write_buffer:
+                break
+        if isinstance(value, str):
+            value = _decode(value)
+        return value
+
+    def stats(self, buf):
+        """Return a list of :class:`Stat` from `buf`"""
+        return [Stat(label, value)
+                for label, value in zip(self.labels, self.values(buf))]
+
+
 class MmStatsReader(object):
     def __init__(self, data):
         """`data` should be a file-like object (mmap or file)"""
@@ -38,6 +537,14 @@ class MmStatsReader(object):
         rawver = self.data.read(1)
         if rawver == VERSION_1:
             self.version = 1
+        elif rawver == VERSION_2:
+            self.version = 2
+            # Skip the header, index, and change flags as fields are read
+            # sequentially
+            count, _, flags = _v2_header.unpack(
+                self.data.read(_v2_header.size))
+            skip = header_size(2, count, flags & TRACK_CHANGES)
+            self.data.read(skip - 1 - _v2_header.size)
         else:
             raise InvalidMmStatsVersion(repr(rawver))
 
@@ -71,6 +578,16 @@ class MmStatsReader(object):
             buf_idx = read_ubyte(d)
             if buf_idx == UNBUFFERED_FIELD:
                 value = struct.unpack(type_, d.read(sz))[0]
+                if label == LAYOUT_LABEL:
+                    # Fingerprints aren't stats
+                    continue
+            elif buf_idx == ARRAY_FIELD:
+                write_idx, array_size, filled = _array_header.unpack(
+                    d.read(_array_header.size))
+                slots = struct.unpack('=%d%s' % (array_size + 1, type_),
+                                      d.read(sz * (array_size + 1)))
+                yield Stat(label, _chronological(slots, write_idx, filled))
+                continue
             else:
                 # Flip bit as the stored buffer is the *write* buffer
                 buf_idx ^= 1
@@ -88,3 +605,210 @@ class MmStatsReader(object):
         except Exception:
             # Don't worry about exceptions closing the file
             pass
+
+
+class LayoutReader(object):
+    """Reader for repeatedly reading the same mmstats file
+
+    The file's layout is parsed once and each read only unpacks values
+    directly from the mmap. The layout is cheaply revalidated on every read
+    and reparsed if the file has changed.
+    """
+
+    def __init__(self, data, writable=False):
+        """`data` should be an mmap (or any object supporting the buffer
+        interface)
+
+        `writable` data allows :meth:`read_changes` to clear change flags.
+        """
+        self.data = data
+        self.writable = writable
+        self.layout = get_layout(data)
+        # Layout and generation seen by the last read_changes() call
+        self._changes_layout = None
+        self._generation = None
+
+    @classmethod
+    def from_mmap(cls, fn, writable=False):
+        f = open(fn, 'r+b' if writable else 'rb')
+        try:
+            mmapf = mmap.mmap(f.fileno(), 0, access=(
+                mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ))
+        finally:
+            # The mmap keeps its own reference to the file
+            f.close()
+        try:
+            return cls(mmapf, writable)
+        except Exception:
+            mmapf.close()
+            raise
+
+    def _valid_layout(self):
+        """Return the current layout, reparsing it if it has changed"""
+        if not self.layout.valid(self.data):
+            self.layout = get_layout(self.data)
+        return self.layout
+
+    def selected_layout(self, labels=None, prefixes=None):
+        """Return the current :class:`Layout` of the fields selected by
+        `labels` and `prefixes` like :meth:`read`"""
+        layout = self._valid_layout()
+        if labels or prefixes:
+            layout = layout.select(labels or (), prefixes or ())
+        return layout
+
+    def read(self, labels=None, prefixes=None):
+        """Return a list of :class:`Stat` for every field
+
+        If `labels` or `prefixes` are given only fields with those labels or
+        whose labels start with one of the prefixes are read.
+        """
+        return self.selected_layout(labels, prefixes).stats(self.data)
+
+    def snapshot(self, labels=None, prefixes=None):
+        """Return a dict of label to value from a consistent copy
+
+        `labels` and `prefixes` select fields like :meth:`read`.
+        """
+        return self.selected_layout(labels, prefixes).snapshot(self.data)
+
+    def read_changes(self):
+        """Return a list of :class:`Stat` for fields written since the last
+        call
+
+        The first call returns every field. Files written with
+        ``track_changes=True`` return nothing if they haven't been written
+        to since. If the reader is writable only changed fields are decoded
+        and their change flags are cleared, so only one writable reader
+        should read changes from a file. Otherwise every field is returned
+        when any has changed.
+        """
+        layout = self._valid_layout()
+        if layout is not self._changes_layout:
+            # New or changed file so everything is new
+            self._changes_layout = layout
+            self._generation = None
+        changes = read_changes(self.data)
+        if changes is None:
+            return layout.stats(self.data)
+
+        generation, flags_offset = changes
+        # Flags of hidden fields are never read
+        flags_offset += layout.hidden
+        flags_end = flags_offset + len(layout)
+        if not self.writable:
+            if generation == self._generation:
+                return []
+            self._generation = generation
+            return layout.stats(self.data)
+
+        if self._generation is None:
+            self._generation = generation
+            # Clear flags *before* reading so no writes are missed
+            self.data[flags_offset:flags_end] = '\x00' * len(layout)
+            return layout.stats(self.data)
+        self._generation = generation
+
+        # Flags are scanned even if the generation is unchanged as sampler
+        # threads may race the owning thread's generation updates
+        flags = self.data[flags_offset:flags_end]
+        changed = []
+        i = flags.find('\x01')
+        while i != -1:
+            self.data[flags_offset + i] = '\x00'
+            changed.append(i)
+            i = flags.find('\x01', i + 1)
+        if not changed:
+            return []
+        values = layout.field_values(self.data, changed)
+        return [Stat(layout.labels[i], value)
+                for i, value in zip(changed, values)]
+
+    def change_token(self):
+        """Return a value which changes whenever the file is written
+
+        The generation of files written with ``track_changes=True``,
+        otherwise a copy of every field.
+        """
+        changes = read_changes(self.data)
+        if changes is not None:
+            return changes[0]
+        return self.data[:self._valid_layout().end]
+
+    def __iter__(self):
+        return iter(self.read())
+
+    def close(self):
+        try:
+            self.data.close()
+        except Exception:
+            # Don't worry about exceptions closing the file
+            pass
+
+
+def snapshot(fn, labels=None, prefixes=None):
+    """Return a dict of label to value from a consistent copy of `fn`
+
+    `labels` and `prefixes` select fields like :meth:`LayoutReader.read`.
+    """
+    r = LayoutReader.from_mmap(fn)
+    try:
+        return r.snapshot(labels, prefixes)
+    finally:
+        r.close()
+
+
+class ChangeWaiter(object):
+    """Waits for any of the files of a list of :class:`LayoutReader` to be
+    written
+
+    >>> waiter = ChangeWaiter(readers)
+    >>> while 1:
+    ...     for r in waiter.wait():
+    ...         print r.read()
+
+    Files are polled starting every `min_interval` seconds and backing off to
+    every `max_interval` seconds while they're idle, so busy files are
+    noticed quickly without using much CPU on idle ones. Polling files
+    written with ``track_changes=True`` only reads their generation. Every
+    other file has all of its fields copied and compared on every poll,
+    which costs as much as reading it, so files waited on should track
+    changes.
+    """
+
+    def __init__(self, readers,
+                 min_interval=defaults.DEFAULT_WAIT_MIN_INTERVAL,
+                 max_interval=defaults.DEFAULT_WAIT_MAX_INTERVAL):
+        self.readers = list(readers)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._tokens = [r.change_token() for r in self.readers]
+
+    def changed(self):
+        """Return the readers whose files changed since last checked"""
+        changed = []
+        for i, r in enumerate(self.readers):
+            token = r.change_token()
+            if token != self._tokens[i]:
+                self._tokens[i] = token
+                changed.append(r)
+        return changed
+
+    def wait(self, timeout=None):
+        """Block until any file changes and return the changed readers
+
+        Returns an empty list if no files changed within `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        interval = self.min_interval
+        while 1:
+            changed = self.changed()
+            if changed:
+                return changed
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                interval = min(interval, remaining)
+            time.sleep(interval)
+            interval = min(interval * 2, self.max_interval)
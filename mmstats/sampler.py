@@ -0,0 +1,167 @@
+"""Shared background thread for sampling callback driven fields"""
+import atexit
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from . import defaults
+
+
+class Source(object):
+    """A callback sampled every `interval` seconds
+
+    A source's result may be shared by many fields so expensive work (like
+    reading a file) happens once per interval. Each field registered with the
+    source converts the result to its value with its ``_sampled_value``
+    method.
+    """
+
+    def __init__(self, fn, interval=defaults.DEFAULT_SAMPLE_INTERVAL):
+        self.fn = fn
+        self.interval = interval
+
+    def __repr__(self):
+        return '%s(%r, interval=%r)' % (
+            self.__class__.__name__, self.fn, self.interval)
+
+
+class Sampler(object):
+    """Calls sources on their interval and writes the fields' values
+
+    A single daemon thread services every registered source. Each source is
+    called once per interval regardless of how many fields or model instances
+    (threads) publish it.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        # source -> {field: {state id: (mm_ptr, field state)}}
+        self._targets = {}
+        # heap of (due time, tiebreaker, source)
+        self._schedule = []
+        self._counter = itertools.count()
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+
+    def register(self, source, field, mm_ptr, state):
+        """Start writing `field`'s samples from `source` to the buffered
+        struct of the field's `state`
+        """
+        with self._cond:
+            fields = self._targets.get(source)
+            if fields is None:
+                # New sources are sampled immediately
+                fields = self._targets[source] = {}
+                self._push(time.time(), source)
+                self._cond.notify()
+            fields.setdefault(field, {})[id(state)] = (mm_ptr, state)
+            self._ensure_running()
+
+    def unregister(self, mm_ptr):
+        """Stop writing to any structs in the mmap at `mm_ptr`
+
+        Must be called before the mmap is unmapped or reused.
+        """
+        with self._cond:
+            for fields in self._targets.itervalues():
+                for field, targets in fields.items():
+                    for key, (ptr, _) in targets.items():
+                        if ptr == mm_ptr:
+                            del targets[key]
+                    if not targets:
+                        del fields[field]
+
+    def stop(self, timeout=1.0):
+        """Stop the sampling thread waiting up to `timeout` seconds for it"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def _push(self, due, source):
+        heapq.heappush(self._schedule, (due, next(self._counter), source))
+
+    def _ensure_running(self):
+        # Threads don't survive forking, so restart in child processes
+        if self._stopped or (
+                self._thread is not None and self._pid == os.getpid()):
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run,
+                                        name='mmstats-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _next_source(self):
+        """Wait for the next due source and reschedule it
+
+        Raises StopIteration once the sampler has been stopped.
+        """
+        with self._cond:
+            while 1:
+                if self._stopped:
+                    raise StopIteration
+                if not self._schedule:
+                    self._cond.wait()
+                    continue
+                due, _, source = self._schedule[0]
+                delay = due - time.time()
+                if delay <= 0:
+                    break
+                self._cond.wait(delay)
+            heapq.heappop(self._schedule)
+            if not self._targets.get(source):
+                # Every instance publishing this source is gone
+                self._targets.pop(source, None)
+                return None
+            # Keep a fixed schedule unless we've fallen a whole interval behind
+            now = time.time()
+            due += source.interval
+            if due < now:
+                due = now + source.interval
+            self._push(due, source)
+            return source
+
+    def _run(self):
+        while 1:
+            try:
+                source = self._next_source()
+            except StopIteration:
+                return
+            if source is None:
+                continue
+
+            # Callbacks are run without holding the lock
+            try:
+                sample = source.fn()
+            except Exception:
+                # Keep publishing the last good values
+                continue
+
+            with self._cond:
+                for field, targets in self._targets.get(source, {}).items():
+                    try:
+                        value = field._sampled_value(sample)
+                    except Exception:
+                        continue
+                    for _, state in targets.itervalues():
+                        struct = state._struct
+                        # Set the write buffer
+                        struct.buffers[struct.write_buffer] = value
+                        # Swap the write buffer
+                        struct.write_buffer ^= 1
+                        if state.changed is not None:
+                            # Flag the write for readers tracking changes
+                            state.changed.value = 1
+                            state.generation.value += 1
+
+
+_sampler = Sampler()
+# Daemon threads die noisily during interpreter shutdown
+atexit.register(_sampler.stop)
+register = _sampler.register
+unregister = _sampler.unregister
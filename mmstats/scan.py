@@ -0,0 +1,95 @@
+"""Parallel reading of many mmstats files
+
+Opening, mmapping, and parsing tens of thousands of files one after another
+is slow, so :func:`scan` spreads the work over a pool of threads or
+processes and yields files as they're read.
+"""
+import glob
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from . import defaults, reader
+
+
+def read_file(fn, labels=None, prefixes=None, cache=None):
+    """Return a list of :class:`~mmstats.reader.Stat` from `fn` or None if
+    it can't be read
+
+    `labels` and `prefixes` select fields like
+    :meth:`~mmstats.reader.LayoutReader.read`. If a
+    :class:`~mmstats.cache.ReaderCache` is given the file is read through
+    it.
+    """
+    if cache is not None:
+        try:
+            return cache.read(fn, labels, prefixes)
+        except Exception:
+            return None
+    try:
+        r = reader.LayoutReader.from_mmap(fn)
+    except Exception:
+        return None
+    try:
+        return r.read(labels, prefixes)
+    except Exception:
+        return None
+    finally:
+        r.close()
+
+
+def _read_file(args):
+    fn, labels, prefixes, cache = args
+    return fn, read_file(fn, labels, prefixes, cache)
+
+
+def imap(func, items, workers=None, processes=False, ordered=False):
+    """Yield ``func(item)`` for every item in `items` as they complete
+
+    `workers` threads are used unless `processes` is True, in which case
+    `func` and its arguments and results must be picklable. Threads only
+    parallelize the system calls of opening and mmapping files, while
+    processes also parallelize parsing. With 1 worker (or a single item)
+    `func` is called in the current thread. If `ordered` is True results are
+    yielded in the order of `items` instead.
+    """
+    if workers is None:
+        workers = defaults.DEFAULT_SCAN_WORKERS
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    workers = min(workers, len(items))
+    pool = (Pool if processes else ThreadPool)(workers)
+    try:
+        # Batch items so workers aren't starved by per item overhead
+        chunksize = max(1, len(items) // (workers * 4))
+        pool_imap = pool.imap if ordered else pool.imap_unordered
+        for result in pool_imap(func, items, chunksize):
+            yield result
+        pool.close()
+    finally:
+        # Stops workers if the caller stops iterating early
+        pool.terminate()
+        pool.join()
+
+
+def scan(files=None, labels=None, prefixes=None, workers=None,
+         processes=False, cache=None):
+    """Yield (filename, stats) for every file as it's read
+
+    `files` is a glob pattern or a list of filenames and defaults to
+    ``MMSTATS_GLOB``. `stats` is a list of :class:`~mmstats.reader.Stat`
+    or None if the file couldn't be read. See :func:`imap` for `workers` and
+    `processes`. Files are read through `cache` if it's given, which can't
+    be shared with processes.
+    """
+    if cache is not None and processes:
+        raise ValueError('caches cannot be shared with processes')
+    if files is None:
+        files = defaults.DEFAULT_GLOB
+    if isinstance(files, basestring):
+        files = glob.glob(files)
+    return imap(_read_file, ((fn, labels, prefixes, cache) for fn in files),
+                workers, processes)
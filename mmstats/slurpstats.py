@@ -1,11 +1,10 @@
 #!/usr/bin/env python
 import errno
 import glob
-import mmap
 import sys
 import traceback
 
-from mmstats import defaults, reader as mmstats_reader
+from mmstats import defaults, scan, reader as mmstats_reader
 
 
 def err(*args):
@@ -13,56 +12,62 @@ def err(*args):
     sys.stderr.write('%s\n' % ' '.join(map(str, args)))
 
 
-def slurp_stats(full_fn, m):
-    """mmap parsing mainloop"""
-    reader = mmstats_reader.MmStatsReader(m)
+def read_stats(fn):
+    """Return (filename, list of stats, None) or (filename, None,
+    traceback) if it can't be read"""
+    try:
+        r = mmstats_reader.LayoutReader.from_mmap(fn)
+        try:
+            return fn, r.read(), None
+        finally:
+            r.close()
+    except Exception:
+        return fn, None, traceback.format_exc()
 
-    print '==>', full_fn
-    out = []
-    label_max = 0
-    for label, value in reader:
-        if len(label) > label_max:
-            label_max = len(label)
-        out.append((label, value))
 
-    for label, value in out:
+def print_stats(full_fn, stats):
+    """Print a file's list of label, value pairs"""
+    print '==>', full_fn
+    label_max = max([len(label) for label, _ in stats] or [0])
+    for label, value in stats:
         if isinstance(value, str):
             value = value.split('\x00', 1)[0]
-        print ('  %-' + str(label_max) + 's %s') % (label, value)
+        line = ('  %-' + str(label_max) + 's %s') % (label, value)
+        if isinstance(line, unicode):
+            line = line.encode('utf8')
+        print line
     print
 
 
 def main():
     """MmStats CLI Entry point"""
     # Accept paths and dirs to read as mmstats files from the command line
-    stats_files = set()
+    stats_files = []
+    seen = set()
     for arg in sys.argv[1:]:
-        stats_files.add(arg)
+        if arg not in seen:
+            seen.add(arg)
+            stats_files.append(arg)
 
     # Only read from tempdir if no files specified on the command line
     if not stats_files:
         stats_files = glob.glob(defaults.DEFAULT_GLOB)
 
-    for fn in stats_files:
-        with open(fn) as f:
-            mmst = None
-            try:
-                mmst = mmap.mmap(f.fileno(), 0, prot=mmap.ACCESS_READ)
-                slurp_stats(fn, mmst)
-            except IOError as ex:
-                if ex.errno == errno.EPIPE:
-                    # A broken pipe (probably) means the process was killed
-                    # while piped to another command (e.g.: grep) - so die
-                    return
-                else:
-                    err('Error reading: %s' % fn)
-                    err(traceback.format_exc())
-            except Exception:
-                err('Error reading: %s' % fn)
-                err(traceback.format_exc())
-            finally:
-                if mmst is not None:
-                    mmst.close()
+    # Files are read in parallel but printed in order
+    for fn, stats, error in scan.imap(read_stats, stats_files, ordered=True):
+        if stats is None:
+            err('Error reading: %s' % fn)
+            err(error)
+            continue
+        try:
+            print_stats(fn, stats)
+        except IOError as ex:
+            if ex.errno == errno.EPIPE:
+                # A broken pipe (probably) means the process was killed
+                # while piped to another command (e.g.: grep) - so die
+                return
+            err('Error reading: %s' % fn)
+            err(traceback.format_exc())
 
 
 if __name__ == '__main__':
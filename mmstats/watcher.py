@@ -0,0 +1,224 @@
+"""Keeps a live registry of open mmstats files matching a glob
+
+Tools which read the same files repeatedly can share a :class:`Watcher`
+instead of globbing and opening every file on every read.
+"""
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import glob
+import os
+import struct
+import threading
+import time
+
+from . import defaults, reader
+
+
+# Linux consts from /usr/include/sys/inotify.h
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO |
+               IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+# Events which invalidate every file and require a rescan
+_RESCAN_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+_event = struct.Struct('iIII')
+
+
+class Inotify(object):
+    """Minimal non-blocking inotify watch of a single directory"""
+
+    def __init__(self, path, mask=_WATCH_MASK):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if libc.inotify_add_watch(self.fd, path, mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, 'inotify_add_watch failed: %s' % path)
+
+    def read(self):
+        """Return a list of pending (mask, name) events without blocking"""
+        events = []
+        while 1:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return events
+                raise
+            pos = 0
+            while pos < len(data):
+                _, mask, _, name_sz = _event.unpack_from(data, pos)
+                pos += _event.size
+                events.append(
+                    (mask, data[pos:pos + name_sz].split('\x00', 1)[0]))
+                pos += name_sz
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher(object):
+    """Registry of :class:`~mmstats.reader.LayoutReader` for every file
+    matching `pattern`
+
+    Call :meth:`update` before reading to add new files and drop removed,
+    replaced, or truncated ones. On Linux the pattern's directory is watched
+    with inotify so updates cost no syscalls unless files changed. Otherwise
+    (or with ``inotify=False``) the pattern is rescanned at most every
+    `poll_interval` seconds.
+
+    Files which can't be read yet, such as files still being initialized by
+    their writer, are retried on every update.
+
+    Watchers are threadsafe.
+    """
+
+    def __init__(self, pattern=None,
+                 poll_interval=defaults.DEFAULT_WATCH_INTERVAL, inotify=True):
+        if pattern is None:
+            pattern = defaults.DEFAULT_GLOB
+        self.pattern = pattern
+        self.directory, self.file_pattern = os.path.split(pattern)
+        self.poll_interval = poll_interval
+        #: filename -> LayoutReader
+        self.readers = {}
+        # filename -> (inode, size) when opened
+        self._stats = {}
+        # Matching files which couldn't be read yet
+        self._pending = set()
+        self._last_scan = 0
+        self._lock = threading.RLock()
+
+        self._inotify = None
+        if inotify and not glob.has_magic(self.directory):
+            try:
+                self._inotify = Inotify(self.directory or '.')
+            except (AttributeError, OSError):
+                # No inotify (not Linux or out of watches), so poll
+                pass
+        self.rescan()
+
+    @property
+    def using_inotify(self):
+        return self._inotify is not None
+
+    def fileno(self):
+        """Return the inotify file descriptor, which is readable when
+        :meth:`update` has changes to apply, or None if polling"""
+        if self._inotify is None:
+            return None
+        return self._inotify.fd
+
+    def _open(self, fn):
+        """Open `fn` replacing any existing reader"""
+        self._drop(fn)
+        try:
+            st = os.stat(fn)
+            r = reader.LayoutReader.from_mmap(fn)
+        except Exception:
+            self._pending.add(fn)
+            return
+        self._pending.discard(fn)
+        self.readers[fn] = r
+        self._stats[fn] = (st.st_ino, st.st_size)
+
+    def _drop(self, fn):
+        r = self.readers.pop(fn, None)
+        if r is not None:
+            r.close()
+        self._stats.pop(fn, None)
+        self._pending.discard(fn)
+
+    def _check(self, fn):
+        """Reopen `fn` if it was replaced or resized"""
+        try:
+            st = os.stat(fn)
+        except OSError:
+            self._drop(fn)
+            return
+        if self._stats.get(fn) != (st.st_ino, st.st_size):
+            self._open(fn)
+
+    def rescan(self):
+        """Synchronize the registry with the files matching the pattern"""
+        with self._lock:
+            self._last_scan = time.time()
+            current = set(glob.glob(self.pattern))
+            for fn in (set(self.readers) | self._pending) - current:
+                self._drop(fn)
+            for fn in current:
+                if fn in self.readers:
+                    self._check(fn)
+                else:
+                    self._open(fn)
+
+    def update(self):
+        """Apply any changes to the watched files since the last update"""
+        with self._lock:
+            if self._inotify is None:
+                if time.time() - self._last_scan >= self.poll_interval:
+                    self.rescan()
+                return
+
+            changed = set()
+            for mask, name in self._inotify.read():
+                if mask & _RESCAN_MASK:
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                        # Directory is gone so fallback to polling
+                        self._inotify.close()
+                        self._inotify = None
+                    self.rescan()
+                    return
+                if fnmatch.fnmatch(name, self.file_pattern):
+                    changed.add(os.path.join(self.directory, name))
+            for fn in changed:
+                if not os.path.exists(fn):
+                    self._drop(fn)
+                elif fn in self.readers:
+                    self._check(fn)
+                else:
+                    self._open(fn)
+            for fn in list(self._pending - changed):
+                self._open(fn)
+
+    def read(self, labels=None, prefixes=None):
+        """Return a list of (filename, stats) for every readable file
+
+        `labels` and `prefixes` select fields like
+        :meth:`~mmstats.reader.LayoutReader.read`.
+        """
+        results = []
+        with self._lock:
+            for fn, r in self.readers.iteritems():
+                try:
+                    stats = r.read(labels, prefixes)
+                except Exception:
+                    # Probably being reinitialized by its writer
+                    continue
+                results.append((fn, stats))
+        return results
+
+    def close(self):
+        """Close every file and stop watching"""
+        with self._lock:
+            for fn in list(self.readers):
+                self._drop(fn)
+            self._pending.clear()
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
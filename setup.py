@@ -42,6 +42,7 @@ setup(
     ext_modules=exts,
     test_suite='tests',
     install_requires=requirements,
+    extras_require={'numpy': ['numpy'], 'asyncio': ['trollius']},
     classifiers=['License :: OSI Approved :: Apache Software License'],
     # It might actually be zip-safe, I just hate eggs. File an issue or pull
     # request if mmstats is actually zip_safe and you care
@@ -2,6 +2,7 @@ import unittest
 
 import glob
 import os
+import time
 
 import mmstats
 
@@ -11,6 +12,18 @@ class MmstatsTestCase(unittest.TestCase):
     def files(self):
         return glob.glob(os.path.join(self.path, 'test*.mmstats'))
 
+    def wait_for(self, func, timeout=5.0):
+        """Wait for `func` to return True
+
+        Thread local state is released after join() returns, so tests for
+        thread exit behavior need to wait for it.
+        """
+        deadline = time.time() + timeout
+        while not func():
+            if time.time() > deadline:
+                self.fail('Timed out waiting for %s' % func.__name__)
+            time.sleep(0.001)
+
     def setUp(self):
         super(MmstatsTestCase, self).setUp()
         self.path = mmstats.DEFAULT_PATH
@@ -31,3 +44,30 @@ class MmstatsTestCase(unittest.TestCase):
                 pass
             except OSError:
                 continue
+
+
+class WorkerStats(mmstats.BaseMmStats):
+    worker = mmstats.UIntField()
+    requests = mmstats.CounterField()
+
+
+class WorkersTestCase(MmstatsTestCase):
+    """Creates 6 worker files and an invalid file matching `self.pattern`
+
+    Each worker's requests counter is twice its worker number.
+    """
+    prefix = 'test-workers'
+
+    def setUp(self):
+        super(WorkersTestCase, self).setUp()
+        self.pattern = os.path.join(self.path, '%s-*.mmstats' % self.prefix)
+        self.stats = []
+        for i in range(6):
+            s = WorkerStats(filename='%s-%d.mmstats' % (self.prefix, i))
+            s.worker = i
+            s.requests.incr(i * 2)
+            self.stats.append(s)
+        self.invalid = os.path.join(self.path,
+                                    '%s-invalid.mmstats' % self.prefix)
+        with open(self.invalid, 'wb') as f:
+            f.write('\x07garbage')
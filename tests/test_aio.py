@@ -0,0 +1,68 @@
+from . import base
+
+import unittest
+
+from mmstats import aio
+
+
+@unittest.skipUnless(aio.asyncio, 'requires asyncio or trollius')
+class TestAio(base.WorkersTestCase):
+    prefix = 'test-aio'
+
+    def setUp(self):
+        super(TestAio, self).setUp()
+        self.loop = aio.asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        super(TestAio, self).tearDown()
+
+    def run_until_complete(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_snapshot_all(self):
+        results = dict(self.run_until_complete(aio.snapshot_all(
+            self.pattern, labels=['requests'], batch_size=2, loop=self.loop)))
+        self.assertEqual(results, dict((s.filename, {'requests': s.worker * 2})
+                                       for s in self.stats))
+        self.assertEqual(self.run_until_complete(
+            aio.snapshot_all([], loop=self.loop)), [])
+
+    def test_scan(self):
+        it = aio.AsyncScan(self.pattern, labels=['worker'], batch_size=2,
+                           loop=self.loop)
+        results = {}
+        while 1:
+            try:
+                fn, stats = self.run_until_complete(it.fetch())
+            except aio.StopAsyncIteration:
+                break
+            results[fn] = stats
+        self.assertEqual(results, dict((s.filename, [('worker', s.worker)])
+                                       for s in self.stats))
+
+    def test_watcher(self):
+        for inotify in (True, False):
+            w = aio.AsyncWatcher(self.pattern, poll_interval=0.01,
+                                 inotify=inotify, loop=self.loop)
+            try:
+                # Scanned in the executor
+                self.assertEqual(w.readers, {})
+                self.run_until_complete(w.started())
+                self.assertTrue(self.stats[0].filename in w.readers)
+                new = base.WorkerStats(filename='test-aio-new-%s.mmstats' % inotify)
+                self.run_until_complete(w.wait())
+                self.assertTrue(new.filename in w.readers)
+                results = dict(self.run_until_complete(
+                    w.read(labels=['requests'])))
+                self.assertEqual(results[new.filename], [('requests', 0)])
+            finally:
+                w.close()
+
+    def test_watcher_close_before_start(self):
+        w = aio.AsyncWatcher(self.pattern, inotify=False, loop=self.loop)
+        w.close()
+        self.run_until_complete(w.started())
+        # Closed once the scan finished
+        self.run_until_complete(aio.asyncio.sleep(0, loop=self.loop))
+        self.assertEqual(w.readers, {})
@@ -0,0 +1,73 @@
+from . import base
+
+import unittest
+
+import mmstats
+from mmstats import bulk
+
+
+class BulkStats(mmstats.MmStats):
+    requests = mmstats.CounterField()
+    depth = mmstats.UIntField()
+    flag = mmstats.BoolField()
+    name = mmstats.StringField(size=8)
+
+
+class OtherStats(mmstats.BaseMmStats):
+    other = mmstats.DoubleField()
+
+
+@unittest.skipIf(bulk.numpy is None, 'NumPy not installed')
+class TestBulk(base.MmstatsTestCase):
+    def test_read_tables(self):
+        stats = []
+        for i in range(5):
+            s = BulkStats(filename='test-bulk-%d.mmstats' % i)
+            s.requests.incr(i)
+            for _ in range(i):
+                # Flip the write buffer a varying number of times
+                s.depth = i * 10
+            s.flag = bool(i % 2)
+            s.name = 'w%d' % i
+            stats.append(s)
+        o = OtherStats(filename='test-bulk-other.mmstats')
+        o.other = 1.5
+
+        tables = bulk.read_tables(sorted(self.files))
+        self.assertEqual(sorted(len(t) for t in tables), [1, 5])
+        table = [t for t in tables if len(t) == 5][0]
+        other = [t for t in tables if len(t) == 1][0]
+
+        order = [int(fn.rsplit('-', 1)[1].split('.')[0])
+                 for fn in table.files]
+        self.assertEqual(list(table.column('requests')), order)
+        self.assertEqual(table.column('requests').sum(), 10)
+        self.assertEqual(table.values[:, table.index('depth')].max(), 40)
+        self.assertEqual(list(table.column('flag')), [i % 2 for i in order])
+        self.assertEqual(list(table.column('name')),
+                         ['w%d' % i for i in order])
+        self.assertEqual(list(other.column('other')), [1.5])
+
+    def test_precision(self):
+        """Integers beyond float64's precision are kept exact"""
+        s = BulkStats(filename='test-bulk-0.mmstats')
+        s.requests.incr(2 ** 63 + 1)
+        table = bulk.read_tables(self.files)[0]
+        self.assertEqual(table.column('requests').dtype.kind, 'u')
+        self.assertEqual(table.column('requests')[0], 2 ** 63 + 1)
+        self.assertEqual(table.values[0, table.index('requests')],
+                         2 ** 63 + 1)
+        self.assertEqual(table.values[0, table.index('depth')], 0)
+
+    def test_float_values(self):
+        BulkStats(filename='test-bulk-0.mmstats').requests.incr(7)
+        table = bulk.read_tables(self.files)[0]
+        self.assertEqual(table.values.dtype, 'float64')
+        self.assertEqual(table.values[0, table.index('requests')], 7.0)
+
+    def test_skips_invalid(self):
+        BulkStats(filename='test-bulk-0.mmstats')
+        with open(self.path + '/test-bulk-bad.mmstats', 'wb') as f:
+            f.write('\x09garbage')
+        tables = bulk.read_tables(self.files + ['/nonexistent.mmstats'])
+        self.assertEqual([len(t) for t in tables], [1])
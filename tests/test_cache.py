@@ -0,0 +1,101 @@
+from . import base
+
+import os
+import threading
+
+import mmstats
+from mmstats import cache, reader
+
+
+class CachedStats(mmstats.BaseMmStats):
+    requests = mmstats.CounterField()
+
+
+class TestReaderCache(base.MmstatsTestCase):
+    def test_hits(self):
+        a = CachedStats(filename='test-cache-a.mmstats')
+        c = cache.ReaderCache()
+        r = c.get(a.filename)
+        a.requests.incr()
+        self.assertTrue(c.get(a.filename) is r)
+        self.assertEqual(c.read(a.filename, labels=['requests']),
+                         [('requests', 1)])
+        metrics = c.metrics()
+        self.assertEqual((metrics['hits'], metrics['misses']), (2, 1))
+        self.assertEqual(metrics['hit_rate'], 2 / 3.0)
+        c.clear()
+        self.assertEqual(len(c), 0)
+
+    def test_stale(self):
+        a = CachedStats(filename='test-cache-a.mmstats')
+        c = cache.ReaderCache()
+        r = c.get(a.filename)
+
+        # Replaced files are reopened
+        os.remove(a.filename)
+        b = CachedStats(filename='test-cache-a.mmstats')
+        b.requests.incr(3)
+        r2 = c.get(b.filename)
+        self.assertFalse(r2 is r)
+        self.assertEqual(dict(r2.read())['requests'], 3)
+
+        # As are resized files
+        with open(b.filename, 'r+b') as f:
+            f.truncate(10)
+        self.assertRaises(Exception, c.get, b.filename)
+        self.assertEqual(c.metrics()['stale'], 2)
+        self.assertEqual(len(c), 0)
+
+    def test_eviction(self):
+        files = [CachedStats(filename='test-cache-%d.mmstats' % i).filename
+                 for i in range(3)]
+        c = cache.ReaderCache(max_size=2)
+        for fn in files:
+            c.get(fn)
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.metrics()['evictions'], 1)
+        # The least recently used file was evicted
+        c.get(files[2])
+        c.get(files[0])
+        self.assertEqual(c.metrics()['misses'], 4)
+
+        os.remove(files[2])
+        c.prune()
+        self.assertEqual(len(c), 1)
+
+    def test_evicted_while_reading(self):
+        """Readers evicted mid-read are closed once the read is done"""
+        a, b = [CachedStats(filename='test-cache-%s.mmstats' % n).filename
+                for n in 'ab']
+        c = cache.ReaderCache(max_size=1)
+        r = c._get(a, True)
+        c.get(b)
+        self.assertEqual(c.metrics()['evictions'], 1)
+        # Still open
+        self.assertEqual(dict(r.read())['requests'], 0)
+        c._release(r)
+        self.assertRaises(ValueError, r.read)
+
+    def test_open_unlocked(self):
+        """Files are opened without holding the cache's lock"""
+        a = CachedStats(filename='test-cache-a.mmstats')
+        c = cache.ReaderCache()
+        locked = []
+        from_mmap = reader.LayoutReader.__dict__['from_mmap']
+
+        def check_lock(fn):
+            def acquire():
+                acquired = c._lock.acquire(False)
+                if acquired:
+                    c._lock.release()
+                locked.append(not acquired)
+            t = threading.Thread(target=acquire)
+            t.start()
+            t.join()
+            return from_mmap.__get__(None, reader.LayoutReader)(fn)
+        reader.LayoutReader.from_mmap = staticmethod(check_lock)
+        try:
+            self.assertEqual(c.read(a.filename), [('requests', 0)])
+        finally:
+            reader.LayoutReader.from_mmap = from_mmap
+        self.assertEqual(locked, [False])
@@ -0,0 +1,56 @@
+from . import base
+
+import glob
+import os
+import StringIO
+import subprocess
+import sys
+import threading
+
+import mmstats
+from mmstats import clean
+
+
+class TestClean(base.MmstatsTestCase):
+    def setUp(self):
+        super(TestClean, self).setUp()
+        self.stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        super(TestClean, self).tearDown()
+
+    def dead_pid(self):
+        p = subprocess.Popen(['true'])
+        p.wait()
+        return p.pid
+
+    def test_pooled_pid(self):
+        self.assertEqual(clean.pooled_pid('/tmp/.a-1-2.mmstats.123.pool'), 123)
+        self.assertEqual(clean.pooled_pid('/tmp/a-1-2.mmstats'), None)
+        self.assertEqual(clean.pooled_pid('/tmp/.a.mmstats.pool'), None)
+
+    def test_pooled_files(self):
+        """Files pooled by dead processes are removed"""
+        class PoolStats(mmstats.MmStats):
+            requests = mmstats.CounterField()
+
+        s = PoolStats(filename='test-clean-{PID}-{TID}.mmstats', pool_size=1)
+        t = threading.Thread(target=lambda: s.requests.incr())
+        t.start()
+        t.join()
+        pool_glob = os.path.join(self.path, '.test-clean-*.pool')
+        self.wait_for(lambda: glob.glob(pool_glob))
+        pooled = glob.glob(pool_glob)[0]
+        self.assertTrue(pooled in list(clean.pooled_files(s.filename)))
+        self.assertEqual(clean.pooled_pid(pooled), os.getpid())
+
+        leaked = os.path.join(self.path, '.test-clean-1-2.mmstats.%d.pool'
+                              % self.dead_pid())
+        with open(leaked, 'wb') as f:
+            f.write('\x00' * 64)
+        clean.clean([pooled, leaked])
+        self.assertTrue(os.path.exists(pooled))
+        self.assertFalse(os.path.exists(leaked))
+        s.remove()
+        self.assertFalse(os.path.exists(pooled))
@@ -1,10 +1,13 @@
 from . import base
 
+import glob
+import os
+import struct
 import threading
 import uuid
 
 import mmstats
-from mmstats import _mmap
+from mmstats import _mmap, reader
 
 
 class TestMmStats(base.MmstatsTestCase):
@@ -57,6 +60,69 @@ class TestMmStats(base.MmstatsTestCase):
         # Did they all die?
         assert len(self.files) == 0
 
+    def test_thread_exit_cleanup(self):
+        """Per-thread files are removed automatically when threads exit"""
+        class ChurnStats(mmstats.MmStats):
+            requests = mmstats.CounterField()
+
+        s = ChurnStats(filename='test-thread-exit-{PID}-{TID}.mmstats',
+                       pool_size=0)
+
+        def work():
+            s.requests.incr()
+
+        batch = 100
+        for _ in range(10000 // batch):
+            threads = [threading.Thread(target=work) for _ in range(batch)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            # Only the main thread's file should remain
+            self.assertTrue(len(self.files) <= batch + 1, len(self.files))
+
+        def main_file_only():
+            return self.files == [s.filename]
+        self.wait_for(main_file_only)
+        s.remove()
+        self.assertEqual(len(self.files), 0)
+
+    def test_thread_file_pool(self):
+        """Files of exited threads are reused by new threads"""
+        class PoolStats(mmstats.MmStats):
+            requests = mmstats.CounterField()
+
+        s = PoolStats(filename='test-pool-{PID}-{TID}.mmstats', pool_size=2)
+        results = []
+        pool_glob = os.path.join(self.path, '.test-pool-*.pool')
+
+        def pooled():
+            return len(glob.glob(pool_glob)) == 1
+
+        def work():
+            s.requests.incr()
+            results.append((s.filename, s._mm_ptr, s.tid,
+                            dict(reader.MmStatsReader.from_mmap(s.filename))))
+
+        for _ in range(5):
+            t = threading.Thread(target=work)
+            t.start()
+            t.join()
+            self.wait_for(pooled)
+
+        # Every thread after the first reuses the first thread's mmap
+        self.assertEqual(len(set(ptr for _, ptr, _, _ in results)), 1)
+        for fn, _, tid, stats in results:
+            self.assertEqual(stats['requests'], 1)
+            self.assertEqual(stats['sys.tid'], tid)
+        self.assertEqual(len(set(fn for fn, _, _, _ in results)), 5)
+        self.assertEqual(self.files, [s.filename])
+
+        # Removing the model releases pooled files
+        s.remove()
+        self.assertEqual(len(self.files), 0)
+        self.assertEqual(glob.glob(pool_glob), [])
+
     def test_tls(self):
         """MmStats instances are unique per thread"""
         class ScienceStats(mmstats.MmStats):
@@ -173,3 +239,48 @@ class TestMmStats(base.MmstatsTestCase):
         self.assertTrue(isinstance(ChildBStats.a, mmstats.BoolField))
         self.assertTrue(isinstance(ChildBStats.b, mmstats.BoolField))
         self.assertTrue(isinstance(ChildBStats.c, mmstats.BoolField))
+
+    def test_submodels(self):
+        """Embedded models share their parent's mmap"""
+        class DBStats(mmstats.BaseMmStats):
+            queries = mmstats.CounterField()
+            slow = mmstats.UIntField(label='queries.slow')
+
+        class CacheStats(mmstats.BaseMmStats):
+            hits = mmstats.UIntField()
+            db = mmstats.SubModel(DBStats, label_prefix='backend.')
+
+        class AppStats(mmstats.MmStats):
+            requests = mmstats.UIntField()
+            db = mmstats.SubModel(DBStats)
+            cache = mmstats.SubModel(CacheStats)
+
+        s = AppStats(filename='test-submodels.mmstats', label_prefix='app.')
+        self.assertEqual(len(self.files), 1)
+        raw = s._mmap[:]
+        for label in ('app.requests', 'app.db.queries', 'app.db.queries.slow',
+                      'app.cache.hits', 'app.cache.backend.queries'):
+            self.assertTrue(struct.pack('=H', len(label)) + label in raw,
+                            label)
+
+        s.requests = 1
+        s.db.queries.incr()
+        s.db.slow = 2
+        s.cache.hits = 3
+        s.cache.db.queries.incr(4)
+        self.assertEqual(s.requests, 1)
+        self.assertEqual(s.db.queries.value, 1)
+        self.assertEqual(s.db.slow, 2)
+        self.assertEqual(s.cache.hits, 3)
+        self.assertEqual(s.cache.db.queries.value, 4)
+        self.assertEqual(s.cache.db.slow, 0)
+        self.assertEqual(s.db.filename, s.filename)
+
+        stats = dict(reader.MmStatsReader.from_mmap(s.filename))
+        self.assertEqual(stats['app.db.queries'], 1)
+        self.assertEqual(stats['app.cache.backend.queries'], 4)
+
+        # Removing an embedded model removes the whole file
+        s.cache.remove()
+        self.assertEqual(len(self.files), 0)
+        self.assertRaises(Exception, getattr, s, 'db')
@@ -0,0 +1,252 @@
+from . import base
+
+import curses
+import itertools
+import json
+import os
+import StringIO
+import sys
+
+import mmstats
+from mmstats import pollstats
+
+
+class PollModel(mmstats.BaseMmStats):
+    requests = mmstats.CounterField()
+    depth = mmstats.IntField()
+    role = mmstats.StringField(size=8)
+
+
+class FakeClock(object):
+    """Monotonic clock which only advances when told to or slept on"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class PollStatsTestCase(base.MmstatsTestCase):
+    def setUp(self):
+        super(PollStatsTestCase, self).setUp()
+        self.stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        super(PollStatsTestCase, self).tearDown()
+
+    def output(self):
+        return sys.stdout.getvalue()
+
+    def poll(self, *argv):
+        args = pollstats.opts.parse_args(list(argv) + [
+            os.path.join(self.path, 'test-poll-*.mmstats')])
+        return pollstats.PollStats(args)
+
+
+class TestTicks(PollStatsTestCase):
+    def ticks(self, durations, delay='1'):
+        """Returns the clock time of each tick when reading takes
+        `durations` seconds"""
+        clock = FakeClock()
+        start = clock.now
+        times = []
+        ticks = self.poll('-o', 'csv', '-d', delay, 'requests').ticks(
+            clock, clock.sleep)
+        for tick, duration in itertools.izip(ticks, durations):
+            times.append((tick, clock.now - start))
+            clock.now += duration
+        return times
+
+    def test_no_drift(self):
+        times = self.ticks([0.3] * 5)
+        self.assertEqual(times, [(i, float(i)) for i in range(5)])
+
+    def test_fractional(self):
+        times = self.ticks([0.1] * 4, delay='0.25')
+        self.assertEqual(times, [(i, i * 0.25) for i in range(4)])
+
+    def test_skipped_ticks(self):
+        # The second read overruns two ticks
+        times = self.ticks([0.5, 2.5, 0.5, 0.5])
+        self.assertEqual(times, [(0, 0.0), (1, 1.0), (2, 4.0), (3, 5.0)])
+
+    def test_exact_overrun(self):
+        # A read ending exactly on the next tick doesn't skip it
+        times = self.ticks([1.0, 1.0, 1.0])
+        self.assertEqual(times, [(0, 0.0), (1, 1.0), (2, 2.0)])
+
+    def test_invalid_delay(self):
+        stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+        try:
+            for delay in ('0', '-1', 'nan', 'soon'):
+                self.assertRaises(SystemExit, pollstats.opts.parse_args,
+                                  ['-d', delay, 'requests', 'x.mmstats'])
+        finally:
+            sys.stderr = stderr
+        p = self.poll('-o', 'csv', 'requests')
+        p.args.delay = 0
+        self.assertRaises(ValueError, next, p.ticks())
+
+
+class TestOutput(PollStatsTestCase):
+    def setUp(self):
+        super(TestOutput, self).setUp()
+        self.clock = FakeClock()
+        self.stats = {}
+        self.add('a', 'web', 5)
+        self.add('b', 'web', 1)
+
+    def add(self, name, role, requests):
+        s = PollModel(filename='test-poll-%s.mmstats' % name)
+        s.role = role
+        s.requests.incr(requests)
+        self.stats[name] = s
+        return s
+
+    def poll(self, *argv):
+        p = super(TestOutput, self).poll(*argv)
+        p.time = lambda: self.clock.now + 1000
+        p.clock = self.clock
+        return p
+
+    def tick(self, p, seconds=2):
+        p.read_once()
+        self.clock.now += seconds
+
+    def test_csv(self):
+        p = self.poll('-o', 'csv', 'requests,depth')
+        self.tick(p)
+        self.stats['a'].requests.incr(3)
+        self.stats['b'].depth = -2
+        self.tick(p)
+        self.assertEqual(self.output(), 'time,requests,depth\n'
+                                        '1100.0,6,0\n'
+                                        '1102.0,3,-2\n')
+
+    def test_csv_grouped_rates(self):
+        p = self.poll('-o', 'csv', '-g', 'role', '-r', '-a', 'max',
+                      'requests')
+        self.add('c', 'db', 10)
+        self.tick(p)
+        self.stats['a'].requests.incr(8)
+        self.stats['c'].requests.incr(1)
+        self.tick(p)
+        self.assertEqual(self.output(), 'time,role,requests\n'
+                                        '1100.0,db,10\n'
+                                        '1100.0,web,5\n'
+                                        '1102.0,db,0.5\n'
+                                        '1102.0,web,4.0\n')
+
+    def test_csv_group_changing(self):
+        p = self.poll('-o', 'csv', '-g', 'role', 'requests')
+        self.tick(p)
+        # String group labels are re-read every tick
+        self.stats['b'].role = 'db'
+        self.stats['b'].requests.incr(2)
+        self.tick(p)
+        self.assertEqual(self.output(), 'time,role,requests\n'
+                                        '1100.0,web,6\n'
+                                        '1102.0,db,2\n'
+                                        '1102.0,web,0\n')
+
+    def test_json_files_changing(self):
+        p = self.poll('-o', 'json', '-g', 'file', 'requests')
+        a, b = [self.stats[n].filename for n in 'ab']
+        self.tick(p)
+        # b exits and c starts between ticks
+        self.stats.pop('b').remove()
+        c = self.add('c', 'db', 10).filename
+        self.stats['a'].requests.incr(2)
+        self.tick(p)
+        self.stats['c'].requests.incr(4)
+        self.tick(p)
+
+        lines = self.output().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'time': 1100.0, 'file': a, 'requests': 5},
+            {'time': 1100.0, 'file': b, 'requests': 1},
+            # c has nothing to compare to until the next tick
+            {'time': 1102.0, 'file': a, 'requests': 2},
+            {'time': 1104.0, 'file': a, 'requests': 0},
+            {'time': 1104.0, 'file': c, 'requests': 4},
+        ])
+        # Compact objects without spaces
+        self.assertEqual(lines[0].count(' '), 0)
+
+
+class TestRenderFrame(base.MmstatsTestCase):
+    result = {'web': {'app.requests': 10, 'app.latency': 0.5},
+              'db': {'app.requests': 30, 'app.latency': 2.25},
+              u'cache\xe9': {'app.requests': 20}}
+    fields = ['app.requests', 'app.latency']
+
+    def render(self, **kwargs):
+        return pollstats.render_frame(self.result, self.fields, 'role',
+                                      'app.', width=10, **kwargs)
+
+    def rows(self, frame):
+        """Returns the text of every row below the headers"""
+        rows = sorted(set(row for row, _ in frame if row > 1))
+        return [[frame[(row, col)][0] for col in (0, 10, 20)]
+                for row in rows]
+
+    def test_frame(self):
+        frame = self.render()
+        self.assertEqual(frame[(0, 0)][0].rstrip(),
+                         'pollstats: 3 roles  desc  filter: -  [<>] sort '
+                         '[r]everse [/] filter [q]uit')
+        self.assertEqual(frame[(1, 0)], ('   role  ', curses.A_BOLD))
+        # Prefixes are left out of headers and the sort column is reversed
+        self.assertEqual(frame[(1, 10)], (' requests', curses.A_REVERSE))
+        self.assertEqual(frame[(1, 20)], (' latency ', curses.A_BOLD))
+        self.assertEqual(self.rows(frame), [
+            ['db       ', '       30', '     2.25'],
+            ['cache\xc3\xa9  ', '       20', '        0'],
+            ['web      ', '       10', '     0.50'],
+        ])
+
+    def test_sort_and_filter(self):
+        frame = self.render(sort_column=0, descending=False)
+        self.assertEqual([r[0].strip() for r in self.rows(frame)],
+                         ['cache\xc3\xa9', 'db', 'web'])
+        self.assertEqual(frame[(1, 0)][1], curses.A_REVERSE)
+
+        frame = self.render(sort_column=2, group_filter='b')
+        self.assertEqual([r[0].strip() for r in self.rows(frame)],
+                         ['db', 'web'])
+        self.assertTrue('2 roles  desc  filter: b' in frame[(0, 0)][0])
+
+    def test_height(self):
+        # Groups past the bottom of the screen are left out
+        self.assertEqual(len(self.rows(self.render(height=4))), 2)
+        self.assertEqual(self.rows(self.render(height=2)), [])
+
+    def test_truncated(self):
+        frame = pollstats.render_frame(
+            {'/tmp/mmstats/worker-12345.mmstats': {'a': 1}}, ['a'], 'file',
+            width=10)
+        # The end of long groups is shown
+        self.assertEqual(frame[(2, 0)][0], '5.mmstats')
+
+
+class TestCommandName(base.MmstatsTestCase):
+    def test_default_filename(self):
+        self.assertEqual(pollstats.command_name(
+            '/tmp/mmstats/app-worker.py-123-124.mmstats', 123),
+            'app-worker.py')
+
+    def test_other_filename(self):
+        self.assertEqual(pollstats.command_name('/tmp/x.mmstats', None),
+                         'x.mmstats')
+        if os.path.exists('/proc/self/comm'):
+            with open('/proc/self/comm') as f:
+                comm = f.read().rstrip('\n')
+            self.assertEqual(
+                pollstats.command_name('/tmp/x.mmstats', os.getpid()), comm)
@@ -0,0 +1,62 @@
+from . import base
+
+import os
+import threading
+import warnings
+
+import mmstats
+from mmstats import process, reader
+
+
+class TestProcessStats(base.MmstatsTestCase):
+    def setUp(self):
+        super(TestProcessStats, self).setUp()
+        # The interval is shared by every ProcessStats instance
+        interval = process.process_source.interval
+        requested = process._requested_interval
+
+        def restore():
+            process.process_source.interval = interval
+            process._requested_interval = requested
+        self.addCleanup(restore)
+
+    def test_sample(self):
+        sample = process.sample_process()
+        self.assertTrue(sample['cpu.user'] >= 0)
+        self.assertTrue('gc.objects.gen0' in sample)
+        if os.path.exists('/proc/self/stat'):
+            self.assertTrue(sample['rss'] > 0)
+            self.assertTrue(sample['fds'] > 0)
+            self.assertEqual(sample['threads'], threading.active_count())
+            self.assertTrue(sample['ctx_switches.voluntary'] >= 0)
+
+    def test_process_stats(self):
+        s = mmstats.ProcessStats(filename='test-process.mmstats',
+                                 interval=0.01)
+
+        def sampled():
+            return s.cpu_user > 0 and s.rss > 0
+
+        self.wait_for(sampled)
+        stats = dict(reader.MmStatsReader.from_mmap(s.filename))
+        self.assertEqual(stats['sys.pid'], os.getpid())
+        self.assertTrue(stats['sys.rss'] > 0)
+        self.assertTrue('org.python.gc.objects.gen0' in stats)
+        s.remove()
+
+    def test_conflicting_intervals(self):
+        a = mmstats.ProcessStats(filename='test-process-a.mmstats',
+                                 interval=0.5)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            # The same interval or none at all is fine
+            b = mmstats.ProcessStats(filename='test-process-b.mmstats',
+                                     interval=0.5)
+            c = mmstats.ProcessStats(filename='test-process-c.mmstats')
+            self.assertEqual(caught, [])
+            d = mmstats.ProcessStats(filename='test-process-d.mmstats',
+                                     interval=2)
+        self.assertEqual([w.category for w in caught], [RuntimeWarning])
+        self.assertEqual(process.process_source.interval, 2)
+        for s in (a, b, c, d):
+            s.remove()
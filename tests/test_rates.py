@@ -0,0 +1,138 @@
+from . import base
+
+import mmstats
+from mmstats import rates, reader
+
+
+class RateStats(mmstats.BaseMmStats):
+    requests = mmstats.CounterField()
+    small = mmstats.Counter32Field()
+    connections = mmstats.UIntField()
+    bytes = mmstats.UInt64Field()
+    depth = mmstats.IntField()
+    name = mmstats.StringField()
+
+
+class RatesTests(object):
+    def setUp(self):
+        super(RatesTests, self).setUp()
+        self.readers = {}
+
+    def tearDown(self):
+        for r in self.readers.itervalues():
+            r.close()
+        super(RatesTests, self).tearDown()
+
+    def stats(self, name):
+        s = RateStats(filename='test-rates-%s.mmstats' % name)
+        self.readers[s.filename] = reader.LayoutReader.from_mmap(s.filename)
+        return s
+
+    def sample(self, time):
+        return rates.Sample.from_readers(self.readers, time=time)
+
+    def test_deltas(self):
+        a, b = self.stats('a'), self.stats('b')
+        a.requests.incr(5)
+        b.requests.incr(1)
+        prev = self.sample(10)
+        self.assertEqual(prev.totals()['requests'], 6)
+
+        a.requests.incr(10)
+        b.requests.incr(2)
+        a.depth = -3
+        d = rates.deltas(prev, self.sample(12))
+        self.assertEqual(d.elapsed, 2)
+        self.assertEqual(d.totals(),
+                         {'requests': 12, 'small': 0, 'connections': 0,
+                          'bytes': 0, 'depth': -3})
+        self.assertEqual(d.rates()['requests'], 6.0)
+        self.assertEqual(d.by_file()[a.filename]['requests'], 10)
+        self.assertTrue('name' not in d.by_file()[a.filename])
+
+    def test_files_changing(self):
+        a, b = self.stats('a'), self.stats('b')
+        prev = self.sample(0)
+        a.requests.incr(1)
+        b.requests.incr(100)
+        del self.readers[b.filename]
+        c = self.stats('c')
+        c.requests.incr(1000)
+        d = rates.deltas(prev, self.sample(1))
+        self.assertEqual(d.files, [a.filename])
+        self.assertEqual(d.totals()['requests'], 1)
+
+    def test_reset(self):
+        a = self.stats('a')
+        a.requests.value = 100
+        a.small.value = 100
+        prev = self.sample(0)
+        # Restarted writer
+        a.requests.value = 3
+        a.small.value = 4
+        d = rates.deltas(prev, self.sample(1))
+        self.assertEqual(d.totals()['requests'], 3)
+        self.assertEqual(d.totals()['small'], 4)
+        self.assertEqual(d.resets['requests'], 1)
+        self.assertEqual(d.resets['small'], 1)
+
+    def test_wraparound(self):
+        a = self.stats('a')
+        a.small.value = 2 ** 32 - 5
+        prev = self.sample(0)
+        a.small.incr(8)
+        self.assertEqual(a.small.value, 3)
+        d = rates.deltas(prev, self.sample(1))
+        self.assertEqual(d.totals()['small'], 8)
+        self.assertEqual(d.resets['small'], 0)
+
+    def test_gauges(self):
+        """Unsigned gauges aren't counters so they may decrease"""
+        a = self.stats('a')
+        a.connections = 2 ** 32 - 5
+        a.bytes = 2 ** 63 + 5
+        prev = self.sample(0)
+        a.connections = 3
+        a.bytes = 5
+        d = rates.deltas(prev, self.sample(1))
+        self.assertEqual(d.totals()['connections'], 3 - (2 ** 32 - 5))
+        self.assertEqual(d.totals()['bytes'], -2 ** 63)
+        self.assertEqual(d.resets['connections'], 0)
+
+    def test_aggregate(self):
+        files = [self.stats(name) for name in 'abc']
+        prev = self.sample(0)
+        for s, n in zip(files, (1, 5, 10)):
+            s.requests.incr(n)
+        cur = self.sample(2)
+        self.assertEqual(cur.aggregate('max')[None]['requests'], 10)
+
+        d = rates.deltas(prev, cur)
+        for how, expected in (('sum', 16), ('avg', 16 / 3.0), ('min', 1),
+                              ('max', 10), ('p50', 5), ('p75', 7.5)):
+            self.assertEqual(d.aggregate(how)[None]['requests'], expected)
+        self.assertEqual(d.aggregate('sum', per_second=True)[None]['requests'],
+                         8.0)
+
+        groups = {files[0].filename: 'x', files[1].filename: 'x',
+                  files[2].filename: 'y'}
+        grouped = d.aggregate('max', groups)
+        self.assertEqual(sorted(grouped), ['x', 'y'])
+        self.assertEqual(grouped['x']['requests'], 5)
+        self.assertEqual(grouped['y']['requests'], 10)
+        self.assertRaises(ValueError, d.aggregate, 'median')
+        self.assertRaises(ValueError, d.aggregate, 'p101')
+
+
+class TestRates(RatesTests, base.MmstatsTestCase):
+    pass
+
+
+class TestPythonRates(RatesTests, base.MmstatsTestCase):
+    def setUp(self):
+        super(TestPythonRates, self).setUp()
+        self.numpy, rates.numpy = rates.numpy, None
+
+    def tearDown(self):
+        rates.numpy = self.numpy
+        super(TestPythonRates, self).tearDown()
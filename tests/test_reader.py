@@ -0,0 +1,349 @@
+from . import base
+
+import ctypes
+import os
+import struct
+import threading
+import time
+
+import mmstats
+from mmstats import reader
+
+
+class ReaderStats(mmstats.MmStats):
+    counter = mmstats.CounterField()
+    uint = mmstats.UIntField()
+    short = mmstats.ShortField()
+    flag = mmstats.BoolField(initial=True)
+    text = mmstats.StringField(size=10)
+    avg = mmstats.AverageField()
+    double = mmstats.DoubleField()
+
+
+class TestLayoutReader(base.MmstatsTestCase):
+    def stats(self, **kwargs):
+        kwargs.setdefault('filename', 'test-reader.mmstats')
+        s = ReaderStats(**kwargs)
+        s.counter.incr(3)
+        s.uint = 7
+        s.short = -2
+        s.text = u'\u2764 ok'
+        s.avg.add(1.5)
+        s.double = 0.25
+        return s
+
+    def test_matches_streaming_reader(self):
+        s = self.stats()
+        expected = list(reader.MmStatsReader.from_mmap(s.filename))
+        r = reader.LayoutReader.from_mmap(s.filename)
+        self.assertEqual(r.read(), expected)
+        self.assertEqual(list(r), expected)
+        self.assertEqual(dict(r)['text'], u'\u2764 ok')
+        self.assertEqual(dict(r)['flag'], True)
+        r.close()
+
+    def test_rereads_values(self):
+        s = self.stats()
+        r = reader.LayoutReader.from_mmap(s.filename)
+        layout = r.layout
+        s.counter.incr()
+        s.uint = 8
+        s.uint = 9
+        values = dict(r.read())
+        self.assertEqual(values['counter'], 4)
+        self.assertEqual(values['uint'], 9)
+        # Layout was not reparsed
+        self.assertTrue(r.layout is layout)
+        r.close()
+
+    def test_layout_change(self):
+        s = self.stats()
+        r = reader.LayoutReader.from_mmap(s.filename)
+
+        class OtherStats(mmstats.BaseMmStats):
+            other = mmstats.UIntField()
+
+        # Recreate the file in place with a different layout
+        o = OtherStats(filename='test-reader.mmstats')
+        o.other = 5
+        self.assertFalse(r.layout.valid(r.data))
+        self.assertEqual(r.read(), [('other', 5)])
+        r.close()
+
+    def test_select(self):
+        s = self.stats()
+        r = reader.LayoutReader.from_mmap(s.filename)
+        self.assertEqual(r.read(labels=['uint', 'text']),
+                         [('uint', 7), ('text', u'\u2764 ok')])
+        self.assertEqual(dict(r.read(prefixes=['sys.pid', 'sys.u'])),
+                         {'sys.pid': os.getpid(), 'sys.uid': os.getuid()})
+        self.assertEqual(r.read(labels=['missing']), [])
+        self.assertEqual(r.snapshot(labels=['counter'], prefixes=['avg']),
+                         {'counter': 3, 'avg': 1.5})
+
+        # Selections are cached and validate like their layout
+        selection = r.layout.select(['uint'])
+        self.assertTrue(r.layout.select(['uint']) is selection)
+        self.assertTrue(selection.valid(r.data))
+        self.assertEqual(selection.fingerprint, r.layout.fingerprint)
+        r.close()
+
+    def test_invalid_version(self):
+        self.assertRaises(reader.InvalidMmStatsVersion,
+                          reader.parse_layout, '\x03\x00\x00')
+
+
+class TornBuffer(bytearray):
+    """Returns a stale copy for the first full copy to simulate a writer
+    flipping buffers while it's copied
+    """
+    stale = None
+
+    def __getitem__(self, key):
+        if (isinstance(key, slice) and key.start is None and
+                self.stale is not None):
+            stale, self.stale = self.stale, None
+            return stale
+        return bytearray.__getitem__(self, key)
+
+
+class TestSnapshot(base.MmstatsTestCase):
+    def test_snapshot(self):
+        s = ReaderStats(filename='test-snapshot.mmstats')
+        s.uint = 3
+        s.text = 'hi'
+        expected = dict(reader.MmStatsReader.from_mmap(s.filename))
+        self.assertEqual(reader.snapshot(s.filename), expected)
+        r = reader.LayoutReader.from_mmap(s.filename)
+        self.assertEqual(r.snapshot(), expected)
+        r.close()
+
+    def test_torn_fields_reread(self):
+        s = ReaderStats(filename='test-snapshot.mmstats')
+        s.uint = 1
+        layout = reader.parse_layout(s._mmap)
+        stale = s._mmap[:layout.end]
+        s.uint = 2
+
+        buf = TornBuffer(s._mmap[:])
+        buf.stale = stale
+        values = layout.snapshot(buf)
+        self.assertEqual(values['uint'], 2)
+        self.assertEqual(values['counter'], 0)
+
+
+class TestLayoutFingerprint(base.MmstatsTestCase):
+    def test_fingerprint(self):
+        a = ReaderStats(filename='test-fingerprint-a.mmstats')
+        b = ReaderStats(filename='test-fingerprint-b.mmstats')
+        c = ReaderStats(filename='test-fingerprint-c.mmstats',
+                        label_prefix='c.')
+        fa, fb, fc = [reader.read_fingerprint(s._mmap) for s in (a, b, c)]
+        self.assertTrue(fa)
+        self.assertEqual(fa, fb)
+        self.assertNotEqual(fa, fc)
+
+        # Writers and readers agree on the fingerprint
+        self.assertEqual(reader.parse_layout(a._mmap).fingerprint, fa)
+        # but it isn't a stat
+        stats = dict(reader.MmStatsReader.from_mmap(a.filename))
+        self.assertFalse(reader.LAYOUT_LABEL in stats)
+        r = reader.LayoutReader.from_mmap(a.filename)
+        self.assertFalse(reader.LAYOUT_LABEL in dict(r.read()))
+        self.assertFalse(reader.LAYOUT_LABEL in r.snapshot())
+        r.close()
+
+    def test_shared_layouts(self):
+        a = ReaderStats(filename='test-fingerprint-a.mmstats')
+        b = ReaderStats(filename='test-fingerprint-b.mmstats')
+        b.uint = 2
+        ra = reader.LayoutReader.from_mmap(a.filename)
+        rb = reader.LayoutReader.from_mmap(b.filename)
+        self.assertTrue(ra.layout is rb.layout)
+        self.assertEqual(dict(rb)['uint'], 2)
+        ra.close()
+        rb.close()
+
+    def test_no_fingerprint(self):
+        """Files without a fingerprint are still read and validated"""
+        buf = ('\x01' + struct.pack('=H1sH1sBI', 1, 'a', 1, 'I', 255, 7) +
+               '\x00\x00')
+        self.assertEqual(reader.read_fingerprint(buf), None)
+        layout = reader.get_layout(buf)
+        self.assertTrue(layout.valid(buf))
+        self.assertEqual(reader.LayoutReader(buf).read(), [('a', 7)])
+
+
+class TestVersion2(base.MmstatsTestCase):
+    def stats(self, **kwargs):
+        s = ReaderStats(**kwargs)
+        s.uint = 7
+        s.text = 'v2'
+        s.avg.add(2.0)
+        return s
+
+    def test_readers(self):
+        v1 = self.stats(filename='test-v1.mmstats')
+        v2 = self.stats(filename='test-v2.mmstats', version=2)
+        self.assertEqual(v2._mmap[0], reader.VERSION_2)
+
+        # Everything but the creation time matches version 1
+        expected = dict(reader.MmStatsReader.from_mmap(v1.filename))
+        streamed = dict(reader.MmStatsReader.from_mmap(v2.filename))
+        del expected['sys.created'], streamed['sys.created']
+        self.assertEqual(streamed, expected)
+
+        r = reader.LayoutReader.from_mmap(v2.filename)
+        self.assertEqual(r.layout.version, reader.VERSION_2)
+        self.assertTrue(r.layout.valid(r.data))
+        self.assertEqual(dict(r.read())['uint'], 7)
+        r.close()
+
+    def test_tracked_stream(self):
+        """MmStatsReader skips the change flags of tracked files"""
+        s = self.stats(filename='test-v2.mmstats', version=2,
+                       track_changes=True)
+        expected = reader.LayoutReader.from_mmap(s.filename)
+        streamed = list(reader.MmStatsReader.from_mmap(s.filename))
+        self.assertEqual(streamed, expected.read())
+        self.assertEqual(dict(streamed)['uint'], 7)
+        expected.close()
+
+    def test_header(self):
+        s = self.stats(filename='test-v2.mmstats', version=2)
+        count, end = struct.unpack_from('=II', s._mmap, 1)
+        layout = reader.parse_layout(s._mmap)
+        # The count includes the hidden fingerprint field
+        self.assertEqual(count, len(layout) + layout.hidden)
+        self.assertEqual(end, layout.end)
+        self.assertEqual(layout.fields[0].start,
+                         reader.header_size(2, count) +
+                         reader.LAYOUT_RECORD_SIZE)
+
+    def test_find_field(self):
+        v1 = self.stats(filename='test-v1.mmstats')
+        v2 = self.stats(filename='test-v2.mmstats', version=2)
+        for s in (v1, v2):
+            for field in reader.parse_layout(s._mmap).fields:
+                self.assertEqual(reader.find_field(s._mmap, field.label),
+                                 field)
+            self.assertEqual(reader.find_field(s._mmap, 'missing'), None)
+            self.assertEqual(reader.read_value(s._mmap, 'uint'), 7)
+            self.assertEqual(reader.read_value(s._mmap, u'text'), u'v2')
+            self.assertEqual(reader.read_value(s._mmap, 'avg'), 2.0)
+            self.assertRaises(KeyError, reader.read_value, s._mmap, 'missing')
+
+    def test_hash_collisions(self):
+        record = struct.Struct('=H1sH1sBI')
+        buf = bytearray(reader.header_size(2, 2) + record.size * 2)
+        buf[0] = reader.VERSION_2
+        offsets = [reader.header_size(2, 2),
+                   reader.header_size(2, 2) + record.size]
+        record.pack_into(buf, offsets[0], 1, 'a', 1, 'I', 255, 1)
+        record.pack_into(buf, offsets[1], 1, 'b', 1, 'I', 255, 2)
+        # Index b under a's hash before a
+        hash_ = reader.label_hash('a')
+        struct.pack_into('=IIIIIII', buf, 1, 2, len(buf), 0,
+                         hash_, offsets[1], hash_, offsets[0])
+        buf = str(buf)
+        self.assertEqual(reader.find_field(buf, 'a').start, offsets[0])
+        self.assertEqual(reader.read_value(buf, 'a'), 1)
+
+    def test_invalid_version(self):
+        self.assertRaises(ValueError, ReaderStats,
+                          filename='test-v3.mmstats', version=3)
+
+
+class ChangeStats(mmstats.BaseMmStats):
+    counter = mmstats.CounterField()
+    uint = mmstats.UIntField()
+    flag = mmstats.BoolField()
+    text = mmstats.StringField(size=10)
+    recent = mmstats.RingArrayField(ctypes.c_uint32, 3)
+
+
+class TestChanges(base.MmstatsTestCase):
+    def stats(self):
+        return ChangeStats(filename='test-changes.mmstats', version=2,
+                           track_changes=True)
+
+    def test_consume_changes(self):
+        s = self.stats()
+        r = reader.LayoutReader.from_mmap(s.filename, writable=True)
+        # Everything is new the first time
+        self.assertEqual(len(r.read_changes()), len(r.layout))
+        self.assertEqual(r.read_changes(), [])
+
+        s.uint = 5
+        s.counter.incr()
+        self.assertEqual(sorted(r.read_changes()),
+                         [('counter', 1), ('uint', 5)])
+        self.assertEqual(r.read_changes(), [])
+
+        s.flag = True
+        s.text = 'hi'
+        s.recent.append(3)
+        self.assertEqual(sorted(r.read_changes()),
+                         [('flag', True), ('recent', [3]), ('text', u'hi')])
+        r.close()
+
+    def test_compare_generations(self):
+        s = self.stats()
+        r = reader.LayoutReader.from_mmap(s.filename)
+        generation = reader.read_changes(r.data)[0]
+        self.assertEqual(len(r.read_changes()), len(r.layout))
+        self.assertEqual(r.read_changes(), [])
+        s.uint = 5
+        self.assertEqual(reader.read_changes(r.data)[0], generation + 1)
+        # Read only readers can't tell which fields changed
+        self.assertEqual(dict(r.read_changes())['uint'], 5)
+        self.assertEqual(r.read_changes(), [])
+        r.close()
+
+    def test_untracked(self):
+        s = ChangeStats(filename='test-changes.mmstats', version=2)
+        r = reader.LayoutReader.from_mmap(s.filename)
+        self.assertEqual(reader.read_changes(r.data), None)
+        self.assertEqual(len(r.read_changes()), len(r.layout))
+        self.assertEqual(len(r.read_changes()), len(r.layout))
+        r.close()
+
+        self.assertRaises(ValueError, ChangeStats,
+                          filename='test-changes.mmstats', track_changes=True)
+
+
+class TestChangeWaiter(base.MmstatsTestCase):
+    def test_wait(self):
+        tracked = ChangeStats(filename='test-wait-a.mmstats', version=2,
+                              track_changes=True)
+        untracked = ChangeStats(filename='test-wait-b.mmstats')
+        readers = [reader.LayoutReader.from_mmap(s.filename)
+                   for s in (tracked, untracked)]
+        waiter = reader.ChangeWaiter(readers)
+        self.assertEqual(waiter.changed(), [])
+        self.assertEqual(waiter.wait(timeout=0.01), [])
+
+        # Wait in another thread as models must be written by the thread
+        # that created them
+        waiting = threading.Event()
+        changed = []
+
+        def wait():
+            waiting.set()
+            changed.extend(waiter.wait(timeout=5))
+        t = threading.Thread(target=wait)
+        t.start()
+        waiting.wait(5)
+        time.sleep(0.05)
+        start = time.time()
+        tracked.uint = 1
+        t.join(5)
+        self.assertEqual(changed, [readers[0]])
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(dict(readers[0].read())['uint'], 1)
+
+        untracked.counter.incr()
+        self.assertEqual(waiter.wait(timeout=5), [readers[1]])
+        self.assertEqual(waiter.changed(), [])
+        for r in readers:
+            r.close()
@@ -0,0 +1,45 @@
+from . import base
+
+from mmstats import cache, scan
+
+
+class TestScan(base.WorkersTestCase):
+    prefix = 'test-scan'
+
+    def scanned(self, **kwargs):
+        return dict(scan.scan(self.pattern, **kwargs))
+
+    def test_scan(self):
+        for kwargs in ({'workers': 1}, {'workers': 3},
+                       {'workers': 2, 'processes': True}):
+            results = self.scanned(**kwargs)
+            self.assertEqual(len(results), 7)
+            self.assertEqual(results.pop(self.invalid), None)
+            for s in self.stats:
+                stats = dict(results[s.filename])
+                self.assertEqual(stats['requests'], s.worker * 2)
+
+    def test_labels(self):
+        results = self.scanned(labels=['worker'], workers=2)
+        self.assertEqual(results[self.stats[3].filename], [('worker', 3)])
+
+    def test_ordered(self):
+        files = [s.filename for s in reversed(self.stats)]
+        results = scan.imap(scan._read_file,
+                            [(fn, None, None, None) for fn in files],
+                            workers=3, ordered=True)
+        self.assertEqual([fn for fn, _ in results], files)
+
+    def test_stop_early(self):
+        results = scan.scan([s.filename for s in self.stats], workers=2)
+        self.assertEqual(len(next(results)), 2)
+        results.close()
+
+    def test_cache(self):
+        c = cache.ReaderCache()
+        for _ in range(2):
+            results = self.scanned(workers=2, cache=c)
+            self.assertEqual(results.pop(self.invalid), None)
+            self.assertEqual(len(results), 6)
+        self.assertEqual(c.metrics()['hits'], 6)
+        self.assertRaises(ValueError, scan.scan, [], cache=c, processes=True)
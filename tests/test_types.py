@@ -6,6 +6,7 @@ import warnings
 from . import base
 
 import mmstats
+from mmstats import models, reader, sampler
 
 
 class TestTypes(base.MmstatsTestCase):
@@ -295,3 +296,166 @@ class TestTypes(base.MmstatsTestCase):
         stats.t1.stop()
         self.assertTrue(stats.t1.last < last)
         self.assertTrue(stats.t1.value < oldval)
+
+    def test_disabled(self):
+        class BareStats(mmstats.BaseMmStats):
+            a = mmstats.UIntField()
+
+        class DebugStats(BareStats):
+            b = mmstats.CounterField(enabled=False)
+            t = mmstats.TimerField(enabled=False)
+            s = mmstats.StringField(enabled=False)
+            d = mmstats.DoubleField(label='debug.d')
+
+        bare = BareStats(filename='test-disabled-bare.mmstats')
+        debug = DebugStats(filename='test-disabled-debug.mmstats',
+                disabled=['debug.*'])
+        self.assertEqual(debug._offset, bare._offset)
+        for label in ('\x01\x00b\x01', '\x01\x00t\x01', '\x01\x00s\x01',
+                      'debug.d'):
+            self.assertTrue(label not in debug._mmap[:], label)
+
+        # Disabled fields are no-ops but still usable
+        debug.a = 1
+        debug.b.incr()
+        with debug.t:
+            pass
+        debug.t.add(1.0)
+        debug.s = 'x'
+        debug.d = 2.0
+        self.assertEqual(debug.a, 1)
+        self.assertEqual(debug.b.value, 0)
+        self.assertEqual(debug.t.value, 0)
+
+        # Disabled fields are plain attributes instead of descriptors
+        self.assertTrue(isinstance(debug, DebugStats))
+        self.assertFalse(hasattr(type(debug).__dict__['b'], '__set__'))
+        self.assertTrue(isinstance(DebugStats.b, mmstats.CounterField))
+
+        # enabled patterns override both the field's default and disabled
+        enabled = DebugStats(filename='test-disabled-enabled.mmstats',
+                disabled=['debug.*'], enabled=['b', 'debug.*'])
+        self.assertTrue('b\x02\x001Q' in enabled._mmap[:])
+        self.assertTrue('debug.d\x01\x00d' in enabled._mmap[:])
+        enabled.b.incr()
+        self.assertEqual(enabled.b.value, 1)
+
+    def test_disabled_env(self):
+        class EnvStats(mmstats.BaseMmStats):
+            a = mmstats.UIntField(label='debug.a')
+            b = mmstats.UIntField()
+
+        orig = models.DEFAULT_DISABLED
+        models.DEFAULT_DISABLED = 'x.*, debug.*'
+        try:
+            s = EnvStats(filename='test-disabled-env.mmstats')
+        finally:
+            models.DEFAULT_DISABLED = orig
+        self.assertTrue('debug.a' not in s._mmap[:])
+        self.assertTrue('b\x01\x00I' in s._mmap[:])
+
+    def test_callback_gauge(self):
+        calls = []
+
+        def queue_depth():
+            calls.append(1)
+            return len(calls)
+
+        class GaugeStats(mmstats.MmStats):
+            depth = mmstats.CallbackGaugeField(queue_depth, interval=0.01)
+            other = mmstats.CallbackGaugeField(lambda: 1.5, interval=0.01)
+
+        s = GaugeStats(filename='test-callback-gauge.mmstats')
+
+        def sampled():
+            return s.depth >= 3 and s.other == 1.5
+        self.wait_for(sampled)
+
+        self.assertRaises(AttributeError, setattr, s, 'depth', 1)
+
+        s.remove()
+        targets = sampler._sampler._targets.get(GaugeStats.depth.source)
+        self.assertEqual(targets, {})
+
+    def test_ring_array(self):
+        class RingStats(mmstats.MmStats):
+            recent = mmstats.RingArrayField(ctypes.c_uint32, 3)
+            latency = mmstats.RingArrayField(ctypes.c_double, 2)
+            after = mmstats.UIntField()
+
+        s = RingStats(filename='test-ring-array.mmstats')
+        s.after = 9
+        self.assertEqual(s.recent.values, [])
+        self.assertEqual(
+            dict(reader.MmStatsReader.from_mmap(s.filename))['recent'], [])
+
+        s.recent.append(1)
+        s.recent.append(2)
+        self.assertEqual(s.recent.values, [1, 2])
+        for i in xrange(3, 8):
+            s.recent.append(i)
+        s.latency.append(0.5)
+        self.assertEqual(s.recent.values, [5, 6, 7])
+        self.assertEqual(list(s.recent), [5, 6, 7])
+        self.assertEqual(len(s.recent), 3)
+
+        # Every reader returns values oldest first
+        expected = {'recent': [5, 6, 7], 'latency': [0.5], 'after': 9}
+        streamed = dict(reader.MmStatsReader.from_mmap(s.filename))
+        r = reader.LayoutReader.from_mmap(s.filename)
+        read = dict(r.read())
+        for label, value in expected.items():
+            self.assertEqual(streamed[label], value)
+            self.assertEqual(read[label], value)
+            self.assertEqual(reader.read_value(s._mmap, label), value)
+        r.close()
+
+    def test_ring_array_64bit(self):
+        """64-bit types are written with standard size codes"""
+        class RingStats(mmstats.MmStats):
+            recent = mmstats.RingArrayField(ctypes.c_uint64, 4)
+            signed = mmstats.RingArrayField(ctypes.c_long, 2)
+            after = mmstats.UIntField()
+
+        s = RingStats(filename='test-ring-array.mmstats')
+        for i in (1, 2, 3):
+            s.recent.append(i)
+        s.recent.append(2 ** 64 - 1)
+        s.signed.append(-2 ** 40)
+        s.after = 9
+        self.assertEqual(RingStats.recent.type_signature, 'Q')
+        self.assertEqual(RingStats.signed.type_signature,
+                         'q' if ctypes.sizeof(ctypes.c_long) == 8 else 'i')
+
+        expected = {'recent': [1, 2, 3, 2 ** 64 - 1], 'signed': [-2 ** 40],
+                    'after': 9}
+        if ctypes.sizeof(ctypes.c_long) == 4:
+            del expected['signed']
+        streamed = dict(reader.MmStatsReader.from_mmap(s.filename))
+        r = reader.LayoutReader.from_mmap(s.filename)
+        read = dict(r.read())
+        snapshot = r.snapshot()
+        for label, value in expected.items():
+            self.assertEqual(streamed[label], value)
+            self.assertEqual(read[label], value)
+            self.assertEqual(snapshot[label], value)
+            self.assertEqual(reader.read_value(s._mmap, label), value)
+        r.close()
+
+    def test_ring_array_size(self):
+        """Array sizes are part of the layout fingerprint"""
+        def model(size):
+            class RingStats(mmstats.BaseMmStats):
+                recent = mmstats.RingArrayField(ctypes.c_uint32, size)
+            return RingStats
+
+        a = model(2)(filename='test-ring-a.mmstats')
+        b = model(4)(filename='test-ring-b.mmstats')
+        self.assertNotEqual(reader.read_fingerprint(a._mmap),
+                            reader.read_fingerprint(b._mmap))
+        self.assertRaises(ValueError, mmstats.RingArrayField,
+                          ctypes.c_uint32, 0)
+        self.assertRaises(TypeError, mmstats.RingArrayField,
+                          ctypes.c_char * 3, 4)
+        self.assertRaises(TypeError, mmstats.RingArrayField,
+                          ctypes.c_char_p, 4)
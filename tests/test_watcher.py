@@ -0,0 +1,77 @@
+from . import base
+
+import os
+import sys
+import unittest
+
+import mmstats
+from mmstats import watcher
+
+
+class WatchedStats(mmstats.BaseMmStats):
+    requests = mmstats.CounterField()
+
+
+class WatcherTests(object):
+    inotify = True
+
+    def setUp(self):
+        super(WatcherTests, self).setUp()
+        self.w = watcher.Watcher(
+            os.path.join(self.path, 'test-watch-*.mmstats'),
+            poll_interval=0, inotify=self.inotify)
+
+    def tearDown(self):
+        self.w.close()
+        super(WatcherTests, self).tearDown()
+
+    def test_files(self):
+        a = WatchedStats(filename='test-watch-a.mmstats')
+        self.w.update()
+        self.assertEqual(list(self.w.readers), [a.filename])
+        reader = self.w.readers[a.filename]
+
+        # Unchanged files aren't reopened
+        b = WatchedStats(filename='test-watch-b.mmstats')
+        b.requests.incr(2)
+        WatchedStats(filename='test-other.mmstats')
+        self.w.update()
+        self.assertEqual(sorted(self.w.readers), [a.filename, b.filename])
+        self.assertTrue(self.w.readers[a.filename] is reader)
+        self.assertEqual(dict(self.w.read(labels=['requests'])),
+                         {a.filename: [('requests', 0)],
+                          b.filename: [('requests', 2)]})
+
+        a.remove()
+        self.w.update()
+        self.assertEqual(list(self.w.readers), [b.filename])
+
+    def test_pending(self):
+        fn = os.path.join(self.path, 'test-watch-new.mmstats')
+        with open(fn, 'wb') as f:
+            f.write('\x00' * 10)
+        self.w.update()
+        self.assertEqual(self.w.readers, {})
+
+        # Becomes readable once initialized
+        WatchedStats(filename='test-watch-new.mmstats')
+        self.w.update()
+        self.assertEqual(list(self.w.readers), [fn])
+
+    def test_truncated(self):
+        a = WatchedStats(filename='test-watch-a.mmstats')
+        self.w.update()
+        with open(a.filename, 'r+b') as f:
+            f.truncate(0)
+        self.w.update()
+        self.assertEqual(self.w.readers, {})
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify is Linux only')
+class TestInotifyWatcher(WatcherTests, base.MmstatsTestCase):
+    def test_using_inotify(self):
+        self.assertTrue(self.w.using_inotify)
+
+
+class TestPollingWatcher(WatcherTests, base.MmstatsTestCase):
+    inotify = False